@@ -0,0 +1,309 @@
+# benchmark.py
+# Reproducible CPU benchmarks for the inference scripts and the dataset tools.
+# Everything runs offline on synthetic data: images and YOLO labels are generated from a fixed seed,
+# the PyTorch model is built from a model yaml (random weights, same compute as trained weights) and
+# the ONNX model is exported from it locally.
+#
+#   python benchmarks/benchmark.py run --out results.json
+#   python benchmarks/benchmark.py run --suite tools --num-files 5000 --out tools.json
+#   python benchmarks/benchmark.py compare baseline.json results.json --threshold 0.1
+#
+# `compare` exits with status 1 when any metric regressed by more than the threshold.
+import argparse
+import contextlib
+import importlib.metadata
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'script'), os.path.join(ROOT, 'tools')]
+
+# metric name -> True when larger is better
+METRIC_DIRECTIONS = {
+    'latency_ms_p50': False,
+    'latency_ms_p95': False,
+    'latency_ms_p99': False,
+    'images_per_sec': True,
+    'files_per_sec': True,
+}
+
+
+# ------------------------------
+# Synthetic data
+# ------------------------------
+def make_image(rng: np.random.Generator, height: int, width: int) -> np.ndarray:
+    """Smooth noise with a few filled rectangles, so JPEG sizes and decode times look like real photos."""
+    small = rng.integers(0, 256, (max(height // 16, 1), max(width // 16, 1), 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+    for _ in range(rng.integers(1, 6)):
+        x1, y1 = int(rng.integers(0, width - 2)), int(rng.integers(0, height - 2))
+        x2, y2 = int(rng.integers(x1 + 1, width)), int(rng.integers(y1 + 1, height))
+        cv2.rectangle(image, (x1, y1), (x2, y2), tuple(int(c) for c in rng.integers(0, 256, 3)), -1)
+    return image
+
+
+def make_labels(rng: np.random.Generator, num_classes: int, max_boxes: int = 12) -> np.ndarray:
+    """(N, 5) [class, cx, cy, w, h] normalized boxes fully inside the image."""
+    n = int(rng.integers(0, max_boxes + 1))
+    wh = rng.uniform(0.02, 0.5, (n, 2))
+    centers = wh / 2 + rng.uniform(0, 1, (n, 2)) * (1 - wh)
+    return np.column_stack([rng.integers(0, num_classes, n), centers, wh])
+
+
+def make_dataset(root: str, num_files: int, num_classes: int = 10, image_size: int = 128,
+                 num_videos: int = 4, seed: int = 0) -> str:
+    """Flat YOLO dataset of `num_files` image/label pairs named like frames of `num_videos` videos
+    (flat because ClassFilter.filter_dataset and DatasetChecker only scan the top-level folder)."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(root, exist_ok=True)
+    for i in range(num_files):
+        stem = os.path.join(root, f"video{i % num_videos}_frame_{i:06d}")
+        cv2.imwrite(stem + '.jpg', make_image(rng, image_size, image_size))
+        labels = make_labels(rng, num_classes)
+        with open(stem + '.txt', 'w') as f:
+            f.write(''.join(f"{int(c)} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for c, x, y, w, h in labels))
+    return root
+
+
+# ------------------------------
+# Measurement
+# ------------------------------
+def time_calls(fn: Callable[[], None], runs: int, warmup: int) -> np.ndarray:
+    """Wall time in milliseconds of `runs` calls after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    times = np.empty(runs)
+    for i in range(runs):
+        start = time.perf_counter()
+        fn()
+        times[i] = (time.perf_counter() - start) * 1000
+    return times
+
+
+def latency_metrics(times_ms: np.ndarray, images_per_call: int) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(times_ms, [50, 95, 99])
+    return {'latency_ms_p50': float(p50), 'latency_ms_p95': float(p95), 'latency_ms_p99': float(p99),
+            'images_per_sec': float(images_per_call * len(times_ms) / (times_ms.sum() / 1000))}
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the per-file / per-step prints of the tools while they are timed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+# ------------------------------
+# Inference suite
+# ------------------------------
+def bench_inference(args, work_dir: str) -> List[Dict]:
+    import torch
+    from ultralytics import YOLO
+
+    from batch_prediction import FolderPredictor
+    from onnx_backend import OnnxDetector
+
+    rng = np.random.default_rng(args.seed)
+    frames = [make_image(rng, 480, 640) for _ in range(max(args.batch_sizes) * 2)]
+    folder = make_dataset(os.path.join(work_dir, 'frames'), args.folder_images, image_size=640, seed=args.seed)
+
+    model = YOLO(args.model)
+    onnx_path = None
+    if 'onnx' in args.backends:
+        # dynamic axes: one export serves every imgsz and batch size
+        with quiet():
+            exported = model.export(format='onnx', dynamic=True, simplify=False, imgsz=max(args.imgsz),
+                                    device='cpu')
+        onnx_path = shutil.move(str(exported), os.path.join(work_dir, 'model.onnx'))
+
+    results = []
+    for backend in args.backends:
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            for imgsz in args.imgsz:
+                detector = (OnnxDetector(onnx_path, imgsz=imgsz, intra_op_threads=threads,
+                                         max_batch=max(args.batch_sizes)) if backend == 'onnx' else None)
+                for batch in args.batch_sizes:
+                    images = frames[:batch]
+                    if backend == 'onnx':
+                        fn = lambda: detector.predict(images, conf=args.conf)
+                    else:
+                        fn = lambda: model.predict(images, imgsz=imgsz, conf=args.conf, device='cpu', verbose=False)
+                    times = time_calls(fn, args.runs, args.warmup)
+                    results.append(_entry('inference', backend=backend, imgsz=imgsz, batch=batch, threads=threads,
+                                          metrics=latency_metrics(times, batch)))
+                    print(_describe(results[-1]))
+
+                # end to end over a folder: decode + letterbox + inference + postprocess
+                predictor_model = onnx_path if backend == 'onnx' else args.model
+                with quiet():
+                    predictor = FolderPredictor(predictor_model, folder, img_size=imgsz, conf=args.conf,
+                                                device='cpu', backend=backend, onnx_threads=threads)
+                    predictor.run_batched(batch_size=max(args.batch_sizes))  # warm-up
+                    summary = predictor.run_batched(batch_size=max(args.batch_sizes))
+                results.append(_entry('folder', backend=backend, imgsz=imgsz, batch=max(args.batch_sizes),
+                                      threads=threads, metrics={'images_per_sec': summary['images_per_sec']}))
+                print(_describe(results[-1]))
+    return results
+
+
+# ------------------------------
+# Dataset tools suite
+# ------------------------------
+def bench_tools(args, work_dir: str) -> List[Dict]:
+    from class_filter import ClassFilter
+    from dataset_checker import DatasetChecker
+    from dataset_preparer import DatasetPreparer
+
+    source = make_dataset(os.path.join(work_dir, 'dataset_src'), args.num_files, num_classes=args.num_classes,
+                          seed=args.seed)
+    keep = list(range(0, args.num_classes, 2))
+    tools = {
+        'class_filter': lambda d: ClassFilter(d, keep, reencode=True).filter_dataset_parallel(workers=args.workers),
+        'dataset_checker': lambda d: DatasetChecker(d, keep).validate(workers=args.workers),
+        'dataset_preparer': lambda d: DatasetPreparer(d, os.path.join(work_dir, 'split'), 0.8, 0.2, 0.0,
+                                                      stratify=True, group_by='video', workers=args.workers).run(),
+    }
+
+    results = []
+    for name, fn in tools.items():
+        seconds = []
+        for _ in range(args.repeats):
+            # fresh copy every repeat: ClassFilter rewrites the labels in place
+            dataset = os.path.join(work_dir, 'dataset')
+            shutil.rmtree(dataset, ignore_errors=True)
+            shutil.copytree(source, dataset)
+            start = time.perf_counter()
+            with quiet():
+                fn(dataset)
+            seconds.append(time.perf_counter() - start)
+        results.append(_entry('tools', tool=name, files=args.num_files, workers=args.workers or os.cpu_count(),
+                              metrics={'files_per_sec': args.num_files / float(np.median(seconds))}))
+        print(_describe(results[-1]))
+    return results
+
+
+def _entry(suite: str, metrics: Dict[str, float], **params) -> Dict:
+    key = '/'.join([suite] + [f"{k}={v}" for k, v in params.items()])
+    return {'key': key, 'suite': suite, 'params': params, 'metrics': metrics}
+
+
+def _describe(entry: Dict) -> str:
+    metrics = ', '.join(f"{k}={v:.2f}" for k, v in entry['metrics'].items())
+    return f"{entry['key']}: {metrics}"
+
+
+def _environment() -> Dict:
+    versions = {}
+    for package in ('numpy', 'opencv-python', 'torch', 'onnxruntime', 'ultralytics'):
+        try:  # package metadata only, so a tools-only run never imports torch
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'versions': versions,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run(args) -> Dict:
+    work_dir = tempfile.mkdtemp(prefix='yolo_bench_')
+    try:
+        results = []
+        if args.suite in ('all', 'tools'):
+            results += bench_tools(args, work_dir)
+        if args.suite in ('all', 'inference'):
+            results += bench_inference(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'environment': _environment(), 'config': vars(args), 'results': results}
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Results written to {args.out}")
+    return report
+
+
+# ------------------------------
+# Comparison
+# ------------------------------
+def compare(baseline_path: str, current_path: str, threshold: float = 0.1) -> List[Dict]:
+    """
+    Compare two result files benchmark by benchmark.
+
+    Returns:
+        regressions: metrics that got worse by more than `threshold` (relative)
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = {r['key']: r for r in json.load(f)['results']}
+    with open(current_path, 'r') as f:
+        current = {r['key']: r for r in json.load(f)['results']}
+
+    regressions = []
+    print(f"{'benchmark':<70}{'metric':<16}{'baseline':>12}{'current':>12}{'change':>9}")
+    for key in sorted(baseline.keys() & current.keys()):
+        for metric, value in current[key]['metrics'].items():
+            base = baseline[key]['metrics'].get(metric)
+            if base is None or metric not in METRIC_DIRECTIONS or base == 0:
+                continue
+            change = (value - base) / base
+            worse = -change if METRIC_DIRECTIONS[metric] else change
+            flag = ' REGRESSION' if worse > threshold else ''
+            print(f"{key:<70}{metric:<16}{base:>12.2f}{value:>12.2f}{change:>+9.1%}{flag}")
+            if flag:
+                regressions.append({'key': key, 'metric': metric, 'baseline': base, 'current': value,
+                                    'change': change})
+
+    for key in sorted(baseline.keys() - current.keys()):
+        print(f"{key:<70}missing from the current run")
+    print(f"\n{len(regressions)} regressions above {threshold:.0%}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='CPU benchmarks for the inference scripts and dataset tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and save the results as JSON')
+    run_parser.add_argument('--suite', choices=('all', 'inference', 'tools'), default='all')
+    run_parser.add_argument('--out', default=None, help='JSON results file')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--model', default='yolov8n.yaml', help='model yaml (offline) or local .pt weights')
+    run_parser.add_argument('--backends', nargs='+', choices=('torch', 'onnx'), default=['torch', 'onnx'])
+    run_parser.add_argument('--imgsz', nargs='+', type=int, default=[320, 640])
+    run_parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 8])
+    run_parser.add_argument('--threads', nargs='+', type=int, default=[os.cpu_count()])
+    run_parser.add_argument('--conf', type=float, default=0.25)
+    run_parser.add_argument('--runs', type=int, default=30, help='timed calls per inference benchmark')
+    run_parser.add_argument('--warmup', type=int, default=3)
+    run_parser.add_argument('--folder-images', type=int, default=64, help='images for the FolderPredictor benchmark')
+    run_parser.add_argument('--num-files', type=int, default=2000, help='image/label pairs for the tools benchmark')
+    run_parser.add_argument('--num-classes', type=int, default=10)
+    run_parser.add_argument('--workers', type=int, default=None, help='pool size for the tools (None = all cores)')
+    run_parser.add_argument('--repeats', type=int, default=3, help='tool runs, the median is reported')
+
+    compare_parser = commands.add_parser('compare', help='flag regressions between two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as regression')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args)
+        return 0
+    return 1 if compare(args.baseline, args.current, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
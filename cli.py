@@ -0,0 +1,362 @@
+# cli.py
+# Single command-line entry point for the dataset tools (tools/) and the model scripts (script/).
+#   python cli.py split --dataset datasets/human_dataset --output-dir output --stratify --group-by video
+#   python cli.py train --config configs/train.yaml epochs=50 lr0=0.005
+# Every subcommand takes --config (YAML or JSON): a flat mapping of option names, or one section per
+# subcommand; options given on the command line override the file. Modules are imported inside the
+# subcommand that needs them, so dataset subcommands never load torch / ultralytics and start immediately.
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(ROOT, 'tools'), os.path.join(ROOT, 'script')]
+
+# options a subcommand cannot run without (not argparse-required, so a config file may provide them)
+REQUIRED = {
+    'filter': ('dataset', 'keep'),
+    'check': ('dataset', 'allowed'),
+    'split': ('dataset', 'output_dir'),
+    'view': ('dataset', 'output_dir'),
+    'stats': ('dataset',),
+    'predict': ('model', 'source'),
+    'batch-predict': ('model', 'source'),
+    'export': ('model',),
+    'train': ('model', 'data'),
+}
+
+
+# ------------------------------
+# Dataset subcommands (no torch)
+# ------------------------------
+def _index(args):
+    from dataset_index import DatasetIndex
+    return DatasetIndex(args.dataset, recursive=args.recursive) if args.index else None
+
+
+def cmd_filter(args):
+    from class_filter import ClassFilter
+    class_filter = ClassFilter(args.dataset, args.keep, reencode=args.reencode, remove_empty=args.remove_empty,
+                               index=_index(args))
+    class_filter.filter_dataset_parallel(workers=args.workers, chunk_size=args.chunk_size,
+                                         use_threads=args.threads, recursive=args.recursive)
+
+
+def cmd_check(args):
+    from dataset_checker import DatasetChecker
+    checker = DatasetChecker(args.dataset, args.allowed, index=_index(args))
+    issues = checker.validate(report_path=args.report, workers=args.workers, check_images=args.check_images,
+                              full_decode=args.full_decode)
+    if args.apply:
+        checker.apply_report(issues, action=args.apply, quarantine_dir=args.quarantine_dir)
+
+
+def cmd_split(args):
+    from dataset_preparer import DatasetPreparer
+    preparer = DatasetPreparer(args.dataset, args.output_dir, train_ratio=args.train_ratio, val_ratio=args.val_ratio,
+                               test_ratio=args.test_ratio, seed=args.seed, index=_index(args),
+                               stratify=args.stratify, group_by=args.group_by, workers=args.workers)
+    preparer.run()
+
+
+def cmd_view(args):
+    from dataset_view import DatasetView
+    from label_store import LabelStore
+    index = _index(args)
+    store = LabelStore.build(args.store or args.dataset.rstrip('/\\') + '_labels',
+                             dataset_dir=None if index else args.dataset, index=index, workers=args.workers)
+    view = DatasetView(store, keep_ids=args.keep, reencode=args.reencode, remove_empty=args.remove_empty,
+                       max_images_per_class=args.max_images_per_class, link=args.link, seed=args.seed, index=index)
+    splits = {name: path for name, path in (('train', args.train_list), ('val', args.val_list),
+                                            ('test', args.test_list)) if path}
+    view.create(args.output_dir, names=args.names, source_yaml=args.source_yaml, split_lists=splits or None,
+                overwrite=args.overwrite)
+
+
+def cmd_stats(args):
+    from dataset_index import DatasetIndex
+    from dataset_stats import DatasetStats
+    stats = DatasetStats(DatasetIndex(args.dataset, recursive=args.recursive),
+                         args.store or args.dataset.rstrip('/\\') + '_labels', names=args.names, workers=args.workers)
+    stats.compute(imgsz_candidates=args.imgsz, small_thresholds=args.small, num_anchors=args.anchors)
+    stats.print_summary()
+    if args.output:
+        stats.save(args.output, plot=args.plot)
+
+
+# ------------------------------
+# Model subcommands
+# ------------------------------
+def cmd_predict(args):
+    from predict import YOLODetector, is_image_source, is_live_source
+    detector = YOLODetector(args.model, backend=args.backend, onnx_threads=args.onnx_threads)
+    source = int(args.source) if args.source.isdigit() else args.source  # "0" = webcam
+    if is_image_source(source):
+        result = detector.predict(source, conf=args.conf, iou=args.iou, save=args.save, show=args.show,
+                                  device=args.device, classes=args.classes, imgsz=args.imgsz,
+                                  output_path=args.output)
+        if args.output:
+            print(result)
+        return
+
+    # videos, cameras and streams: frame by frame with constant memory (predict() would keep every result)
+    import cv2
+    from detection_writer import DetectionWriter
+    writer = DetectionWriter(args.output) if args.output else None
+    try:
+        for frame_id, frame, det in detector.stream(source, conf=args.conf, iou=args.iou, device=args.device,
+                                                    classes=args.classes, imgsz=args.imgsz,
+                                                    drop_frames=is_live_source(source)):
+            if writer is not None:
+                writer.write(f"{source}:{frame_id}", det)
+            if args.show:
+                cv2.imshow("YOLO", detector._draw(frame, det))
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+    finally:
+        if args.show:
+            cv2.destroyAllWindows()
+        if writer is not None:
+            writer.close()
+    print(detector.stream_stats.snapshot())
+
+
+def cmd_batch_predict(args):
+    from batch_prediction import FolderPredictor
+    predictor = FolderPredictor(model_path=args.model, source_folder=args.source, save_results=args.save,
+                                save_crops=args.save_crops, img_size=args.imgsz, conf=args.conf, iou=args.iou,
+                                device=args.device, backend=args.backend, onnx_threads=args.onnx_threads)
+    if args.videos:
+        predictor.run_videos(workers=args.video_workers, frame_stride=args.frame_stride,
+                             scene_threshold=args.scene_threshold, max_gap=args.max_gap,
+                             batch_size=args.batch_size, output_path=args.output)
+    elif args.batched or args.cache or args.output or args.tile_size or predictor.backend == 'onnx':
+        predictor.run_batched(batch_size=args.batch_size, decode_workers=args.decode_workers, cache_path=args.cache,
+                              output_path=args.output, tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                              tile_merge=args.tile_merge)
+    else:
+        predictor.run()
+
+
+def cmd_export(args):
+    from convert_to_onnx import OnnxExporter
+    exporter = OnnxExporter(args.model, imgsz=args.imgsz, dynamic=args.dynamic, opset=args.opset,
+                            simplify=args.simplify, batch=args.batch, val_list=args.val_list,
+                            calib_images=args.calib_images)
+    variants = exporter.export(fp16=args.fp16, int8=args.int8)
+    if args.compare:
+        exporter.compare(variants, data=args.data, report_path=args.report)
+
+
+def cmd_train(args):
+    import inspect
+    from train import YOLOTrainer
+    accepted = set(inspect.signature(YOLOTrainer.__init__).parameters) - {'self'}
+    kwargs = {key: getattr(args, key) for key in ('model', 'data', 'epochs', 'batch', 'imgsz', 'device', 'workers',
+                                                  'project', 'name', 'image_cache_dir', 'telemetry')
+              if getattr(args, key) is not None}
+    kwargs.update(args.trainer_options)  # from the config file
+    for override in args.overrides:
+        key, sep, value = override.partition('=')
+        if not sep:
+            raise SystemExit(f"Expected KEY=VALUE, got '{override}'")
+        kwargs[key.replace('-', '_')] = _parse_value(value)
+    unknown = set(kwargs) - accepted
+    if unknown:
+        raise SystemExit(f"Unknown YOLOTrainer arguments: {', '.join(sorted(unknown))}")
+
+    trainer = YOLOTrainer(**kwargs)
+    if args.autotune:
+        trainer.autotune()
+    print(trainer.train())
+
+
+# ------------------------------
+# Parser
+# ------------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Dataset tools and YOLO scripts')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add(name, func, help_text):
+        p = sub.add_parser(name, help=help_text, description=help_text)
+        p.add_argument('--config', help='YAML / JSON file with option values (command line wins)')
+        p.set_defaults(func=func)
+        return p
+
+    def dataset_options(p):
+        p.add_argument('--dataset', help='dataset root folder')
+        p.add_argument('--index', action=argparse.BooleanOptionalAction, default=True,
+                       help='use the persistent DatasetIndex (only changed files are re-read)')
+        p.add_argument('--recursive', action=argparse.BooleanOptionalAction, default=True)
+        p.add_argument('--workers', type=int, help='pool size (default: CPU count)')
+
+    p = add('filter', cmd_filter, 'Keep only some classes in the label files (rewrites the dataset)')
+    dataset_options(p)
+    p.add_argument('--keep', type=int, nargs='+', help='class ids to keep')
+    p.add_argument('--reencode', action='store_true', help='renumber kept classes 0..n-1')
+    p.add_argument('--remove-empty', action='store_true', help='delete images left without annotations')
+    p.add_argument('--chunk-size', type=int, default=512)
+    p.add_argument('--threads', action='store_true', help='thread pool instead of processes (network storage)')
+
+    p = add('check', cmd_check, 'Validate labels (and optionally images) and write a report')
+    dataset_options(p)
+    p.add_argument('--allowed', type=int, nargs='+', help='allowed class ids')
+    p.add_argument('--report', default='output/dataset_report.json', help='.json or .csv report')
+    p.add_argument('--check-images', action='store_true', help='also detect truncated / corrupt images')
+    p.add_argument('--full-decode', action='store_true', help='decode images fully instead of headers only')
+    p.add_argument('--apply', choices=('quarantine', 'delete'), help='act on the report (default: report only)')
+    p.add_argument('--quarantine-dir')
+
+    p = add('split', cmd_split, 'Write train/val/test image lists')
+    dataset_options(p)
+    p.add_argument('--output-dir', help='folder for train.txt / val.txt / test.txt')
+    p.add_argument('--train-ratio', type=float, default=0.8)
+    p.add_argument('--val-ratio', type=float, default=0.15)
+    p.add_argument('--test-ratio', type=float, default=0.05)
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--stratify', action='store_true', help='keep every class close to the ratios in each split')
+    p.add_argument('--group-by', choices=('folder', 'video'), help='keep related frames in one split')
+
+    p = add('view', cmd_view, 'Filtered dataset view with linked images and its own data.yaml')
+    dataset_options(p)
+    p.add_argument('--output-dir', help='view folder')
+    p.add_argument('--store', help='LabelStore folder (default: <dataset>_labels)')
+    p.add_argument('--keep', type=int, nargs='+', help='class ids to keep (default: all)')
+    p.add_argument('--reencode', action='store_true')
+    p.add_argument('--remove-empty', action='store_true')
+    p.add_argument('--max-images-per-class', type=int, help='class-balanced undersampling cap')
+    p.add_argument('--link', choices=('hardlink', 'symlink'), default='hardlink')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--names', nargs='+', help='class names by original id')
+    p.add_argument('--source-yaml', help='take class names from this data.yaml')
+    p.add_argument('--train-list')
+    p.add_argument('--val-list')
+    p.add_argument('--test-list')
+    p.add_argument('--overwrite', action='store_true')
+
+    p = add('stats', cmd_stats, 'Class, box size and small-object statistics, k-means anchors')
+    dataset_options(p)
+    p.add_argument('--store', help='LabelStore folder (default: <dataset>_labels)')
+    p.add_argument('--names', nargs='+')
+    p.add_argument('--imgsz', type=int, nargs='+', default=[320, 640, 1280], help='candidate imgsz values')
+    p.add_argument('--small', type=int, nargs='+', default=[8, 16, 32], help='small object thresholds (px)')
+    p.add_argument('--anchors', type=int, default=9, help='k-means clusters (0 = skip)')
+    p.add_argument('--output', help='JSON report path')
+    p.add_argument('--plot', action='store_true', help='also write <output>.png')
+
+    def model_options(p):
+        p.add_argument('--model', help='.pt / .yaml weights or an exported .onnx')
+        p.add_argument('--source', help='image, folder, video, stream URL or camera index')
+        p.add_argument('--backend', choices=('auto', 'torch', 'onnx'), default='auto')
+        p.add_argument('--onnx-threads', type=int)
+        p.add_argument('--imgsz', type=int, default=640)
+        p.add_argument('--conf', type=float, default=0.25)
+        p.add_argument('--iou', type=float, default=0.45)
+        p.add_argument('--device', help="'cpu', '0', '0,1'")
+        p.add_argument('--output', help='stream detections to a .parquet file / .npz folder')
+
+    p = add('predict', cmd_predict, 'Detect objects in images, videos or a camera')
+    model_options(p)
+    p.add_argument('--classes', type=int, nargs='+')
+    p.add_argument('--save', action=argparse.BooleanOptionalAction, default=True,
+                   help='save annotated images (image files / folders)')
+    p.add_argument('--show', action='store_true')
+
+    p = add('batch-predict', cmd_batch_predict, 'Batched prediction over an image or video folder')
+    model_options(p)
+    p.set_defaults(iou=0.7)  # FolderPredictor default
+    p.add_argument('--save', action='store_true', help='save annotated images')
+    p.add_argument('--save-crops', action='store_true')
+    p.add_argument('--batched', action='store_true', help='use the batched pipeline (implied by the options below)')
+    p.add_argument('--batch-size', type=int, default=16)
+    p.add_argument('--decode-workers', type=int)
+    p.add_argument('--cache', help='SQLite result cache (resumable runs)')
+    p.add_argument('--tile-size', type=int, help='sliced inference tile size')
+    p.add_argument('--tile-overlap', type=float, default=0.2)
+    p.add_argument('--tile-merge', choices=('nms', 'wbf'), default='nms')
+    p.add_argument('--videos', action='store_true', help='process the videos in the folder, in parallel')
+    p.add_argument('--video-workers', type=int, help='video processes (default: one per video, up to the CPU count)')
+    p.add_argument('--frame-stride', type=int, default=1, help='only every n-th frame is a candidate')
+    p.add_argument('--scene-threshold', type=float, help='process a candidate only on a scene change (e.g. 0.03)')
+    p.add_argument('--max-gap', type=int, help='with --scene-threshold, process at least every n frames')
+
+    p = add('export', cmd_export, 'Export to ONNX (optionally FP16 / INT8) and compare the variants')
+    p.add_argument('--model', help='.pt weights')
+    p.add_argument('--imgsz', type=int, default=640)
+    p.add_argument('--dynamic', action='store_true')
+    p.add_argument('--opset', type=int)
+    p.add_argument('--simplify', action=argparse.BooleanOptionalAction, default=True)
+    p.add_argument('--batch', type=int, default=1)
+    p.add_argument('--fp16', action='store_true')
+    p.add_argument('--int8', action='store_true')
+    p.add_argument('--val-list', help='val.txt for INT8 calibration and --compare')
+    p.add_argument('--calib-images', type=int, default=300)
+    p.add_argument('--compare', action='store_true', help='compare every variant with the PyTorch model')
+    p.add_argument('--data', help='data.yaml: add mAP to the comparison')
+    p.add_argument('--report', default='runs/export_report.json')
+
+    p = add('train', cmd_train, 'Train with YOLOTrainer (extra arguments as KEY=VALUE or in --config)')
+    p.add_argument('--model')
+    p.add_argument('--data')
+    p.add_argument('--epochs', type=int)
+    p.add_argument('--batch', type=float)
+    p.add_argument('--imgsz', type=int)
+    p.add_argument('--device')
+    p.add_argument('--workers', type=int)
+    p.add_argument('--project')
+    p.add_argument('--name')
+    p.add_argument('--image-cache-dir')
+    p.add_argument('--telemetry', action='store_true', default=None)
+    p.add_argument('--autotune', action='store_true', help='pick batch / workers for this machine first')
+    p.add_argument('overrides', nargs='*', metavar='KEY=VALUE', help='any other YOLOTrainer argument')
+    p.set_defaults(trainer_options={})
+    return parser, sub
+
+
+def load_config(path: str, command: str) -> dict:
+    """Options for `command` from a YAML / JSON file: its section named after the command, else the whole file."""
+    with open(path, 'r') as f:
+        if path.endswith('.json'):
+            config = json.load(f)
+        else:
+            import yaml
+            config = yaml.safe_load(f) or {}
+    section = config.get(command)
+    config = section if isinstance(section, dict) else config
+    return {key.replace('-', '_'): value for key, value in config.items()}
+
+
+def _parse_value(text: str):
+    """KEY=VALUE value: JSON scalars / lists (true, 0.01, [0, 1]) or Python booleans, otherwise the string."""
+    if text in ('True', 'False', 'None'):
+        return {'True': True, 'False': False, 'None': None}[text]
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def main(argv=None):
+    parser, sub = build_parser()
+    args = parser.parse_args(argv)
+    if args.config:
+        subparser = sub.choices[args.command]
+        options = {action.dest for action in subparser._actions}
+        config = load_config(args.config, args.command)
+        known = {key: value for key, value in config.items() if key in options}
+        extra = {key: value for key, value in config.items() if key not in options}
+        if extra and args.command != 'train':
+            parser.error(f"unknown options in {args.config} for '{args.command}': {', '.join(sorted(extra))}")
+        subparser.set_defaults(**known, trainer_options=extra)
+        args = parser.parse_args(argv)  # parse again: command line values override the file
+
+    missing = [name for name in REQUIRED[args.command] if getattr(args, name, None) is None]
+    if missing:
+        parser.error(f"{args.command}: missing " + ', '.join('--' + m.replace('_', '-') for m in missing))
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
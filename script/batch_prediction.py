@@ -1,6 +1,23 @@
 # yolofolder_predictor.py
 import os
-from ultralytics import YOLO
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from detection_writer import DetectionWriter
+from inference_utils import letterbox, list_images, merge_detections, scale_boxes_back, tile_windows
+from result_cache import ResultCache
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm', '.mpg', '.mpeg', '.wmv')
+SCENE_THUMB_SIZE = (64, 36)  # downscaled grayscale frame compared for scene changes
+
 
 class FolderPredictor:
     def __init__(self,
@@ -11,10 +28,12 @@ class FolderPredictor:
                  img_size: int = 640,
                  conf: float = 0.25,
                  iou: float = 0.7,
-                 device: str = None):
+                 device: str = None,
+                 backend: str = 'auto',
+                 onnx_threads: int = None):
         """
         Args:
-            model_path: path to YOLO model (.pt or .yaml)
+            model_path: path to YOLO model (.pt, .yaml, or .onnx for the ONNX Runtime backend)
             source_folder: folder path (supports recursive search)
             save_results: whether to save annotated output
             save_crops: whether to save cropped detections
@@ -22,8 +41,22 @@ class FolderPredictor:
             conf: confidence threshold
             iou: NMS IoU threshold
             device: 'cpu', 'cuda', or specific GPU index
+            backend: 'torch', 'onnx' (ONNX Runtime on CPU, torch is never imported) or 'auto' (by extension)
+            onnx_threads: ONNX Runtime intra-op threads (None = all cores)
         """
-        self.model = YOLO(model_path)
+        if backend == 'auto':
+            backend = 'onnx' if model_path.endswith('.onnx') else 'torch'
+        self.backend = backend
+        if backend == 'onnx':
+            from onnx_backend import OnnxDetector
+            self.model = OnnxDetector(model_path, imgsz=img_size, intra_op_threads=onnx_threads)
+            img_size = self.model.imgsz  # a static export fixes the input size
+        else:
+            from ultralytics import YOLO
+            self.model = YOLO(model_path)
+        self.names = self.model.names
+        self.model_path = model_path
+        self.onnx_threads = onnx_threads
         self.source_folder = source_folder
         self.save = save_results
         self.save_crop = save_crops
@@ -33,6 +66,10 @@ class FolderPredictor:
         self.device = device
 
     def run(self):
+        if self.backend == 'onnx':
+            # the ultralytics streaming loader needs the torch backend
+            self.run_batched()
+            return
         source_pattern = os.path.join(self.source_folder, "**", "*")
         results = self.model.predict(source=source_pattern,
                                      stream=True,
@@ -48,6 +85,390 @@ class FolderPredictor:
             print(f"[INFO] Processed: {r.path} -> {len(r.boxes)} boxes detected")
         print("[INFO] Inference complete.")
 
+    def run_batched(self, batch_size: int = 16, queue_depth: int = 4, decode_workers: int = None,
+                    cache_path: str = None, cache_key: str = 'stat', output_path: str = None,
+                    tile_size: int = None, tile_overlap: float = 0.2, tile_full_image: bool = True,
+                    tile_merge: str = 'nms') -> dict:
+        """
+        Batched inference over the images in source_folder. A thread pool decodes and letterboxes
+        images into a bounded queue, the model runs on fixed-size batches, and postprocessing
+        (box rescaling, printing, saving) runs on its own thread, overlapping the next batch.
+
+        Args:
+            batch_size: images per forward pass (the last batch may be smaller)
+            queue_depth: preprocessed batches buffered ahead of the model
+            decode_workers: threads decoding and letterboxing images (None = executor default)
+            cache_path: SQLite result cache; cached images skip inference and an interrupted run
+                        resumes where it stopped (None = no cache)
+            cache_key: 'stat' (path + size + mtime) or 'content' (hash of the image bytes)
+            output_path: stream every detection (path, class, conf, xyxy) into a columnar file
+                         (.parquet, or a folder of .npz chunks without pyarrow) through a background writer
+            tile_size: sliced inference for high-resolution images: every image is cut into overlapping
+                       tile_size tiles, each letterboxed to img_size, and the boxes are merged back
+                       (None = whole image only)
+            tile_overlap: fraction of tile_size shared by neighbouring tiles
+            tile_full_image: also run the whole image, for objects larger than a tile
+            tile_merge: 'nms' or 'wbf' (weighted boxes fusion) across tile seams
+
+        Returns:
+            summary with images, cached, seconds and images_per_sec
+        """
+        start = time.perf_counter()
+        paths = list_images(self.source_folder)
+        self._tiling = (tile_size, tile_overlap, tile_full_image, tile_merge) if tile_size else None
+        self._cache, self._image_keys, num_cached = None, {}, 0
+        self._postprocess_error = None
+        self._writer = DetectionWriter(output_path) if output_path else None
+        if cache_path:
+            paths, num_cached = self._apply_cache(paths, cache_path, cache_key, decode_workers)
+
+        batches = queue.Queue(maxsize=queue_depth)
+        outputs = queue.Queue(maxsize=queue_depth)
+        stop = threading.Event()
+        loader = threading.Thread(target=self._load_batches,
+                                  args=(paths, batch_size, decode_workers, batches, stop), daemon=True)
+        postprocessor = threading.Thread(target=self._postprocess_batches, args=(outputs,), daemon=True)
+
+        loader.start()
+        postprocessor.start()
+        num_images = 0
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if self._postprocess_error is not None:
+                    stop.set()  # postprocessing failed, only let the loader finish
+                    continue
+                # every image contributes one input, or one per tile when tiling
+                detections = self._infer_batch(np.concatenate([item['input'] for item in batch]))
+                outputs.put((batch, detections))
+                num_images += len(batch)
+        finally:
+            # also on an inference error: stop the loader, flush what was already inferred and close the
+            # cache and writer, so finished results are not lost
+            stop.set()
+            while loader.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            outputs.put(None)
+            postprocessor.join()
+            try:
+                if self._cache is not None:
+                    self._cache.close()
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                    print(f"[INFO] {self._writer.num_rows} detections written to {output_path}")
+        if self._postprocess_error is not None:
+            raise self._postprocess_error
+
+        elapsed = time.perf_counter() - start
+        summary = {'images': num_images, 'cached': num_cached, 'seconds': elapsed,
+                   'images_per_sec': num_images / max(elapsed, 1e-9)}
+        print(f"[INFO] Batched inference complete: {num_images} images in {elapsed:.1f}s "
+              f"({summary['images_per_sec']:.1f} images/sec), {num_cached} served from cache")
+        return summary
+
+    def run_videos(self, workers: int = None, frame_stride: int = 1, scene_threshold: float = None,
+                   max_gap: int = None, batch_size: int = 8, queue_depth: int = 32, output_path: str = None) -> dict:
+        """
+        Video mode: the videos under source_folder are spread over a process pool, one model per process.
+        In each process a thread decodes frames into a bounded queue while the model runs on batches of
+        the sampled frames. Skipped frames are only grabbed (demuxed), never converted to images.
+
+        Args:
+            workers: video processes (None = min(number of videos, CPU count)); the CPU threads of the
+                     machine are split between them
+            frame_stride: only every frame_stride-th frame is a candidate
+            scene_threshold: scene-change sampling: a candidate is processed only when the mean absolute
+                             difference of its downscaled grayscale frame to the last processed frame is at
+                             least this fraction of the full range (e.g. 0.03); None = every candidate
+            max_gap: with scene sampling, process a frame at least every max_gap frames anyway
+            batch_size: frames per forward pass
+            queue_depth: decoded frames buffered ahead of the model in each process
+            output_path: stream every detection with its video path, frame number and timestamp into a
+                         columnar file (.parquet, or a folder of .npz chunks without pyarrow)
+
+        Returns:
+            summary with videos, frames, processed, skip_ratio, seconds and frames_per_sec
+        """
+        start = time.perf_counter()
+        videos = list_videos(self.source_folder)
+        if not videos:
+            print(f"[WARN] No videos found in {self.source_folder}")
+            return {'videos': 0, 'frames': 0, 'processed': 0, 'skip_ratio': 0.0, 'seconds': 0.0,
+                    'frames_per_sec': 0.0}
+        if self.save or self.save_crop:
+            print("[WARN] save_results / save_crops are not supported in video mode, use run()")
+        workers = workers or min(len(videos), os.cpu_count() or 1)
+        threads = max((os.cpu_count() or 1) // workers, 1)
+        config = {'model_path': self.model_path, 'img_size': self.imgsz, 'conf': self.conf, 'iou': self.iou,
+                  'device': self.device, 'backend': self.backend, 'onnx_threads': self.onnx_threads or threads,
+                  'threads': threads}
+        sampling = (frame_stride, scene_threshold, max_gap, batch_size, queue_depth)
+
+        writer = DetectionWriter(output_path, video=True) if output_path else None
+        frames = processed = failed = 0
+        # spawn: forking a process that already holds an initialized torch runtime is not safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                 initializer=_init_video_worker, initargs=(config,)) as executor:
+            futures = {executor.submit(_process_video, path, *sampling): path for path in videos}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:  # one broken video does not stop the run
+                    print(f"[WARN] Failed to process video {futures[future]}: {e}")
+                    failed += 1
+                    continue
+                frames += result['frames']
+                processed += len(result['detections'])
+                num_boxes = sum(len(det) for _, _, det in result['detections'])
+                print(f"[INFO] Processed: {result['path']} -> {len(result['detections'])}/{result['frames']} frames, "
+                      f"{num_boxes} boxes, {result['frames'] / max(result['seconds'], 1e-9):.1f} frames/sec")
+                if writer is not None:
+                    for frame, timestamp_ms, det in result['detections']:
+                        writer.write(result['path'], det, frame=frame, timestamp_ms=timestamp_ms)
+        if writer is not None:
+            writer.close()
+            print(f"[INFO] {writer.num_rows} detections written to {output_path}")
+
+        elapsed = time.perf_counter() - start
+        summary = {'videos': len(videos) - failed, 'failed': failed, 'frames': frames, 'processed': processed,
+                   'skip_ratio': 1 - processed / max(frames, 1), 'seconds': elapsed,
+                   'frames_per_sec': frames / max(elapsed, 1e-9)}
+        print(f"[INFO] Video inference complete: {summary['videos']} videos, {frames} frames in {elapsed:.1f}s "
+              f"({summary['frames_per_sec']:.1f} frames/sec), {processed} processed "
+              f"(skip ratio {summary['skip_ratio']:.1%})")
+        return summary
+
+    def _apply_cache(self, paths, cache_path, cache_key, workers):
+        """Report cached images and return only the paths that still need inference."""
+        tiling = {'tiling': self._tiling} if self._tiling else {}  # keeps existing caches valid
+        self._cache = ResultCache(cache_path, self.model_path, key_mode=cache_key,
+                                  imgsz=self.imgsz, conf=self.conf, iou=self.iou, **tiling)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            self._image_keys = dict(zip(paths, pool.map(self._cache.image_key, paths)))
+        key_to_paths = defaultdict(list)  # content keys are shared by identical images
+        for path, key in self._image_keys.items():
+            key_to_paths[key].append(path)
+        hits = set()
+        for key, boxes in self._cache.iter_cached(list(key_to_paths)):
+            hits.add(key)
+            for path in key_to_paths[key]:
+                print(f"[INFO] Cached: {path} -> {len(boxes)} boxes detected")
+                if self._writer is not None:
+                    self._writer.write(path, boxes)
+        remaining = [path for path in paths if self._image_keys[path] not in hits]
+        return remaining, len(paths) - len(remaining)
+
+    def _load_batches(self, paths, batch_size, decode_workers, batches: queue.Queue, stop: threading.Event):
+        try:
+            with ThreadPoolExecutor(max_workers=decode_workers) as pool:
+                for i in range(0, len(paths), batch_size):
+                    if stop.is_set():
+                        break
+                    items = [item for item in pool.map(self._load_image, paths[i:i + batch_size]) if item]
+                    if items:
+                        batches.put(items)
+        finally:
+            batches.put(None)
+
+    def _load_image(self, path: str):
+        image = cv2.imread(path)
+        if image is None:
+            print(f"[WARN] Cannot read image: {path}")
+            return None
+        info = {'path': path,
+                'orig_img': image if (self.save or self.save_crop) else None,
+                'orig_shape': image.shape[:2]}
+        h, w = image.shape[:2]
+        if self._tiling is None:
+            windows = [(0, 0, w, h)]
+        else:
+            tile_size, overlap, full_image, _ = self._tiling
+            windows = tile_windows(h, w, tile_size, overlap)
+            if full_image and len(windows) > 1:
+                windows.append((0, 0, w, h))
+
+        inputs = np.empty((len(windows), 3, self.imgsz, self.imgsz), dtype=np.uint8)
+        info['windows'] = []
+        for i, (x1, y1, x2, y2) in enumerate(windows):
+            boxed, ratio, pad = letterbox(image[y1:y2, x1:x2], self.imgsz)
+            inputs[i] = boxed[:, :, ::-1].transpose(2, 0, 1)  # BGR HWC -> RGB CHW
+            info['windows'].append((x1, y1, (y2 - y1, x2 - x1), ratio, pad))
+        info['input'] = inputs
+        return info
+
+    def _infer_batch(self, batch: np.ndarray) -> list:
+        """uint8 (B, 3, imgsz, imgsz) -> per image (N, 6) [x1, y1, x2, y2, conf, cls] in letterbox coordinates."""
+        if self.backend == 'onnx':
+            return self.model.predict_batch(batch, conf=self.conf, iou=self.iou)
+        import torch
+        x = torch.from_numpy(batch).float().div_(255.0)
+        results = self.model.predict(source=x, imgsz=self.imgsz, conf=self.conf, iou=self.iou,
+                                     device=self.device, verbose=False)
+        return [r.boxes.data.cpu().numpy() for r in results]
+
+    def _postprocess_batches(self, outputs: queue.Queue):
+        save_dir = os.path.join("runs/predict", "predict")
+        while True:
+            item = outputs.get()
+            if item is None:
+                break
+            if self._postprocess_error is not None:
+                continue  # keep draining so the inference loop never blocks on a full queue
+            try:
+                self._postprocess_batch(*item, save_dir)
+            except Exception as e:  # re-raised by run_batched once the pipeline has stopped
+                self._postprocess_error = e
+
+    def _postprocess_batch(self, batch: list, outputs_per_input: list, save_dir: str):
+        detections, cursor = [], 0
+        for info in batch:
+            # letterbox -> window -> image coordinates, then merge across tile seams
+            per_window = []
+            for x1, y1, shape, ratio, pad in info['windows']:
+                det = outputs_per_input[cursor]
+                cursor += 1
+                scale_boxes_back(det[:, :4], ratio, pad, shape)
+                det[:, [0, 2]] += x1
+                det[:, [1, 3]] += y1
+                per_window.append(det)
+            if self._tiling is None:
+                detections.append(per_window[0])
+            else:
+                detections.append(merge_detections(per_window, self._tiling[3], self.iou))
+
+        for info, det in zip(batch, detections):
+            print(f"[INFO] Processed: {info['path']} -> {len(det)} boxes detected")
+            if self.save or self.save_crop:
+                self._save_result(info, det, save_dir)
+            if self._writer is not None:
+                self._writer.write(info['path'], det)
+        if self._cache is not None:
+            self._cache.put_many((self._image_keys[info['path']], info['path'], det)
+                                 for info, det in zip(batch, detections))
+
+    def _save_result(self, info: dict, det: np.ndarray, save_dir: str):
+        import torch
+        from ultralytics.engine.results import Results
+        result = Results(info['orig_img'], path=info['path'], names=self.names, boxes=torch.from_numpy(det))
+        if self.save:
+            os.makedirs(save_dir, exist_ok=True)
+            result.save(filename=os.path.join(save_dir, os.path.basename(info['path'])))
+        if self.save_crop:
+            result.save_crop(save_dir=os.path.join(save_dir, "crops"), file_name=Path(info['path']).stem)
+
+
+def list_videos(folder: str) -> list:
+    """All video files under `folder` (recursive, sorted)."""
+    return sorted(str(p) for p in Path(folder).rglob("*") if p.suffix.lower() in VIDEO_EXTENSIONS)
+
+
+_video_predictor = None  # per-process model of the video pool
+
+
+def _init_video_worker(config: dict):
+    """Pool initializer: load the model once per video process."""
+    global _video_predictor
+    if config['backend'] == 'torch':
+        import torch
+        torch.set_num_threads(config['threads'])
+    cv2.setNumThreads(1)  # the decode thread and the model already use the process' share of the cores
+    _video_predictor = FolderPredictor(model_path=config['model_path'], source_folder=None,
+                                       img_size=config['img_size'], conf=config['conf'], iou=config['iou'],
+                                       device=config['device'], backend=config['backend'],
+                                       onnx_threads=config['onnx_threads'])
+
+
+def _decode_video(cap, fps: float, frame_stride: int, scene_threshold: float, max_gap: int,
+                  frames: queue.Queue, state: dict, stop: threading.Event):
+    """Decode thread: put sampled (frame index, timestamp ms, BGR frame) into `frames`, then None.
+    The frame count and any decode error are left in `state`; `stop` ends decoding early."""
+    last_thumb, last_index, index = None, None, -1
+    try:
+        while not stop.is_set():
+            index += 1
+            if index % frame_stride:
+                if not cap.grab():  # demux only, the frame is never converted
+                    break
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if scene_threshold is not None:
+                thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), SCENE_THUMB_SIZE,
+                                   interpolation=cv2.INTER_AREA).astype(np.int16)
+                changed = (last_thumb is None or np.abs(thumb - last_thumb).mean() >= scene_threshold * 255
+                           or (max_gap is not None and index - last_index >= max_gap))
+                if not changed:
+                    continue
+                last_thumb, last_index = thumb, index
+            timestamp_ms = index * 1000.0 / fps if fps > 0 else cap.get(cv2.CAP_PROP_POS_MSEC)
+            frames.put((index, timestamp_ms, frame))
+    except Exception as e:  # re-raised by _process_video, a truncated result must not look complete
+        state['error'] = e
+    finally:
+        state['frames'] = index
+        frames.put(None)
+
+
+def _process_video(path: str, frame_stride: int, scene_threshold: float, max_gap: int, batch_size: int,
+                   queue_depth: int) -> dict:
+    """Pool task: sampled-frame detections of one video, as [(frame index, timestamp ms, (N, 6) det)]."""
+    start = time.perf_counter()
+    predictor = _video_predictor
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"cannot open video {path}")
+    frames, state, stop = queue.Queue(maxsize=queue_depth), {}, threading.Event()
+    decoder = threading.Thread(target=_decode_video, args=(cap, cap.get(cv2.CAP_PROP_FPS), frame_stride,
+                                                           scene_threshold, max_gap, frames, state, stop),
+                               daemon=True)
+    decoder.start()
+
+    detections = []
+    try:
+        done = False
+        while not done:
+            batch = []
+            while len(batch) < batch_size:
+                item = frames.get()
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+            if not batch:
+                break
+            inputs = np.empty((len(batch), 3, predictor.imgsz, predictor.imgsz), dtype=np.uint8)
+            geometry = []
+            for i, (_, _, frame) in enumerate(batch):
+                boxed, ratio, pad = letterbox(frame, predictor.imgsz)
+                inputs[i] = boxed[:, :, ::-1].transpose(2, 0, 1)  # BGR HWC -> RGB CHW
+                geometry.append((ratio, pad, frame.shape[:2]))
+            for (index, timestamp_ms, _), det, (ratio, pad, shape) in zip(batch, predictor._infer_batch(inputs),
+                                                                          geometry):
+                scale_boxes_back(det[:, :4], ratio, pad, shape)
+                detections.append((index, timestamp_ms, det))
+    finally:
+        # on an inference error the decoder may be blocked on a full queue: stop it and drain
+        stop.set()
+        while decoder.is_alive():
+            try:
+                frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        decoder.join()
+        cap.release()
+    if 'error' in state:
+        raise state['error']
+    return {'path': path, 'frames': state['frames'], 'detections': detections,
+            'seconds': time.perf_counter() - start}
+
+
 if __name__ == "__main__":
     def example1():
         print("\nExample 1: Image prediction")
@@ -60,6 +481,36 @@ if __name__ == "__main__":
                                     device=0)
         predictor.run()
 
+    def example3():
+        print("\nExample 3: Batched image prediction (CPU)")
+        predictor = FolderPredictor(model_path='yolo11s.pt',
+                                    source_folder="datasets/test_images",
+                                    img_size=640,
+                                    conf=0.4,
+                                    device='cpu')
+        predictor.run_batched(batch_size=16, queue_depth=4, decode_workers=os.cpu_count(),
+                              cache_path="runs/predict/result_cache.sqlite",
+                              output_path="runs/predict/detections.parquet")
+
+    def example4():
+        print("\nExample 4: ONNX Runtime on CPU (export with convert_to_onnx.py first)")
+        predictor = FolderPredictor(model_path='yolo11s.onnx',
+                                    source_folder="datasets/test_images",
+                                    conf=0.4,
+                                    onnx_threads=os.cpu_count())
+        predictor.run_batched(batch_size=1, decode_workers=4)
+
+    def example5():
+        print("\nExample 5: Tiled inference for 4K / aerial images (small objects)")
+        predictor = FolderPredictor(model_path='yolo11s.pt',
+                                    source_folder="datasets/aerial_images",
+                                    save_results=True,
+                                    img_size=640,
+                                    conf=0.3,
+                                    device='cpu')
+        predictor.run_batched(batch_size=2, tile_size=640, tile_overlap=0.2, tile_full_image=True,
+                              tile_merge='wbf')
+
     def example2():
         print("\nExample 2: Video prediction")
         predictor = FolderPredictor(model_path="yolo11s.pt",
@@ -71,5 +522,13 @@ if __name__ == "__main__":
                                     device=0)
         predictor.run()
 
+    def example6():
+        print("\nExample 6: Parallel video prediction with scene-change sampling (CPU)")
+        predictor = FolderPredictor(model_path="yolo11s.onnx",
+                                    source_folder="./videos",
+                                    conf=0.4)
+        predictor.run_videos(workers=4, frame_stride=2, scene_threshold=0.03, max_gap=150,
+                             output_path="runs/predict/video_detections.parquet")
+
     example1()
     # example2()
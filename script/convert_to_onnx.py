@@ -1,7 +1,279 @@
-from ultralytics import YOLO
+# convert_to_onnx.py
+# Export a YOLO model to ONNX with configurable settings (imgsz, dynamic batch, opset, simplify),
+# optionally derive FP16 and static INT8 variants, and compare every variant against the PyTorch
+# model on the DatasetPreparer val split: box agreement, optional mAP, CPU latency and file size.
+import json
+import os
+import random
+import re
+import time
+from typing import Dict, List, Optional
 
-# Load the YOLO11 model
-model = YOLO("runs/detect/renesas/weights/best.pt")
+import cv2
+import numpy as np
 
-# Export the model to ONNX format
-model.export(format="onnx")  # creates 'yolo11n.onnx'
\ No newline at end of file
+from inference_utils import box_iou, letterbox
+
+
+class ValCalibrationReader:
+    """INT8 calibration data: letterboxed images from a val.txt split, one batch at a time."""
+
+    def __init__(self, image_paths: List[str], input_name: str, imgsz: int, batch_size: int = 1):
+        self.image_paths = image_paths
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self.batch_size = batch_size
+        self._position = 0
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        batch = []
+        while len(batch) < self.batch_size and self._position < len(self.image_paths):
+            image = cv2.imread(self.image_paths[self._position])
+            self._position += 1
+            if image is None:
+                continue
+            boxed, _, _ = letterbox(image, self.imgsz)
+            batch.append(boxed[:, :, ::-1].transpose(2, 0, 1))
+        if len(batch) < self.batch_size:
+            return None  # a static batch axis cannot take a partial batch
+        return {self.input_name: np.stack(batch).astype(np.float32) / 255.0}
+
+    def rewind(self):
+        self._position = 0
+
+
+class OnnxExporter:
+    def __init__(self,
+                 model_path: str,
+                 imgsz: int = 640,
+                 dynamic: bool = False,
+                 opset: Optional[int] = None,
+                 simplify: bool = True,
+                 batch: int = 1,
+                 val_list: Optional[str] = None,
+                 calib_images: int = 300,
+                 seed: int = 0):
+        """
+        Args:
+            model_path: PyTorch weights (.pt) to export
+            imgsz: square input size
+            dynamic: dynamic batch (and spatial) axes instead of a fixed input shape
+            opset: ONNX opset (None = ultralytics default)
+            simplify: run the ONNX simplifier after export
+            batch: batch size baked into the graph when dynamic is False
+            val_list: val.txt written by DatasetPreparer, used for INT8 calibration and the comparison
+            calib_images: number of val images used for INT8 calibration
+            seed: seed for choosing the calibration images
+        """
+        self.model_path = model_path
+        self.imgsz = imgsz
+        self.dynamic = dynamic
+        self.opset = opset
+        self.simplify = simplify
+        self.batch = batch
+        self.val_list = val_list
+        self.calib_images = calib_images
+        self.seed = seed
+
+    def export(self, fp16: bool = False, int8: bool = False) -> Dict[str, str]:
+        """
+        Export the FP32 model and the requested variants.
+
+        Returns:
+            {'fp32': path, 'fp16': path, 'int8': path} for the variants produced
+        """
+        from ultralytics import YOLO
+
+        model = YOLO(self.model_path)
+        fp32_path = model.export(format="onnx", imgsz=self.imgsz, dynamic=self.dynamic, opset=self.opset,
+                                 simplify=self.simplify, batch=self.batch, device="cpu")
+        variants = {'fp32': str(fp32_path)}
+        print(f"[INFO] FP32 model: {fp32_path}")
+        if fp16:
+            variants['fp16'] = self.convert_fp16(variants['fp32'])
+        if int8:
+            variants['int8'] = self.quantize_int8(variants['fp32'])
+        return variants
+
+    def convert_fp16(self, onnx_path: str) -> str:
+        """FP16 weights and activations; inputs / outputs stay FP32 so callers need no changes."""
+        import onnx
+        try:
+            from onnxconverter_common import float16
+        except ImportError:
+            raise ImportError("FP16 conversion requires onnxconverter-common (pip install onnxconverter-common)")
+
+        out_path = onnx_path.replace('.onnx', '_fp16.onnx')
+        model = float16.convert_float_to_float16(onnx.load(onnx_path), keep_io_types=True)
+        onnx.save(model, out_path)
+        print(f"[INFO] FP16 model: {out_path}")
+        return out_path
+
+    def quantize_int8(self, onnx_path: str, exclude_head: bool = True) -> str:
+        """
+        Static INT8 quantization (QDQ, per-channel weights) calibrated on val images.
+
+        Args:
+            exclude_head: keep the detection head in FP32; box regression and the class scores lose the
+                          most accuracy when quantized, while the head is a small part of the compute
+        """
+        import onnx
+        import onnxruntime as ort
+        from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+
+        if not self.val_list:
+            raise ValueError("INT8 calibration needs val_list (the val.txt written by DatasetPreparer)")
+        images = self._val_images()
+        random.Random(self.seed).shuffle(images)
+
+        input_meta = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0]
+        batch = input_meta.shape[0] if isinstance(input_meta.shape[0], int) else 1
+        reader = ValCalibrationReader(images[:self.calib_images], input_meta.name, self.imgsz, batch)
+
+        # shape inference + graph folding first, so every Conv is found with its bias and gets quantized
+        prepared_path = onnx_path.replace('.onnx', '_prep.onnx')
+        quant_pre_process(onnx_path, prepared_path)
+        nodes = [node.name for node in onnx.load(prepared_path).graph.node]
+        excluded = _head_nodes(nodes) if exclude_head else []
+        out_path = onnx_path.replace('.onnx', '_int8.onnx')
+        quantize_static(prepared_path, out_path, reader,
+                        quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8,
+                        per_channel=True,
+                        calibrate_method=CalibrationMethod.MinMax,
+                        nodes_to_exclude=excluded)
+        os.remove(prepared_path)
+        print(f"[INFO] INT8 model: {out_path} (calibrated on {min(len(images), self.calib_images)} images, "
+              f"{len(excluded)} head nodes kept in FP32)")
+        return out_path
+
+    def compare(self, variants: Dict[str, str], max_images: int = 200, conf: float = 0.25, iou: float = 0.7,
+                data: Optional[str] = None, latency_runs: int = 50, threads: Optional[int] = None,
+                report_path: Optional[str] = None) -> Dict[str, dict]:
+        """
+        Compare the exported variants with the PyTorch model on the val split.
+
+        Args:
+            variants: output of export()
+            max_images: val images used for box agreement
+            conf, iou: prediction thresholds shared by all models
+            data: dataset yaml; when given, mAP50-95 / mAP50 are measured with ultralytics val
+            latency_runs: timed single-image CPU inferences per model
+            threads: ONNX Runtime intra-op threads (None = all cores)
+            report_path: write the comparison as JSON
+
+        Returns:
+            {model: {size_mb, latency_ms_p50, latency_ms_p95, agreement (and map50_95 / map50 with data)}}
+        """
+        from ultralytics import YOLO
+        from onnx_backend import OnnxDetector
+
+        images = self._val_images()[:max_images]
+        frames = [img for img in (cv2.imread(p) for p in images) if img is not None]
+        if not frames:
+            raise ValueError("No readable val images to compare on")
+
+        torch_model = YOLO(self.model_path)
+        reference = [r.boxes.data.cpu().numpy()
+                     for r in torch_model.predict(frames, imgsz=self.imgsz, conf=conf, iou=iou, device="cpu",
+                                                  stream=True, verbose=False)]
+        torch_latency = _time_calls(lambda f: torch_model.predict(f, imgsz=self.imgsz, conf=conf, iou=iou,
+                                                                  device="cpu", verbose=False),
+                                    frames, latency_runs)
+        report = {'torch': {'size_mb': os.path.getsize(self.model_path) / 2 ** 20, **torch_latency,
+                            'agreement': 1.0}}
+
+        for name, path in variants.items():
+            detector = OnnxDetector(path, imgsz=self.imgsz, intra_op_threads=threads)
+            predictions = [detector.predict([f], conf=conf, iou=iou)[0] for f in frames]
+            report[name] = {'size_mb': os.path.getsize(path) / 2 ** 20,
+                            **_time_calls(lambda f: detector.predict([f], conf=conf, iou=iou), frames, latency_runs),
+                            'agreement': box_agreement(reference, predictions)}
+
+        if data is not None:
+            for name, path in [('torch', self.model_path), *variants.items()]:
+                metrics = YOLO(path, task="detect").val(data=data, imgsz=self.imgsz, batch=1, device="cpu",
+                                                        plots=False, verbose=False)
+                report[name]['map50_95'] = float(metrics.box.map)
+                report[name]['map50'] = float(metrics.box.map50)
+
+        self._print_report(report)
+        if report_path:
+            with open(report_path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"[INFO] Comparison written to {report_path}")
+        return report
+
+    def _val_images(self) -> List[str]:
+        with open(self.val_list, 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+
+    @staticmethod
+    def _print_report(report: Dict[str, dict]):
+        print(f"\n{'model':<8}{'size MB':>10}{'p50 ms':>10}{'p95 ms':>10}{'agree':>8}{'mAP50-95':>10}")
+        base = report['torch']['latency_ms_p50']
+        for name, r in report.items():
+            map_text = f"{r['map50_95']:.4f}" if 'map50_95' in r else '-'
+            print(f"{name:<8}{r['size_mb']:>10.1f}{r['latency_ms_p50']:>10.1f}{r['latency_ms_p95']:>10.1f}"
+                  f"{r['agreement']:>8.3f}{map_text:>10}   ({base / r['latency_ms_p50']:.2f}x vs torch)")
+
+
+def box_agreement(reference: List[np.ndarray], predictions: List[np.ndarray], iou_threshold: float = 0.5) -> float:
+    """
+    F1 of predicted boxes against reference boxes, matched greedily by confidence with IoU >= iou_threshold
+    and the same class. 1.0 means both models produced the same detections.
+    """
+    matched = num_ref = num_pred = 0
+    for ref, pred in zip(reference, predictions):
+        num_ref += len(ref)
+        num_pred += len(pred)
+        available = np.ones(len(ref), dtype=bool)
+        for det in pred[np.argsort(-pred[:, 4])]:
+            candidates = np.flatnonzero(available & (ref[:, 5] == det[5]))
+            if len(candidates) == 0:
+                continue
+            ious = box_iou(det[:4], ref[candidates, :4])
+            best = ious.argmax()
+            if ious[best] >= iou_threshold:
+                available[candidates[best]] = False
+                matched += 1
+    if num_ref + num_pred == 0:
+        return 1.0
+    return 2 * matched / (num_ref + num_pred)
+
+
+def _time_calls(fn, frames: List[np.ndarray], runs: int, warmup: int = 3) -> Dict[str, float]:
+    """p50 / p95 latency in milliseconds of fn(frame) over `runs` calls cycling through frames."""
+    for i in range(warmup):
+        fn(frames[i % len(frames)])
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        fn(frames[i % len(frames)])
+        times.append((time.perf_counter() - start) * 1000)
+    return {'latency_ms_p50': float(np.percentile(times, 50)), 'latency_ms_p95': float(np.percentile(times, 95))}
+
+
+def _head_nodes(node_names: List[str]) -> List[str]:
+    """Nodes of the last top-level module (the Detect head), named '/model.<N>/...' by the ultralytics export."""
+    indices = [int(m.group(1)) for m in (re.match(r"/model\.(\d+)/", n) for n in node_names) if m]
+    if not indices:
+        return []
+    prefix = f"/model.{max(indices)}/"
+    return [n for n in node_names if n.startswith(prefix)]
+
+
+if __name__ == "__main__":
+    exporter = OnnxExporter(
+        model_path="runs/detect/renesas/weights/best.pt",
+        imgsz=640,
+        dynamic=False,            # True: dynamic batch axis (FolderPredictor.run_batched batches > 1)
+        opset=None,
+        simplify=True,
+        val_list="./output/val.txt",   # written by DatasetPreparer
+        calib_images=300,
+    )
+    exported = exporter.export(fp16=False, int8=True)
+    exporter.compare(exported, max_images=200, data=None, report_path="runs/export_report.json")
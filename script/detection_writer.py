@@ -0,0 +1,140 @@
+# detection_writer.py
+# Streams detections (path, class, conf, x1, y1, x2, y2) into an append-only columnar file from a
+# background thread. Parquet (one row group per flush) when pyarrow is installed, otherwise a folder of
+# chunked .npz files. Callers only enqueue small arrays, so memory per processed image stays constant.
+# Video results (video=True) add the frame number and timestamp of every detection.
+import glob
+import os
+import queue
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, falls back to chunked .npz
+    pa = pq = None
+
+COLUMNS = ('class', 'conf', 'x1', 'y1', 'x2', 'y2')
+VIDEO_COLUMNS = ('frame', 'timestamp_ms')
+
+
+class DetectionWriter:
+    def __init__(self, output_path: str, fmt: Optional[str] = None, flush_rows: int = 100_000,
+                 queue_size: int = 256, video: bool = False):
+        """
+        Args:
+            output_path: .parquet file, or a folder for .npz chunks
+            fmt: 'parquet' or 'npz' (None = parquet if pyarrow is available)
+            flush_rows: buffered detections per flush (row group / chunk)
+            queue_size: images buffered before write() blocks
+            video: add frame / timestamp_ms columns (write() then needs frame and timestamp_ms)
+        """
+        self.fmt = fmt or ('parquet' if pq is not None else 'npz')
+        if self.fmt == 'parquet' and pq is None:
+            raise ImportError("pyarrow is required for Parquet output (pip install pyarrow)")
+        if self.fmt not in ('parquet', 'npz'):
+            raise ValueError("fmt must be 'parquet' or 'npz'")
+        self.output_path = output_path
+        self.flush_rows = flush_rows
+        self.video = video
+        self.num_images = 0
+        self.num_rows = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._buffer = []
+        self._buffered_rows = 0
+        self._parquet = None
+        self._chunk = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, path: str, detections: np.ndarray, frame: Optional[int] = None,
+              timestamp_ms: Optional[float] = None):
+        """Enqueue the (N, 6) [x1, y1, x2, y2, conf, cls] detections of one image (or one video frame)."""
+        if self._error is not None:
+            raise self._error
+        self._queue.put((path, np.array(detections, dtype=np.float32).reshape(-1, 6), (frame, timestamp_ms)))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        closed = False
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    closed = True
+                    break
+                path, det, position = item
+                self.num_images += 1
+                if len(det):
+                    self._buffer.append((path, det, position))
+                    self._buffered_rows += len(det)
+                    if self._buffered_rows >= self.flush_rows:
+                        self._flush()
+            self._flush()
+            if self._parquet is not None:
+                self._parquet.close()
+        except Exception as e:  # surfaced to the caller on the next write() / close()
+            self._error = e
+            while not closed:  # keep draining so producers never block, until close()
+                closed = self._queue.get() is None
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        det = np.concatenate([d for _, d, _ in self._buffer])
+        paths = [p for p, _, _ in self._buffer]
+        counts = [len(d) for _, d, _ in self._buffer]
+        path_index = np.repeat(np.arange(len(paths), dtype=np.int32), counts)
+        columns = {'class': det[:, 5].astype(np.int16), 'conf': det[:, 4],
+                   'x1': det[:, 0], 'y1': det[:, 1], 'x2': det[:, 2], 'y2': det[:, 3]}
+        if self.video:
+            columns['frame'] = np.repeat(np.array([p[0] for _, _, p in self._buffer], dtype=np.int64), counts)
+            columns['timestamp_ms'] = np.repeat(np.array([p[1] for _, _, p in self._buffer], dtype=np.float64), counts)
+
+        if self.fmt == 'parquet':
+            path_column = pa.DictionaryArray.from_arrays(pa.array(path_index), pa.array(paths))
+            table = pa.table({'path': path_column, **{k: pa.array(v) for k, v in columns.items()}})
+            if self._parquet is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+                self._parquet = pq.ParquetWriter(self.output_path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            os.makedirs(self.output_path, exist_ok=True)
+            chunk_path = os.path.join(self.output_path, f"part-{self._chunk:05d}.npz")
+            np.savez(chunk_path, paths=np.array(paths), path_index=path_index, **columns)
+            self._chunk += 1
+
+        self.num_rows += len(det)
+        self._buffer = []
+        self._buffered_rows = 0
+
+
+def load_detections(output_path: str) -> Dict[str, np.ndarray]:
+    """Load a DetectionWriter output into column arrays (path, class, conf, x1, y1, x2, y2; frame and
+    timestamp_ms for video results)."""
+    if os.path.isfile(output_path):
+        table = pq.read_table(output_path)
+        return {name: table.column(name).to_numpy() for name in ('path',) + COLUMNS + VIDEO_COLUMNS
+                if name in table.column_names}
+
+    parts = [np.load(p) for p in sorted(glob.glob(os.path.join(output_path, "part-*.npz")))]
+    names = COLUMNS + tuple(c for c in VIDEO_COLUMNS if parts and c in parts[0].files)
+    result = {name: np.concatenate([p[name] for p in parts]) if parts else np.zeros(0) for name in names}
+    result['path'] = np.concatenate([p['paths'][p['path_index']] for p in parts]) if parts else np.zeros(0, dtype=str)
+    return result
@@ -0,0 +1,241 @@
+# hyperparameter_sweep.py
+# Parallel hyperparameter search on top of YOLOTrainer with asynchronous successive halving (ASHA).
+# Trials sampled from a search space first train on a cheap rung (small `fraction`, few epochs); only the
+# best 1/reduction_factor of the trials finished on a rung are promoted to the next, more expensive one.
+# Trials run in a local process pool, each pinned to its own slice of CPU cores (and a device), and the
+# sweep state is saved to JSON after every event so an interrupted sweep resumes where it stopped.
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_RUNGS = ((0.25, 3), (0.5, 8), (1.0, 20))  # (fraction, epochs) per rung
+DEFAULT_METRIC = 'metrics/mAP50-95(B)'
+
+
+def sample_params(space: Dict[str, tuple], rng: random.Random) -> Dict:
+    """
+    Draw one configuration. Space entries:
+        ('uniform', low, high), ('log', low, high), ('int', low, high) or ('choice', [values])
+    """
+    params = {}
+    for name, spec in space.items():
+        kind = spec[0]
+        if kind == 'uniform':
+            params[name] = rng.uniform(spec[1], spec[2])
+        elif kind == 'log':
+            params[name] = math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2])))
+        elif kind == 'int':
+            params[name] = rng.randint(spec[1], spec[2])
+        elif kind == 'choice':
+            params[name] = rng.choice(list(spec[1]))
+        else:
+            raise ValueError(f"Unknown search space type '{kind}' for '{name}'")
+    return params
+
+
+class HyperparameterSweep:
+    def __init__(self,
+                 trainer_kwargs: Dict,
+                 search_space: Dict[str, tuple],
+                 state_path: str = "runs/sweep/sweep_state.json",
+                 num_trials: int = 27,
+                 rungs: Sequence[Tuple[float, int]] = DEFAULT_RUNGS,
+                 reduction_factor: int = 3,
+                 parallel: int = 2,
+                 devices: Optional[Sequence] = None,
+                 metric: str = DEFAULT_METRIC,
+                 seed: int = 0):
+        """
+        Args:
+            trainer_kwargs: fixed YOLOTrainer arguments (model, data, imgsz, batch, ...)
+            search_space: {YOLOTrainer argument: spec}, see sample_params
+            state_path: JSON file holding every trial; an existing file resumes the sweep
+            num_trials: configurations sampled in total
+            rungs: (fraction, epochs) budgets from cheapest to full
+            reduction_factor: only the top 1/reduction_factor of a rung is promoted
+            parallel: trials running at once
+            devices: device per slot, round robin (e.g. ['cpu'] or [0, 1]; None = trainer_kwargs['device'])
+            metric: key of the training results to maximise
+            seed: seed of the configuration sampler
+        """
+        self.trainer_kwargs = dict(trainer_kwargs)
+        self.search_space = search_space
+        self.state_path = state_path
+        self.num_trials = num_trials
+        self.rungs = [tuple(r) for r in rungs]
+        self.reduction_factor = reduction_factor
+        self.parallel = parallel
+        self.devices = list(devices) if devices else [self.trainer_kwargs.get('device', 'cpu')]
+        self.metric = metric
+        self.seed = seed
+        self.cpu_slices = _split_cpus(parallel)
+        self.state = self._load_state()
+
+    # ------------------------------
+    # State
+    # ------------------------------
+    def _load_state(self) -> Dict:
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            interrupted = 0
+            for trial in state['trials']:
+                for rung in trial['rungs'].values():
+                    if rung['status'] == 'running':  # the sweep stopped while this rung was training
+                        rung['status'] = 'pending'
+                        interrupted += 1
+            print(f"[sweep] Resuming '{self.state_path}': {len(state['trials'])} trials, "
+                  f"{interrupted} interrupted runs restarted")
+            return state
+
+        rng = random.Random(self.seed)
+        trials = [{'id': i, 'params': sample_params(self.search_space, rng), 'rungs': {}}
+                  for i in range(self.num_trials)]
+        return {'metric': self.metric, 'rungs': self.rungs, 'reduction_factor': self.reduction_factor,
+                'trials': trials}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    # ------------------------------
+    # ASHA scheduling
+    # ------------------------------
+    def _next_job(self) -> Optional[Tuple[Dict, int]]:
+        """(trial, rung) to start next: restarts first, then promotions from the highest rung, then new trials."""
+        trials = self.state['trials']
+        for trial in trials:
+            for rung, entry in trial['rungs'].items():
+                if entry['status'] == 'pending':
+                    return trial, int(rung)
+
+        for rung in range(len(self.rungs) - 2, -1, -1):
+            done = [t for t in trials if t['rungs'].get(str(rung), {}).get('status') == 'done']
+            done.sort(key=lambda t: t['rungs'][str(rung)]['score'], reverse=True)
+            top = done[:len(done) // self.reduction_factor]
+            for trial in top:
+                if str(rung + 1) not in trial['rungs']:
+                    return trial, rung + 1
+
+        for trial in trials:
+            if not trial['rungs']:
+                return trial, 0
+        return None
+
+    def run(self) -> Dict:
+        """
+        Run (or resume) the sweep until no trial can be started or promoted.
+
+        Returns:
+            best trial: {'id', 'params', 'rung', 'score'}
+        """
+        free_slots = list(range(self.parallel))
+        running = {}
+        with ProcessPoolExecutor(max_workers=self.parallel, mp_context=get_context("spawn")) as executor:
+            while True:
+                while free_slots:
+                    job = self._next_job()
+                    if job is None:
+                        break
+                    trial, rung = job
+                    slot = free_slots.pop(0)
+                    fraction, epochs = self.rungs[rung]
+                    trial['rungs'][str(rung)] = {'status': 'running', 'started': time.time()}
+                    self._save_state()
+                    kwargs = dict(self.trainer_kwargs, **trial['params'], fraction=fraction, epochs=epochs,
+                                  device=self.devices[slot % len(self.devices)],
+                                  name=f"trial{trial['id']:03d}_rung{rung}", exist_ok=True,
+                                  project=os.path.join(os.path.dirname(os.path.abspath(self.state_path)), 'trials'))
+                    print(f"[sweep] trial {trial['id']} rung {rung} (fraction={fraction}, epochs={epochs}) "
+                          f"on cpus {self.cpu_slices[slot]}: {trial['params']}")
+                    future = executor.submit(_run_trial, kwargs, self.cpu_slices[slot])
+                    running[future] = (trial, rung, slot)
+
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    trial, rung, slot = running.pop(future)
+                    free_slots.append(slot)
+                    entry = trial['rungs'][str(rung)]
+                    entry['seconds'] = time.time() - entry.pop('started')
+                    try:
+                        metrics = future.result()
+                        score = metrics.get(self.metric)
+                        if score is None or not math.isfinite(score):
+                            raise ValueError(f"metric '{self.metric}' missing or not finite: {score}")
+                        entry.update(status='done', score=score, metrics=metrics)
+                        print(f"[sweep] trial {trial['id']} rung {rung}: {self.metric}={entry['score']:.4f} "
+                              f"({entry['seconds'] / 60:.1f} min)")
+                    except Exception as e:  # a failed trial never gets promoted (score None keeps the JSON standard)
+                        entry.update(status='failed', score=None, error=str(e))
+                        print(f"[sweep] trial {trial['id']} rung {rung} failed: {e}")
+                    self._save_state()
+
+        best = self.best()
+        print(f"[sweep] Best: trial {best['id']} at rung {best['rung']} with {self.metric}={best['score']:.4f}: "
+              f"{best['params']}")
+        return best
+
+    def best(self) -> Dict:
+        """Best trial on the highest rung any trial finished."""
+        finished = [(int(rung), entry['score'], trial) for trial in self.state['trials']
+                    for rung, entry in trial['rungs'].items() if entry['status'] == 'done']
+        if not finished:
+            raise RuntimeError("No trial has finished yet")
+        rung, score, trial = max(finished, key=lambda x: (x[0], x[1]))
+        return {'id': trial['id'], 'params': trial['params'], 'rung': rung, 'score': score}
+
+
+def _split_cpus(parallel: int) -> List[List[int]]:
+    """Disjoint CPU core slices, one per slot (the same full set when there are fewer cores than slots)."""
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    if len(cpus) < parallel:
+        return [cpus] * parallel
+    size = len(cpus) // parallel
+    return [cpus[i * size:(i + 1) * size] for i in range(parallel)]
+
+
+def _run_trial(trainer_kwargs: Dict, cpus: List[int]) -> Dict:
+    """Pool task: train one trial pinned to `cpus`, return the final training metrics."""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    import torch
+    torch.set_num_threads(len(cpus))
+    # dataloader workers share the slice with the training threads
+    trainer_kwargs['workers'] = min(trainer_kwargs.get('workers', 8), max(len(cpus) - 1, 0))
+
+    from train import YOLOTrainer
+    results = YOLOTrainer(**trainer_kwargs).train()
+    metrics = getattr(results, 'results_dict', None) or {}
+    return {k: float(v) for k, v in metrics.items()}
+
+
+if __name__ == "__main__":
+    sweep = HyperparameterSweep(
+        trainer_kwargs=dict(model="yolov8n.pt", data="datasets/renesas/data.yaml", imgsz=640, batch=16,
+                            device="cpu", workers=4),
+        search_space={
+            'lr0': ('log', 1e-4, 5e-2),
+            'momentum': ('uniform', 0.85, 0.98),
+            'weight_decay': ('log', 1e-5, 1e-3),
+            'mosaic': ('choice', [0.5, 1.0]),
+            'hsv_s': ('uniform', 0.3, 0.9),
+            'scale': ('uniform', 0.2, 0.7),
+        },
+        state_path="runs/sweep/sweep_state.json",
+        num_trials=27,
+        rungs=((0.25, 3), (0.5, 8), (1.0, 20)),
+        reduction_factor=3,
+        parallel=2,
+        devices=["cpu"],
+    )
+    sweep.run()
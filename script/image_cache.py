@@ -0,0 +1,191 @@
+# image_cache.py
+# Pre-decoded image store for training: every image is decoded once, resized so its long side is imgsz
+# (exactly like the ultralytics dataloader does every epoch), and appended to one flat uint8 file.
+# An index holds per-image offset, shape, original shape and the source file's size / mtime.
+# Dataloader workers open the file with a read-only np.memmap: reads come straight from the shared page
+# cache (no decode, nothing pickled). get() returns read-only views; the training dataset copies each image
+# (a cheap memcpy of the resized pixels) because ultralytics augmentations modify images in place.
+# Rebuilding reuses the entries of unchanged files, so the store carries over between runs.
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+CACHE_VERSION = 1
+# index columns
+OFFSET, HEIGHT, WIDTH, CHANNELS, HEIGHT0, WIDTH0, SIZE, MTIME = range(8)
+
+
+class MmapImageCache:
+    def __init__(self, cache_dir: str):
+        """
+        Open an existing cache (the pixel data is mapped lazily, once per process).
+
+        Args:
+            cache_dir: folder written by `MmapImageCache.build`
+        """
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != CACHE_VERSION:
+            raise ValueError(f"Unsupported image cache version in '{cache_dir}'")
+        self.imgsz = self.meta['imgsz']
+        self.index = np.load(os.path.join(cache_dir, 'index.npy'))  # int64 (N, 8), see the column constants
+        self.paths = np.load(os.path.join(cache_dir, 'paths.npy'))  # str (N,), absolute image paths
+        self.lookup = {str(p): i for i, p in enumerate(self.paths)}
+        self._data = None
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getstate__(self):
+        # dataloader workers started with spawn get the small index, never a copy of the mapped pixels
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            path = os.path.join(self.cache_dir, 'images.u8')
+            self._data = (np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path)
+                          else np.zeros(0, dtype=np.uint8))
+        return self._data
+
+    def get(self, i: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """(resized BGR image as a read-only view into the map, original (h, w)) of cache row i."""
+        offset, h, w, c, h0, w0 = self.index[i, :SIZE]
+        return self.data[offset:offset + h * w * c].reshape(h, w, c), (int(h0), int(w0))
+
+    def rows_for(self, image_paths: Sequence[str], workers: Optional[int] = None) -> np.ndarray:
+        """Cache row of every image, or -1 when it is missing, unreadable or changed since it was cached."""
+        rows = np.array([self.lookup.get(os.path.abspath(p), -1) for p in image_paths], dtype=np.int64)
+        stats = _stat_many(image_paths, workers)
+        cached = rows >= 0
+        current = self.index[rows[cached]]
+        valid = ((current[:, SIZE] == stats[cached, 0]) & (current[:, MTIME] == stats[cached, 1])
+                 & (current[:, HEIGHT] > 0))
+        rows[np.flatnonzero(cached)[~valid]] = -1
+        return rows
+
+    # ------------------------------
+    # Building
+    # ------------------------------
+    @classmethod
+    def build(cls, cache_dir: str, image_paths: Sequence[str], imgsz: int = 640, workers: Optional[int] = None,
+              chunk_size: int = 256) -> 'MmapImageCache':
+        """
+        Build (or incrementally rebuild) the cache for `image_paths`.
+
+        Args:
+            cache_dir: output folder
+            image_paths: images to cache, in dataset order
+            imgsz: long side after resizing (must match the training imgsz)
+            workers: decoding processes (None = os.cpu_count())
+            chunk_size: images decoded per round, bounds the memory of in-flight images
+
+        Returns:
+            the opened cache
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        paths = [os.path.abspath(p) for p in image_paths]
+        stats = _stat_many(paths, workers)
+
+        old = None
+        try:
+            old = cls(cache_dir)
+            if old.imgsz != imgsz:
+                old = None
+        except (OSError, ValueError):
+            pass
+        old_rows = np.full(len(paths), -1, dtype=np.int64)
+        reusable = np.zeros(len(paths), dtype=bool)
+        if old is not None:
+            old_rows[:] = [old.lookup.get(p, -1) for p in paths]
+            hit = old_rows >= 0
+            rows = old_rows[hit]
+            reusable[hit] = (old.index[rows, SIZE] == stats[hit, 0]) & (old.index[rows, MTIME] == stats[hit, 1])
+        if old is not None and reusable.all() and len(old) == len(paths):
+            print(f"Image cache '{cache_dir}' is up to date ({len(paths)} images)")
+            return old
+
+        data_tmp = os.path.join(cache_dir, 'images.u8.tmp')
+        index = np.zeros((len(paths), 8), dtype=np.int64)
+        index[:, SIZE:] = stats
+        offset = 0
+        num_decoded = 0
+        with open(data_tmp, 'wb') as out, ProcessPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(paths), chunk_size):
+                end = min(start + chunk_size, len(paths))
+                todo = [i for i in range(start, end) if not reusable[i]]
+                decoded = dict(zip(todo, executor.map(_decode_resized, [(paths[i], imgsz) for i in todo],
+                                                      chunksize=max(len(todo) // (4 * (workers or os.cpu_count())), 1))))
+                num_decoded += len(todo)
+                for i in range(start, end):
+                    if reusable[i]:
+                        image, (h0, w0) = old.get(old_rows[i])
+                        image = image if image.size else None
+                    else:
+                        image, (h0, w0) = decoded.pop(i)
+                    if image is None:
+                        index[i, OFFSET:SIZE] = (offset, 0, 0, 0, h0, w0)  # unreadable: the dataloader decodes it
+                        continue
+                    out.write(np.ascontiguousarray(image).data)
+                    index[i, OFFSET:SIZE] = (offset, *image.shape, h0, w0)
+                    offset += image.nbytes
+                print(f"Image cache: {end}/{len(paths)} images ({offset / 2 ** 30:.2f} GB)", end='\r')
+        print()
+
+        np.save(os.path.join(cache_dir, 'index.tmp.npy'), index)
+        np.save(os.path.join(cache_dir, 'paths.tmp.npy'), np.array(paths))
+        os.replace(data_tmp, os.path.join(cache_dir, 'images.u8'))
+        os.replace(os.path.join(cache_dir, 'index.tmp.npy'), os.path.join(cache_dir, 'index.npy'))
+        os.replace(os.path.join(cache_dir, 'paths.tmp.npy'), os.path.join(cache_dir, 'paths.npy'))
+        with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'imgsz': imgsz, 'num_images': len(paths),
+                       'num_bytes': offset, 'reused_images': int(reusable.sum())}, f, indent=2)
+        print(f"Image cache '{cache_dir}': {len(paths)} images, {num_decoded} decoded, "
+              f"{int(reusable.sum())} reused, {offset / 2 ** 30:.2f} GB")
+        return cls(cache_dir)
+
+
+def _stat_many(paths: Sequence[str], workers: Optional[int] = None) -> np.ndarray:
+    """int64 (N, 2) size and mtime_ns, (-1, -1) for missing files; threads hide the latency of network storage."""
+    def stat(path: str) -> Tuple[int, int]:
+        try:
+            st = os.stat(path)
+            return st.st_size, st.st_mtime_ns
+        except OSError:
+            return -1, -1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return np.array(list(pool.map(stat, paths)), dtype=np.int64).reshape(-1, 2)
+
+
+def _decode_resized(task: Tuple[str, int]) -> Tuple[Optional[np.ndarray], Tuple[int, int]]:
+    """Pool task: decode one image and resize its long side to imgsz (same rule as ultralytics load_image)."""
+    path, imgsz = task
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None, (0, 0)
+    h0, w0 = image.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        image = cv2.resize(image, (w, h), interpolation=cv2.INTER_LINEAR)
+    return image, (h0, w0)
+
+
+def read_image_list(list_path: str) -> List[str]:
+    """Image paths of a split file written by DatasetPreparer (one path per line)."""
+    with open(list_path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    # pre-build before training (YOLOTrainer(image_cache_dir=...) also builds it on start)
+    MmapImageCache.build("runs/image_cache/train", read_image_list("./output/train.txt"), imgsz=640)
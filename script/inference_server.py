@@ -0,0 +1,385 @@
+# inference_server.py
+# Long-lived local inference server: the model is loaded once and shared by every client.
+# Requests (encoded image bytes) arrive over HTTP on a TCP port or a Unix socket, are grouped by a
+# dynamic batcher (up to max_batch images, waiting at most max_wait_ms for the batch to fill), run as
+# one forward pass, and each request gets its own detections back as JSON.
+#
+# With --workers N the model is loaded in the parent and N forked worker processes accept from the
+# same listening socket, so the weights are shared copy-on-write instead of loaded N times.
+#
+#   python script/inference_server.py --model best.onnx --port 8000 --workers 2
+#   curl --data-binary @image.jpg http://127.0.0.1:8000/predict
+#   curl http://127.0.0.1:8000/metrics
+import argparse
+import collections
+import http.client
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+
+class DynamicBatcher:
+    def __init__(self, infer_fn: Callable[[List[np.ndarray]], List[np.ndarray]], max_batch: int = 8,
+                 max_wait_ms: float = 5.0, max_queue: int = 256, window: int = 1000):
+        """
+        Args:
+            infer_fn: list of BGR images -> list of (N, 6) [x1, y1, x2, y2, conf, cls] detections
+            max_batch: largest batch sent to the model
+            max_wait_ms: how long the first request of a batch waits for more requests
+            max_queue: pending requests before submit() rejects new ones
+            window: recent requests kept for the latency percentiles
+        """
+        self.infer_fn = infer_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.batches = 0
+        self.batch_sizes = collections.Counter()
+        self.queue_ms = collections.deque(maxlen=window)
+        self.inference_ms = collections.deque(maxlen=window)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image: np.ndarray) -> Future:
+        """Queue one image; the future resolves to its (N, 6) detections."""
+        future = Future()
+        try:
+            self._queue.put_nowait((time.perf_counter(), image, future))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise
+        return future
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            def percentiles(values):
+                if not values:
+                    return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+                p50, p95, p99 = np.percentile(np.array(values), [50, 95, 99])
+                return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+            return {'pid': os.getpid(), 'queue_depth': self._queue.qsize(), 'requests': self.requests,
+                    'rejected': self.rejected, 'errors': self.errors, 'batches': self.batches,
+                    'mean_batch_size': self.requests / max(self.batches, 1),
+                    'batch_sizes': dict(sorted(self.batch_sizes.items())),
+                    'queue_ms': percentiles(self.queue_ms), 'inference_ms': percentiles(self.inference_ms)}
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            started = time.perf_counter()
+            try:
+                detections = self.infer_fn([image for _, image, _ in batch])
+            except Exception as e:  # the error goes back to every request of the batch
+                with self._lock:
+                    self.errors += len(batch)
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.batch_sizes[len(batch)] += 1
+                self.queue_ms.extend((started - queued_at) * 1000 for queued_at, _, _ in batch)
+                self.inference_ms.append(elapsed_ms)
+            for (_, _, future), det in zip(batch, detections):
+                future.set_result(det)
+
+
+def load_backend(model_path: str, backend: str = 'auto', imgsz: int = 640, conf: float = 0.25, iou: float = 0.7,
+                 device: Optional[str] = None, max_batch: int = 8, threads: Optional[int] = None):
+    """
+    Load the model and return (prepare, names). prepare() is called once in every worker process and
+    returns the batch inference function; the weights loaded here are shared by forked workers.
+    """
+    if backend == 'auto':
+        backend = 'onnx' if model_path.endswith('.onnx') else 'torch'
+
+    if backend == 'onnx':
+        import ast
+        import onnx
+        from onnx_backend import OnnxDetector
+
+        # ONNX Runtime thread pools do not survive fork(), so each worker opens its own session
+        metadata = {p.key: p.value for p in onnx.load(model_path, load_external_data=False).metadata_props}
+        names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+
+        def prepare():
+            detector = OnnxDetector(model_path, imgsz=imgsz, intra_op_threads=threads, max_batch=max_batch)
+            return lambda images: detector.predict(images, conf=conf, iou=iou)
+        return prepare, names
+
+    from ultralytics import YOLO
+    model = YOLO(model_path)  # loaded before fork(): workers share the weights copy-on-write
+
+    def prepare():
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+
+        def infer(images):
+            results = model.predict(images, imgsz=imgsz, conf=conf, iou=iou, device=device, verbose=False)
+            return [r.boxes.data.cpu().numpy() for r in results]
+        return infer
+    return prepare, model.names
+
+
+def make_handler(batcher: DynamicBatcher, names: Dict[int, str], timeout: float = 30.0):
+    class PredictHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive: clients can reuse one connection
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/metrics':
+                self._send_json(200, batcher.metrics())
+            elif path == '/health':
+                self._send_json(200, {'status': 'ok', 'pid': os.getpid()})
+            else:
+                self._send_json(404, {'error': f"unknown path {path}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/predict':
+                self._send_json(404, {'error': f"unknown path {url.path}"})
+                return
+            started = time.perf_counter()
+            length = self.headers.get('Content-Length', '')
+            if not length.isdigit() or int(length) == 0:
+                self._send_json(400, {'error': 'an image body with a Content-Length is required'})
+                return
+            body = self.rfile.read(int(length))
+            # the batch runs at the server threshold; a client may ask for a stricter one
+            try:
+                min_conf = float(parse_qs(url.query).get('conf', [0])[0])
+            except ValueError:
+                min_conf = float('nan')
+            if not 0 <= min_conf <= 1:
+                self._send_json(400, {'error': 'conf must be a number between 0 and 1'})
+                return
+            try:
+                image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+            except cv2.error:
+                image = None
+            if image is None:
+                self._send_json(400, {'error': 'body is not a decodable image'})
+                return
+            try:
+                det = batcher.submit(image).result(timeout=timeout)
+            except queue.Full:
+                self._send_json(503, {'error': 'server busy, queue is full'})
+                return
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+                return
+
+            det = det[det[:, 4] >= min_conf]
+            self._send_json(200, {'boxes': det[:, :4].round(2).tolist(), 'scores': det[:, 4].round(4).tolist(),
+                                  'classes': det[:, 5].astype(int).tolist(),
+                                  'names': [names.get(int(c), str(int(c))) for c in det[:, 5]],
+                                  'latency_ms': (time.perf_counter() - started) * 1000})
+
+        def _send_json(self, status: int, payload: Dict):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # one line per request would dominate the cost of small requests
+
+    return PredictHandler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)  # BaseHTTPRequestHandler expects a (host, port) address
+
+
+def serve(model_path: str, host: str = '127.0.0.1', port: int = 8000, unix_socket: Optional[str] = None,
+          workers: int = 1, backend: str = 'auto', imgsz: int = 640, conf: float = 0.25, iou: float = 0.7,
+          device: Optional[str] = None, max_batch: int = 8, max_wait_ms: float = 5.0, threads: Optional[int] = None):
+    """
+    Run the server until interrupted.
+
+    Args:
+        unix_socket: listen on this socket path instead of host:port
+        workers: forked worker processes sharing the listening socket and the loaded weights
+        threads: inference threads per worker (None = backend default)
+        max_batch, max_wait_ms: dynamic batching policy
+    """
+    prepare, names = load_backend(model_path, backend, imgsz, conf, iou, device, max_batch, threads)
+
+    # bind before forking so every worker accepts from the same socket
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, None, bind_and_activate=True)
+        address = unix_socket
+    else:
+        server = ThreadingHTTPServer((host, port), None)
+        address = f"http://{host}:{server.server_address[1]}"
+
+    def run_worker():
+        batcher = DynamicBatcher(prepare(), max_batch=max_batch, max_wait_ms=max_wait_ms)
+        server.RequestHandlerClass = make_handler(batcher, names)
+        server.serve_forever()
+
+    if workers <= 1:
+        print(f"[INFO] Serving {model_path} on {address} (max_batch={max_batch}, max_wait_ms={max_wait_ms})")
+        try:
+            run_worker()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_worker()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f"[INFO] Serving {model_path} on {address} with {workers} workers {children} "
+          f"(max_batch={max_batch}, max_wait_ms={max_wait_ms})")
+
+    def stop(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for _ in children:
+            os.wait()
+    except KeyboardInterrupt:
+        stop(None, None)
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class InferenceClient:
+    def __init__(self, address: str = 'http://127.0.0.1:8000', timeout: float = 30.0):
+        """
+        Args:
+            address: 'http://host:port' or the path of the server's Unix socket
+        """
+        if address.startswith('http://'):
+            url = urlparse(address)
+            self._connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+        else:
+            self._connection = _UnixHTTPConnection(address, timeout)
+
+    def predict(self, image, conf: Optional[float] = None) -> np.ndarray:
+        """
+        Args:
+            image: image path, encoded image bytes or a BGR array
+
+        Returns:
+            (N, 6) [x1, y1, x2, y2, conf, cls]
+        """
+        if isinstance(image, str):
+            with open(image, 'rb') as f:
+                body = f.read()
+        elif isinstance(image, np.ndarray):
+            body = cv2.imencode('.png', image)[1].tobytes()  # lossless, results match a local prediction
+        else:
+            body = bytes(image)
+        path = '/predict' if conf is None else f"/predict?conf={conf}"
+        result = self._request('POST', path, body)
+        det = np.zeros((len(result['boxes']), 6), dtype=np.float32)
+        if len(det):
+            det[:, :4] = result['boxes']
+            det[:, 4] = result['scores']
+            det[:, 5] = result['classes']
+        return det
+
+    def metrics(self) -> Dict:
+        return self._request('GET', '/metrics')
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None) -> Dict:
+        self._connection.request(method, path, body=body)
+        response = self._connection.getresponse()
+        payload = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"server returned {response.status}: {payload.get('error')}")
+        return payload
+
+    def close(self):
+        self._connection.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Local YOLO inference server with dynamic batching')
+    parser.add_argument('--model', required=True, help='.pt / .yaml (PyTorch) or .onnx (ONNX Runtime)')
+    parser.add_argument('--backend', choices=('auto', 'torch', 'onnx'), default='auto')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket', default=None, help='listen on a Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None, help='inference threads per worker')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--iou', type=float, default=0.7)
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    args = parser.parse_args(argv)
+    serve(args.model, args.host, args.port, args.unix_socket, args.workers, args.backend, args.imgsz, args.conf,
+          args.iou, args.device, args.max_batch, args.max_wait_ms, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# inference_utils.py
+# Shared NumPy helpers for the inference scripts: letterbox preprocessing, mapping boxes back to the
+# original image, NMS / WBF and tiled inference. Kept free of torch / ultralytics imports so any backend
+# can use them.
+import os
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.bmp', '.dng', '.jpeg', '.jpg', '.mpo', '.png', '.tif', '.tiff', '.webp', '.pfm')
+PAD_VALUE = 114
+
+
+def list_images(folder: str) -> List[str]:
+    """All image files under `folder` (recursive, sorted)."""
+    paths = []
+    stack = [folder]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                    paths.append(entry.path)
+    return sorted(paths)
+
+
+def letterbox(image: np.ndarray, new_shape: int = 640, out: Optional[np.ndarray] = None
+              ) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    Resize keeping the aspect ratio and pad to a square `new_shape` (same geometry as ultralytics LetterBox).
+
+    Args:
+        image: HWC uint8 BGR image
+        new_shape: output size (square)
+        out: optional preallocated (new_shape, new_shape, 3) uint8 buffer to write into
+
+    Returns:
+        (letterboxed image, scale ratio, (pad_left, pad_top))
+    """
+    h, w = image.shape[:2]
+    ratio = min(new_shape / h, new_shape / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    pad_w, pad_h = (new_shape - new_w) / 2, (new_shape - new_h) / 2
+    left, top = int(round(pad_w - 0.1)), int(round(pad_h - 0.1))
+
+    if out is None:
+        out = np.empty((new_shape, new_shape, 3), dtype=np.uint8)
+    out.fill(PAD_VALUE)
+    resized = image if (new_w, new_h) == (w, h) else cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    out[top:top + new_h, left:left + new_w] = resized
+    return out, ratio, (left, top)
+
+
+def scale_boxes_back(boxes: np.ndarray, ratio: float, pad: Tuple[int, int], orig_shape: Tuple[int, int]) -> np.ndarray:
+    """Map xyxy boxes from letterboxed coordinates to the original image (in place) and clip them."""
+    boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / ratio).clip(0, orig_shape[1])
+    boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / ratio).clip(0, orig_shape[0])
+    return boxes
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """IoU of one xyxy box against (N, 4) xyxy boxes."""
+    iw = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    ih = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    inter = iw * ih
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def nms(detections: np.ndarray, iou_threshold: float = 0.7, max_det: int = 300,
+        class_agnostic: bool = False) -> np.ndarray:
+    """
+    Greedy NMS on (N, 6) [x1, y1, x2, y2, conf, cls] detections. Class-aware by offsetting the boxes of
+    each class so boxes of different classes never overlap (same trick as ultralytics).
+
+    Returns:
+        kept detections sorted by confidence
+    """
+    if len(detections) == 0:
+        return detections
+    order = np.argsort(-detections[:, 4], kind='stable')
+    detections = detections[order]
+    boxes = detections[:, :4].astype(np.float64)
+    if not class_agnostic:
+        boxes = boxes + detections[:, 5:6] * (boxes.max() + 1)
+
+    keep = []
+    candidates = np.arange(len(detections))
+    while len(candidates) and len(keep) < max_det:
+        i = candidates[0]
+        keep.append(i)
+        rest = candidates[1:]
+        candidates = rest[box_iou(boxes[i], boxes[rest]) <= iou_threshold]
+    return detections[keep]
+
+
+def tile_windows(height: int, width: int, tile_size: int = 640, overlap: float = 0.2) -> List[Tuple[int, int, int, int]]:
+    """
+    Overlapping (x1, y1, x2, y2) windows covering the image. Neighbouring tiles share `overlap` of the
+    tile size and the last row / column is aligned to the image border, so every tile is full size
+    (or the whole image along a side shorter than tile_size).
+    """
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        step = max(int(tile_size * (1 - overlap)), 1)
+        positions = list(range(0, length - tile_size, step))
+        return positions + [length - tile_size]
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def weighted_boxes_fusion(detections: np.ndarray, iou_threshold: float = 0.55, max_det: int = 300,
+                          class_agnostic: bool = False) -> np.ndarray:
+    """
+    Weighted boxes fusion on (N, 6) [x1, y1, x2, y2, conf, cls] detections: boxes of the same class
+    overlapping the highest-scoring box of a cluster are averaged, weighted by confidence, instead of
+    discarded. The fused confidence is the cluster maximum, so an object seen by a single tile keeps
+    its score.
+
+    Returns:
+        fused detections sorted by confidence
+    """
+    if len(detections) == 0:
+        return detections
+    detections = detections[np.argsort(-detections[:, 4], kind='stable')]
+    boxes = detections[:, :4].astype(np.float64)
+    if not class_agnostic:
+        boxes = boxes + detections[:, 5:6] * (boxes.max() + 1)
+
+    fused = []
+    candidates = np.arange(len(detections))
+    while len(candidates) and len(fused) < max_det:
+        i = candidates[0]
+        members = candidates[box_iou(boxes[i], boxes[candidates]) > iou_threshold]
+        members = np.union1d(members, [i])
+        weights = detections[members, 4:5]
+        box = (detections[members, :4] * weights).sum(axis=0) / weights.sum()
+        fused.append([*box, detections[i, 4], detections[i, 5]])
+        candidates = np.setdiff1d(candidates, members, assume_unique=True)  # stays sorted by confidence
+    return np.array(fused, dtype=np.float32).reshape(-1, 6)
+
+
+def merge_detections(detections: List[np.ndarray], method: str = 'nms', iou_threshold: float = 0.5,
+                     max_det: int = 300) -> np.ndarray:
+    """Concatenate per-tile detections (already in full-image coordinates) and merge duplicates across
+    tile seams with class-aware 'nms' or 'wbf'."""
+    merged = np.concatenate(detections) if detections else np.zeros((0, 6), dtype=np.float32)
+    if method == 'wbf':
+        return weighted_boxes_fusion(merged, iou_threshold, max_det)
+    if method == 'nms':
+        return nms(merged, iou_threshold, max_det)
+    raise ValueError("method must be 'nms' or 'wbf'")
+
+
+def tiled_predict(image: np.ndarray, infer_fn, tile_size: int = 640, overlap: float = 0.2, full_image: bool = True,
+                  merge: str = 'nms', iou_threshold: float = 0.5, max_det: int = 300) -> np.ndarray:
+    """
+    Sliced inference on one large image: the tiles (plus the whole image when `full_image`, which finds the
+    objects larger than a tile) run as one batch through `infer_fn`, boxes are shifted back to image
+    coordinates and merged across tile seams.
+
+    Args:
+        image: BGR HWC image
+        infer_fn: list of BGR images -> list of (N, 6) [x1, y1, x2, y2, conf, cls] in each image's coordinates
+
+    Returns:
+        (N, 6) detections in image coordinates
+    """
+    h, w = image.shape[:2]
+    windows = tile_windows(h, w, tile_size, overlap)
+    crops = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in windows]
+    offsets = [(x1, y1) for x1, y1, _, _ in windows]
+    if full_image and len(windows) > 1:
+        crops.append(image)
+        offsets.append((0, 0))
+
+    shifted = []
+    for det, (x, y) in zip(infer_fn(crops), offsets):
+        det = np.array(det, dtype=np.float32).reshape(-1, 6)
+        det[:, [0, 2]] += x
+        det[:, [1, 3]] += y
+        shifted.append(det)
+    return merge_detections(shifted, merge, iou_threshold, max_det)
@@ -0,0 +1,122 @@
+# onnx_backend.py
+# CPU inference backend for models exported with convert_to_onnx.py, using ONNX Runtime only:
+# NumPy letterbox preprocessing into preallocated input buffers, one reusable session with tuned
+# intra/inter-op thread counts, and vectorized decoding + NMS. Does not import torch or ultralytics,
+# so it starts much faster than YOLO(...).
+import ast
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import onnxruntime as ort
+
+from inference_utils import letterbox, nms, scale_boxes_back
+
+
+class OnnxDetector:
+    def __init__(self,
+                 model_path: str,
+                 imgsz: int = 640,
+                 intra_op_threads: Optional[int] = None,
+                 inter_op_threads: int = 1,
+                 max_batch: int = 16):
+        """
+        Args:
+            model_path: exported .onnx file
+            imgsz: input size, only used when the model has dynamic spatial axes
+            intra_op_threads: threads used inside one operator (None = number of CPU cores)
+            inter_op_threads: threads running independent operators in parallel (1 is best for YOLO graphs)
+            max_batch: largest batch preallocated for models with a dynamic batch axis
+        """
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads or os.cpu_count()
+        options.inter_op_num_threads = inter_op_threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch, _, height, width = model_input.shape
+        self.imgsz = height if isinstance(height, int) else imgsz
+        if isinstance(width, int) and width != self.imgsz:
+            raise ValueError("Only square model inputs are supported")
+        # fixed batch axis (default export): run in slices of that size, always feeding the full buffer
+        self.fixed_batch = isinstance(batch, int)
+        self.batch_size = batch if self.fixed_batch else max_batch
+        self.input_dtype = np.float16 if model_input.type == 'tensor(float16)' else np.float32
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names: Dict[int, str] = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+
+        # preallocated buffers reused by every call
+        self._input = np.empty((self.batch_size, 3, self.imgsz, self.imgsz), dtype=self.input_dtype)
+        self._letterbox = np.empty((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+
+    def predict(self, images: Sequence[np.ndarray], conf: float = 0.25, iou: float = 0.7,
+                classes: Optional[Sequence[int]] = None, max_det: int = 300) -> List[np.ndarray]:
+        """
+        Args:
+            images: BGR HWC uint8 images (any size)
+
+        Returns:
+            per image (N, 6) [x1, y1, x2, y2, conf, cls] in original image coordinates
+        """
+        results = []
+        for start in range(0, len(images), self.batch_size):
+            chunk = images[start:start + self.batch_size]
+            geometry = []
+            for i, image in enumerate(chunk):
+                boxed, ratio, pad = letterbox(image, self.imgsz, out=self._letterbox)
+                # BGR HWC -> RGB CHW, scaled to 0-1, written straight into the input buffer
+                np.multiply(boxed[:, :, ::-1].transpose(2, 0, 1), 1 / 255.0, out=self._input[i], casting='unsafe')
+                geometry.append((ratio, pad, image.shape[:2]))
+            detections = self._run(len(chunk), conf, iou, classes, max_det)
+            for det, (ratio, pad, shape) in zip(detections, geometry):
+                scale_boxes_back(det[:, :4], ratio, pad, shape)
+                results.append(det)
+        return results
+
+    def predict_batch(self, batch: np.ndarray, conf: float = 0.25, iou: float = 0.7,
+                      classes: Optional[Sequence[int]] = None, max_det: int = 300) -> List[np.ndarray]:
+        """
+        Args:
+            batch: already letterboxed uint8 (B, 3, imgsz, imgsz) RGB batch
+
+        Returns:
+            per image (N, 6) [x1, y1, x2, y2, conf, cls] in letterbox coordinates
+        """
+        results = []
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            np.multiply(chunk, 1 / 255.0, out=self._input[:len(chunk)], casting='unsafe')
+            results.extend(self._run(len(chunk), conf, iou, classes, max_det))
+        return results
+
+    def _run(self, n: int, conf: float, iou: float, classes: Optional[Sequence[int]], max_det: int) -> List[np.ndarray]:
+        feed = self._input if self.fixed_batch else self._input[:n]
+        output = self.session.run(None, {self.input_name: feed})[0][:n]
+        return [self._postprocess(out, conf, iou, classes, max_det) for out in output]
+
+    def _postprocess(self, output: np.ndarray, conf: float, iou: float, classes: Optional[Sequence[int]],
+                     max_det: int) -> np.ndarray:
+        output = output.astype(np.float32, copy=False)
+        if output.shape[-1] == 6 and output.shape[0] <= 1000:
+            # end-to-end export (NMS inside the graph): rows are already [x1, y1, x2, y2, conf, cls]
+            det = output[output[:, 4] > conf]
+            if classes is not None:
+                det = det[np.isin(det[:, 5], classes)]
+        else:
+            # (4 + nc, anchors): cx, cy, w, h then one score per class
+            scores = output[4:]
+            cls = scores.argmax(axis=0)
+            best = scores[cls, np.arange(scores.shape[1])]
+            mask = best > conf
+            cx, cy, w, h = output[:4, mask]
+            det = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2, best[mask], cls[mask]], axis=1).astype(np.float32)
+            if classes is not None:
+                det = det[np.isin(det[:, 5], classes)]
+            if len(det) > 30000:  # same pre-NMS cap as ultralytics
+                det = det[np.argpartition(-det[:, 4], 30000)[:30000]]
+            det = nms(det, iou, max_det)
+        return det[:max_det]
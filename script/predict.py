@@ -1,17 +1,64 @@
-from ultralytics import YOLO
+import collections
 import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from detection_writer import DetectionWriter
+from inference_utils import IMAGE_EXTENSIONS, list_images, tiled_predict
+
+class StreamStats:
+    def __init__(self, window=1000):
+        """
+        串流統計：擷取/處理/丟棄的幀數與最近 window 幀的延遲，記憶體用量固定
+        :param window: 計算延遲百分位數所保留的最近幀數
+        """
+        self.captured = 0
+        self.processed = 0
+        self.dropped = 0
+        self.latencies_ms = collections.deque(maxlen=window)  # 擷取 -> 偵測完成
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """目前的計數與延遲 (p50/p95/p99 毫秒)、處理 FPS"""
+        with self._lock:
+            latencies = np.array(self.latencies_ms) if self.latencies_ms else np.zeros(1)
+            elapsed = time.perf_counter() - self.started
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            return {'captured': self.captured, 'processed': self.processed, 'dropped': self.dropped,
+                    'drop_ratio': self.dropped / max(self.captured, 1),
+                    'latency_ms_p50': float(p50), 'latency_ms_p95': float(p95), 'latency_ms_p99': float(p99),
+                    'fps': self.processed / max(elapsed, 1e-9)}
+
 
 class YOLODetector:
-    def __init__(self, model_path="yolov8n.pt"):
+    def __init__(self, model_path="yolov8n.pt", backend="auto", onnx_threads=None):
         """
         初始化 YOLO 模型
-        :param model_path: 模型檔路徑 (如: 'yolov8n.pt')
+        :param model_path: 模型檔路徑 (如: 'yolov8n.pt'，或 convert_to_onnx.py 匯出的 .onnx)
+        :param backend: 'torch'、'onnx' (ONNX Runtime CPU 推論，不載入 torch) 或 'auto' (依副檔名判斷)
+        :param onnx_threads: ONNX Runtime 運算子內的執行緒數 (None=全部核心)
         """
         if not os.path.exists(model_path) and not model_path.startswith("yolov8"):
             raise FileNotFoundError(f"找不到指定的模型檔案: {model_path}")
-        self.model = YOLO(model_path)
+        if backend == "auto":
+            backend = "onnx" if model_path.endswith(".onnx") else "torch"
+        self.backend = backend
+        if backend == "onnx":
+            from onnx_backend import OnnxDetector
+            self.model = OnnxDetector(model_path, intra_op_threads=onnx_threads)
+        else:
+            from ultralytics import YOLO  # 延遲載入：ONNX 後端不需要 torch
+            self.model = YOLO(model_path)
+        self.names = self.model.names
+        self.stream_stats = None  # stream() 執行時的 StreamStats
 
-    def predict(self, source, conf=0.25, iou=0.45, save=True, show=False, device=None, classes=None, imgsz=640):
+    def predict(self, source, conf=0.25, iou=0.45, save=True, show=False, device=None, classes=None, imgsz=640,
+                output_path=None):
         """
         使用 YOLO 模型進行檢測
         :param source: 檢測來源 (圖片路徑, 影片路徑, 0=webcam)
@@ -22,7 +69,15 @@ class YOLODetector:
         :param device: 運行裝置 ('cpu' 或 '0' 表示 GPU)
         :param classes: 只檢測特定類別 (list of int)
         :param imgsz: 輸入影像大小
+        :param output_path: 若指定，以 stream 模式將偵測結果 (path, class, conf, xyxy) 寫入欄式檔案
+                            (.parquet，無 pyarrow 時為 .npz 分塊資料夾)，不保留 Results，記憶體用量固定；
+                            此時回傳寫入的影像數與偵測數
+        :return: torch 後端為 ultralytics Results；ONNX 後端為每張影像/每一幀的
+                 (路徑, (N, 6) [x1, y1, x2, y2, conf, cls]) 原圖座標
         """
+        if self.backend == "onnx":
+            return self._predict_onnx(source, conf, iou, save, show, classes, output_path)
+
         results = self.model.predict(
             source=source,
             conf=conf,
@@ -31,19 +86,229 @@ class YOLODetector:
             show=show,
             device=device,
             classes=classes,
-            imgsz=imgsz
+            imgsz=imgsz,
+            stream=output_path is not None
         )
+        if output_path is None:
+            return results
+
+        frames = collections.Counter()  # Results 不含幀號，自行計算每個影片/串流的幀數
+        with DetectionWriter(output_path) as writer:
+            for r in results:
+                # 影片/webcam 的每一幀以 "路徑:幀號" 區分
+                path = r.path
+                if not path.lower().endswith(IMAGE_EXTENSIONS):
+                    path = f"{r.path}:{frames[r.path]}"
+                    frames[r.path] += 1
+                writer.write(path, r.boxes.data.cpu().numpy())
+        return {'images': writer.num_images, 'detections': writer.num_rows}
+
+    def stream(self, source=0, conf=0.25, iou=0.45, device=None, classes=None, imgsz=640,
+               queue_size=1, drop_frames=True, stats_window=1000, tile_size=None, tile_overlap=0.2):
+        """
+        即時串流偵測 (generator)：擷取執行緒讀取影格放入有界佇列，推論在呼叫端執行緒進行，
+        不累積 Results，可長時間對攝影機穩定運行
+        :param source: 影片路徑、攝影機編號或串流網址 (RTSP/HTTP)
+        :param queue_size: 佇列最多保留的影格數
+        :param drop_frames: True=佇列滿時丟棄最舊影格 (最新影格優先，適合即時攝影機)；
+                            False=擷取端等待，不丟幀 (適合離線處理影片檔)
+        :param stats_window: 延遲統計保留的最近幀數
+        :param tile_size: 若指定，每幀以切塊推論 (見 predict_tiled)
+        :param tile_overlap: 相鄰切塊重疊比例
+        :return: 逐幀產生 (影格編號, BGR 影格, (N, 6) [x1, y1, x2, y2, conf, cls] 原圖座標)；
+                 計數與延遲可隨時由 self.stream_stats.snapshot() 取得
+        """
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            raise FileNotFoundError(f"無法開啟影像來源: {source}")
+        frames = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        stats = self.stream_stats = StreamStats(stats_window)
+
+        def capture():
+            frame_id = 0
+            try:
+                while not stop.is_set():
+                    ok, frame = cap.read()
+                    if not ok:
+                        break
+                    frame_id += 1
+                    item = (frame_id, time.perf_counter(), frame)
+                    with stats._lock:
+                        stats.captured += 1
+                    if drop_frames:
+                        while True:
+                            try:
+                                frames.put_nowait(item)
+                                break
+                            except queue.Full:
+                                try:
+                                    frames.get_nowait()  # 最新影格優先：丟棄最舊的一幀
+                                    with stats._lock:
+                                        stats.dropped += 1
+                                except queue.Empty:
+                                    pass
+                    else:
+                        while not stop.is_set():
+                            try:
+                                frames.put(item, timeout=0.1)
+                                break
+                            except queue.Full:
+                                continue
+            finally:
+                cap.release()
+                while not stop.is_set():  # 結束標記，必要時等待消費端騰出空間
+                    try:
+                        frames.put(None, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+
+        thread = threading.Thread(target=capture, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    break
+                frame_id, captured_at, frame = item
+                if tile_size:
+                    det = self.predict_tiled(frame, tile_size, tile_overlap, conf=conf, iou=iou, device=device,
+                                             classes=classes, imgsz=imgsz)
+                else:
+                    det = self._detect(frame, conf, iou, device, classes, imgsz)
+                with stats._lock:
+                    stats.processed += 1
+                    stats.latencies_ms.append((time.perf_counter() - captured_at) * 1000)
+                yield frame_id, frame, det
+        finally:
+            stop.set()
+            thread.join()
+
+    def predict_tiled(self, image, tile_size=640, overlap=0.2, full_image=True, merge="nms", conf=0.25, iou=0.45,
+                      device=None, classes=None, imgsz=640):
+        """
+        高解析度影像 (4K、空拍) 的切塊推論：切成重疊的 tile_size 切塊，所有切塊以一個批次推論，
+        框座標映射回原圖，再以類別感知 NMS 或 WBF 合併切塊接縫處的重複框；小物件不會因整張縮放到 imgsz 而消失
+        :param image: 圖片路徑或 BGR 影像
+        :param tile_size: 切塊大小 (像素)
+        :param overlap: 相鄰切塊重疊比例
+        :param full_image: 是否加上整張影像的推論 (偵測比切塊大的物件)
+        :param merge: 'nms' 或 'wbf' (weighted boxes fusion)
+        :return: (N, 6) [x1, y1, x2, y2, conf, cls] 原圖座標
+        """
+        if isinstance(image, str):
+            path, image = image, cv2.imread(image)
+            if image is None:
+                raise FileNotFoundError(f"無法讀取圖片: {path}")
+        return tiled_predict(image, lambda crops: self._detect_many(crops, conf, iou, device, classes, imgsz),
+                             tile_size, overlap, full_image, merge, iou)
+
+    def _detect(self, frame, conf, iou, device, classes, imgsz):
+        """單張 BGR 影像 -> (N, 6) [x1, y1, x2, y2, conf, cls] 原圖座標"""
+        return self._detect_many([frame], conf, iou, device, classes, imgsz)[0]
+
+    def _detect_many(self, frames, conf, iou, device, classes, imgsz):
+        """多張 BGR 影像以一個批次推論 -> 每張 (N, 6) 原圖座標"""
+        if self.backend == "onnx":
+            return self.model.predict(frames, conf=conf, iou=iou, classes=classes)
+        results = self.model.predict(frames, conf=conf, iou=iou, device=device, classes=classes, imgsz=imgsz,
+                                     verbose=False)
+        return [r.boxes.data.cpu().numpy() for r in results]
+
+    def _predict_onnx(self, source, conf, iou, save, show, classes, output_path,
+                      save_dir="runs/detect/predict_onnx"):
+        """ONNX Runtime 推論：以 OpenCV 讀取來源，逐張送入 OnnxDetector"""
+        if save:
+            os.makedirs(save_dir, exist_ok=True)
+        writer = DetectionWriter(output_path) if output_path is not None else None
+        results = []
+        try:
+            for path, frame in self._iter_source(source):
+                det = self.model.predict([frame], conf=conf, iou=iou, classes=classes)[0]
+                if writer is not None:
+                    writer.write(path, det)
+                else:
+                    results.append((path, det))
+                if save or show:
+                    annotated = self._draw(frame, det)
+                    if save:
+                        name = os.path.basename(path).replace(":", "_")
+                        if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                            name += ".jpg"
+                        cv2.imwrite(os.path.join(save_dir, name), annotated)
+                    if show:
+                        cv2.imshow("YOLO ONNX", annotated)
+                        if cv2.waitKey(1) & 0xFF == ord("q"):
+                            break
+        finally:
+            if writer is not None:
+                writer.close()
+            if show:
+                cv2.destroyAllWindows()
+        if writer is not None:
+            return {'images': writer.num_images, 'detections': writer.num_rows}
         return results
 
+    @staticmethod
+    def _iter_source(source):
+        """產生 (路徑, BGR 影像)：單張圖片、資料夾、影片檔或 webcam 編號；影片幀以 "路徑:幀號" 命名"""
+        if isinstance(source, str) and os.path.isdir(source):
+            for path in list_images(source):
+                image = cv2.imread(path)
+                if image is not None:
+                    yield path, image
+            return
+        if isinstance(source, str) and os.path.splitext(source)[1].lower() in IMAGE_EXTENSIONS:
+            image = cv2.imread(source)
+            if image is None:
+                raise FileNotFoundError(f"無法讀取圖片: {source}")
+            yield source, image
+            return
+
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            raise FileNotFoundError(f"無法開啟影像來源: {source}")
+        try:
+            frame_id = 0
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                frame_id += 1
+                yield f"{source}:{frame_id}", frame
+        finally:
+            cap.release()
+
+    def _draw(self, image, det):
+        """在影像副本上畫出偵測框與類別名稱"""
+        image = image.copy()
+        for x1, y1, x2, y2, score, cls in det:
+            p1, p2 = (int(x1), int(y1)), (int(x2), int(y2))
+            cv2.rectangle(image, p1, p2, (0, 255, 0), 2)
+            label = f"{self.names.get(int(cls), int(cls))} {score:.2f}"
+            cv2.putText(image, label, (p1[0], max(p1[1] - 4, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        return image
+
+
+def is_image_source(source):
+    """圖片檔或資料夾 -> True (用 predict)；影片、攝影機編號、串流網址 -> False (用 stream，記憶體固定)"""
+    return os.path.isdir(str(source)) or str(source).lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_live_source(source):
+    """攝影機或網路串流：stream() 應丟棄舊影格 (最新影格優先)"""
+    return isinstance(source, int) or str(source).startswith(("rtsp://", "http://", "https://"))
+
 
 def main():
     # === 這裡設定所有參數 ===
     CONFIG = {
         "model_path": "runs/detect/renesas/weights/best.pt",          # 模型檔路徑
-        "source": 0,                # 檢測來源 (圖片, 影片, 或 0=Webcam)
+        "source": 0,                # 檢測來源 (圖片, 資料夾, 影片, 或 0=Webcam)
         "conf": 0.8,                         # 置信度閾值
         "iou": 0.5,                          # IoU 閾值
-        "save": False,                        # 是否儲存結果
+        "save": False,                        # 是否儲存結果 (圖片 / 資料夾來源)
         "show": True,                       # 是否顯示結果
         "device": "0",                       # 使用 GPU: "0" 或 CPU: "cpu"
         "classes": None,                      # 只檢測特定類別 (如 0=person)，None=全部
@@ -53,22 +318,49 @@ def main():
     # 建立檢測器
     detector = YOLODetector(CONFIG["model_path"])
 
-    # 執行檢測
-    results = detector.predict(
-        source=CONFIG["source"],
+    source = CONFIG["source"]
+    if is_image_source(source):
+        # 圖片 / 資料夾：一般檢測
+        results = detector.predict(
+            source=source,
+            conf=CONFIG["conf"],
+            iou=CONFIG["iou"],
+            save=CONFIG["save"],
+            show=CONFIG["show"],
+            device=CONFIG["device"],
+            classes=CONFIG["classes"],
+            imgsz=CONFIG["imgsz"]
+        )
+
+        # 顯示結果摘要
+        print("檢測完成! 結果摘要：")
+        for r in results:
+            print(r)
+        return
+
+    # 影片 / 攝影機 / 串流：逐幀取得結果，記憶體固定；影片檔不丟幀，攝影機以最新影格優先
+    processed = 0
+    for frame_id, frame, det in detector.stream(
+        source=source,
         conf=CONFIG["conf"],
         iou=CONFIG["iou"],
-        save=CONFIG["save"],
-        show=CONFIG["show"],
         device=CONFIG["device"],
         classes=CONFIG["classes"],
-        imgsz=CONFIG["imgsz"]
-    )
+        imgsz=CONFIG["imgsz"],
+        drop_frames=is_live_source(source)
+    ):
+        processed += 1
+        if CONFIG["show"]:
+            cv2.imshow("YOLO", detector._draw(frame, det))
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+        if processed % 100 == 0:  # 以處理過的幀數計數，丟幀時 frame_id 會跳號
+            print(f"幀 {frame_id}: {len(det)} 個物件, 統計: {detector.stream_stats.snapshot()}")
 
-    # 顯示結果摘要
+    if CONFIG["show"]:
+        cv2.destroyAllWindows()
     print("檢測完成! 結果摘要：")
-    for r in results:
-        print(r)
+    print(detector.stream_stats.snapshot())
 
 
 if __name__ == "__main__":
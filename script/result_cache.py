@@ -0,0 +1,91 @@
+# result_cache.py
+# Content-addressed cache of detection results in a local SQLite file.
+# A result is keyed by the image (path + size + mtime, or a hash of its bytes) and by the inference
+# configuration (hash of the model weights, imgsz, conf, iou, ...). Cache hits skip inference entirely,
+# and since every finished batch is committed, an interrupted run resumes where it stopped.
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+
+class ResultCache:
+    def __init__(self, db_path: str, model_path: str, key_mode: str = 'stat', **params):
+        """
+        Args:
+            db_path: SQLite file
+            model_path: weights file, hashed into the configuration key
+            key_mode: 'stat' (path + size + mtime, no extra reads) or 'content' (SHA-1 of the image bytes,
+                      survives renames and copies)
+            params: inference settings that change the results (imgsz, conf, iou, classes, ...)
+        """
+        if key_mode not in ('stat', 'content'):
+            raise ValueError("key_mode must be 'stat' or 'content'")
+        self.key_mode = key_mode
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # written from the postprocessing thread, read from the main thread before it starts
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS weights (path TEXT PRIMARY KEY, size INTEGER, "
+                              "mtime_ns INTEGER, sha256 TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS results (image_key TEXT, config TEXT, path TEXT, "
+                              "boxes BLOB, PRIMARY KEY (image_key, config))")
+
+        config = dict(params, model=self._weights_hash(model_path))
+        self.config = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _weights_hash(self, model_path: str) -> str:
+        """SHA-256 of the weights, itself cached by path + size + mtime so large files are hashed once."""
+        if not os.path.isfile(model_path):
+            return model_path  # e.g. a model name resolved by ultralytics
+        st = os.stat(model_path)
+        path = os.path.abspath(model_path)
+        row = self.conn.execute("SELECT sha256 FROM weights WHERE path = ? AND size = ? AND mtime_ns = ?",
+                                (path, st.st_size, st.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        digest = _file_digest(model_path, hashlib.sha256())
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO weights VALUES (?, ?, ?, ?)",
+                              (path, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def image_key(self, image_path: str) -> str:
+        if self.key_mode == 'content':
+            return _file_digest(image_path, hashlib.sha1())
+        st = os.stat(image_path)
+        return f"{os.path.abspath(image_path)}:{st.st_size}:{st.st_mtime_ns}"
+
+    def iter_cached(self, image_keys: List[str], chunk_size: int = 900) -> Iterator[Tuple[str, np.ndarray]]:
+        """Yields (image key, (N, 6) float32 [x1, y1, x2, y2, conf, cls]) for every key with a cached result,
+        one SQL query per chunk so memory stays bounded."""
+        for i in range(0, len(image_keys), chunk_size):
+            chunk = image_keys[i:i + chunk_size]
+            rows = self.conn.execute(
+                f"SELECT image_key, boxes FROM results WHERE config = ? AND image_key IN ({','.join('?' * len(chunk))})",
+                [self.config, *chunk]).fetchall()
+            for key, blob in rows:
+                yield key, np.frombuffer(blob, dtype=np.float32).reshape(-1, 6)
+
+    def put_many(self, entries: Iterable[Tuple[str, str, np.ndarray]]):
+        """Store (image key, image path, (N, 6) boxes) and commit, one transaction per call."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results (image_key, config, path, boxes) VALUES (?, ?, ?, ?)",
+                [(key, self.config, path, np.ascontiguousarray(boxes, dtype=np.float32).tobytes())
+                 for key, path, boxes in entries])
+
+    def close(self):
+        self.conn.close()
+
+
+def _file_digest(path: str, hasher, block_size: int = 1 << 20) -> str:
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
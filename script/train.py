@@ -1,4 +1,83 @@
+import os
+import tempfile
+import time as _time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import get_context
+
+import numpy as np
 from ultralytics import YOLO
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+from image_cache import MmapImageCache
+from training_telemetry import TrainingTelemetry
+
+
+class MmapYOLODataset(YOLODataset):
+    """YOLODataset 讀取預先解碼的 MmapImageCache，快取缺少或已變更的影像才回到原本的解碼流程"""
+
+    def attach_image_cache(self, cache: MmapImageCache):
+        self.image_cache = cache
+        self.cache_rows = cache.rows_for(self.im_files)
+        stale = int((self.cache_rows < 0).sum())
+        if stale:
+            print(f"{self.prefix}{stale}/{len(self.im_files)} 張影像不在快取中或已變更，將即時解碼")
+
+    def load_image(self, i, rect_mode=True, resize_short=False):
+        row = self.cache_rows[i]
+        if row < 0 or not rect_mode or resize_short or self.channels != 3:
+            return super().load_image(i, rect_mode, resize_short)
+        im, hw0 = self.image_cache.get(row)  # 由 mmap 讀取，不經過 JPEG 解碼
+        im = im.copy()  # 資料增強 (如 RandomHSV) 會直接修改影像，不可回傳快取的唯讀 view
+        if self.augment:
+            # 只記錄索引供 mosaic 挑選，影像本身不必留在記憶體
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return im, hw0, im.shape[:2]
+
+
+# DDP 的各 GPU 行程只以 args 重建 trainer (args 不接受自訂鍵)，快取設定改經由會被子行程繼承的環境變數傳遞
+IMAGE_CACHE_DIR_ENV = "YOLO_IMAGE_CACHE_DIR"
+CACHE_WORKERS_ENV = "YOLO_IMAGE_CACHE_WORKERS"
+
+
+class MmapDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer：建立資料集時先增量建構 (或重用) 各 split 的 MmapImageCache (設定見 _image_cache_trainer)"""
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        if type(dataset) is YOLODataset:
+            workers = os.environ.get(CACHE_WORKERS_ENV)
+            cache = MmapImageCache.build(os.path.join(os.environ[IMAGE_CACHE_DIR_ENV], mode), dataset.im_files,
+                                         imgsz=dataset.imgsz, workers=int(workers) if workers else None)
+            dataset.__class__ = MmapYOLODataset  # 只替換 load_image，其餘建構流程與 ultralytics 相同
+            dataset.attach_image_cache(cache)
+        return dataset
+
+
+@contextmanager
+def _image_cache_trainer(image_cache_dir, cache_workers):
+    """有設定 image_cache_dir 時 yield MmapDetectionTrainer 並於期間設定快取環境變數，否則 yield None (ultralytics 預設)"""
+    if not image_cache_dir:
+        yield None
+        return
+    # 影像只解碼一次存入 mmap 快取，每個 epoch 與每個 dataloader worker 直接共用
+    settings = {IMAGE_CACHE_DIR_ENV: os.path.abspath(image_cache_dir),
+                CACHE_WORKERS_ENV: str(cache_workers) if cache_workers else ""}
+    previous = {key: os.environ.get(key) for key in settings}
+    os.environ.update(settings)
+    try:
+        yield MmapDetectionTrainer
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
 
 class YOLOTrainer:
     def __init__(
@@ -43,6 +122,11 @@ class YOLOTrainer:
         cutmix: float = 0.0,                    # 0.0
         auto_augment: str = 'randaugment',      # randaugment
         erasing: float = 0.4,                   # 0.4
+        #======================= Data Pipeline =======================#
+        image_cache_dir: str = None,            # None: 預先解碼的 mmap 影像快取資料夾 (取代 cache)
+        cache_workers: int = None,              # None: 建構快取的行程數 (None=CPU 核心數)
+        callbacks: dict = None,                 # None: {事件名稱: 函式或函式列表}，例如 on_train_batch_end
+        telemetry: bool = False,                # False: 記錄每個 step 的 dataloader 等待/運算/checkpoint 時間，輸出 telemetry.json 與 trace.json
     ):
         self.model = model
         self.data = data
@@ -82,13 +166,110 @@ class YOLOTrainer:
         self.mixup = mixup
         self.auto_augment = auto_augment
         self.erasing = erasing
+        self.image_cache_dir = image_cache_dir
+        self.cache_workers = cache_workers
+        self.callbacks = callbacks
+        self.telemetry = telemetry
 
     def train(self):
         assert self.model is not None, "請指定 model 權重或 yaml 路徑"
         assert self.data is not None, "請指定 data yaml 路徑"
         model = YOLO(self.model)
+        callbacks = [self.callbacks or {}]
+        if self.telemetry:
+            callbacks.append(TrainingTelemetry().callbacks())  # 寫入 runs/.../<name>/ (trainer.save_dir)
+        for group in callbacks:
+            for event, funcs in group.items():
+                for func in (funcs if isinstance(funcs, (list, tuple)) else [funcs]):
+                    model.add_callback(event, func)
+        with _image_cache_trainer(self.image_cache_dir, self.cache_workers) as trainer:
+            return model.train(**self._train_args(), **({'trainer': trainer} if trainer else {}))
+
+    def autotune(self, batch_candidates=(8, 16, 32, 64), worker_candidates=None, imgsz_candidates=None,
+                 fraction=0.1, iterations=20, warmup=3, memory_fraction=0.85, apply=True):
+        """
+        以短時間的訓練片段 (fraction 子集、少量 iteration) 自動挑選此主機能穩定維持最高吞吐量的 batch / workers / imgsz，
+        並寫回 self.batch / self.workers / self.imgsz
+        每個候選組合在獨立行程中執行 (記憶體量測不互相干擾，OOM 只影響該組合)，量測 samples/sec、
+        dataloader 等待時間與峰值 RSS (主行程 + dataloader workers，需 psutil)
+        搜尋順序：先在目前 batch 下選 workers，再以最佳 workers 逐步增大 batch (吞吐量下降或超過記憶體上限即停止)，
+        最後比較 imgsz (以 pixels/sec 排序，較小的 imgsz 只有在每像素吞吐量更高時才會勝出)
+        :param batch_candidates: 候選 batch 大小 (由小到大)
+        :param worker_candidates: 候選 dataloader workers 數 (None = 2, 4, 8 ... 不超過 CPU 核心數)
+        :param imgsz_candidates: 候選輸入大小 (None = 只使用 self.imgsz)
+        :param fraction: 每個片段使用的訓練資料比例
+        :param iterations: 每個片段量測的 iteration 數 (不含 warmup)
+        :param warmup: 不計入量測的前幾個 iteration (dataloader 啟動、記憶體配置)
+        :param memory_fraction: 峰值 RSS 不可超過系統記憶體的比例
+        :param apply: 是否將最佳設定寫回 trainer
+        :return: {'best': 最佳設定與量測值, 'trials': 所有片段的量測值}
+        """
+        assert self.model is not None and self.data is not None, "請指定 model 與 data"
+        cpus = os.cpu_count() or 1
+        if worker_candidates is None:
+            worker_candidates = sorted({min(w, cpus) for w in (0, 2, 4, 8, 16, 32) if w <= max(cpus, 2)})
+        memory_limit = _total_memory() * memory_fraction if _total_memory() else None
+        trials = []
+
+        def run(batch, workers, imgsz):
+            args = self._train_args()
+            args.update(batch=batch, workers=workers, imgsz=imgsz, epochs=1, fraction=fraction, val=False,
+                        plots=False, save=False, name="burst", exist_ok=True)
+            print(f"[autotune] batch={batch} workers={workers} imgsz={imgsz} ...")
+            try:
+                with tempfile.TemporaryDirectory(prefix="autotune_") as project, \
+                        ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                    result = executor.submit(_profile_burst, self.model, dict(args, project=project),
+                                             self.image_cache_dir, self.cache_workers, iterations, warmup).result()
+            except (BrokenProcessPool, RuntimeError, MemoryError) as e:  # OOM 被系統終止或 CUDA OOM
+                result = {'error': str(e) or type(e).__name__}
+            result.update(batch=batch, workers=workers, imgsz=imgsz)
+            if 'error' not in result and memory_limit and result['peak_rss_mb'] * 2 ** 20 > memory_limit:
+                result['error'] = f"peak RSS {result['peak_rss_mb']:.0f} MB 超過記憶體上限"
+            trials.append(result)
+            print(f"[autotune]   -> {_describe_trial(result)}")
+            return result if 'error' not in result else None
+
+        def better(a, b, key='samples_per_sec'):
+            return b is None or (a is not None and a[key] > b[key])
+
+        # 1. workers：固定目前的 batch
+        batches = sorted(batch_candidates)
+        start_batch = min(batches, key=lambda b: abs(b - self.batch))
+        best = None
+        for workers in worker_candidates:
+            result = run(start_batch, workers, self.imgsz)
+            if better(result, best):
+                best = result
+        if best is None:
+            raise RuntimeError("autotune: 所有 workers 候選都失敗")
+
+        # 2. batch：由目前 batch 往上增加，吞吐量下降 5% 以上或失敗即停止
+        for batch in [b for b in batches if b > start_batch]:
+            result = run(batch, best['workers'], self.imgsz)
+            if result is None or result['samples_per_sec'] < best['samples_per_sec'] * 0.95:
+                break
+            if better(result, best):
+                best = result
+
+        # 3. imgsz：以每秒處理的像素數比較
+        best['pixels_per_sec'] = best['samples_per_sec'] * best['imgsz'] ** 2
+        for imgsz in [s for s in (imgsz_candidates or []) if s != self.imgsz]:
+            result = run(best['batch'], best['workers'], imgsz)
+            if result is not None:
+                result['pixels_per_sec'] = result['samples_per_sec'] * imgsz ** 2
+                if better(result, best, 'pixels_per_sec'):
+                    best = result
+
+        print(f"[autotune] 最佳設定: batch={best['batch']} workers={best['workers']} imgsz={best['imgsz']} "
+              f"({_describe_trial(best)})")
+        if apply:
+            self.batch, self.workers, self.imgsz = best['batch'], best['workers'], best['imgsz']
+        return {'best': best, 'trials': trials}
+
+    def _train_args(self):
         # 呼叫 train，官方參數預設如下 :contentReference[oaicite:1]{index=1}
-        return model.train(
+        return dict(
             data=self.data,
             epochs=self.epochs,
             time=self.time,
@@ -97,7 +278,7 @@ class YOLOTrainer:
             imgsz=self.imgsz,
             save=self.save,
             save_period=self.save_period,
-            cache=self.cache,
+            cache=False if self.image_cache_dir else self.cache,
             device=self.device,
             workers=self.workers,
             project=self.project,
@@ -129,12 +310,91 @@ class YOLOTrainer:
         )
 
 
+def _total_memory():
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().total
+
+
+def _process_tree_rss():
+    """主行程與所有子行程 (dataloader workers) 的 RSS 總和 (bytes)；沒有 psutil 時只回傳主行程峰值"""
+    try:
+        import psutil
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    process = psutil.Process()
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+class _BurstComplete(Exception):
+    pass
+
+
+def _profile_burst(model_path, train_args, image_cache_dir, cache_workers, iterations, warmup):
+    """
+    autotune 片段 (在獨立行程中執行)：訓練 warmup + iterations 個 batch 後中止，
+    以 callbacks 記錄每個 batch 的開始/結束時間與 RSS
+    :return: samples_per_sec、stall_ratio (等待 dataloader 的時間比例)、compute_ms、peak_rss_mb
+    """
+    starts, ends, rss = [], [], []
+    state = {}
+
+    def on_batch_start(trainer):
+        starts.append(_time.perf_counter())
+
+    def on_batch_end(trainer):
+        ends.append(_time.perf_counter())
+        rss.append(_process_tree_rss())
+        state['batch'] = trainer.batch_size
+        if len(ends) >= warmup + iterations:
+            raise _BurstComplete()  # 不跑完整 epoch 與最終驗證
+
+    model = YOLO(model_path)
+    model.add_callback("on_train_batch_start", on_batch_start)
+    model.add_callback("on_train_batch_end", on_batch_end)
+    with _image_cache_trainer(image_cache_dir, cache_workers) as trainer:
+        try:
+            model.train(**train_args, **({'trainer': trainer} if trainer else {}))
+        except _BurstComplete:
+            pass
+
+    n = len(ends) - warmup
+    if n < 2:
+        return {'error': f"只完成 {len(ends)} 個 batch，請增加 fraction"}
+    starts, ends = np.array(starts[warmup:len(ends)]), np.array(ends[warmup:])
+    wall = ends[-1] - ends[0]
+    compute = (ends[1:] - starts[1:]).sum()
+    return {'samples_per_sec': state['batch'] * (n - 1) / wall,
+            'stall_ratio': float(max(wall - compute, 0) / wall),
+            'compute_ms': float(compute / (n - 1) * 1000),
+            'peak_rss_mb': max(rss) / 2 ** 20,
+            'iterations': n}
+
+
+def _describe_trial(result):
+    if 'error' in result:
+        return f"失敗: {result['error']}"
+    return (f"{result['samples_per_sec']:.1f} samples/s, dataloader 等待 {result['stall_ratio']:.0%}, "
+            f"compute {result['compute_ms']:.0f} ms/batch, 峰值 RSS {result['peak_rss_mb']:.0f} MB")
+
+
 # 使用範例
 if __name__ == "__main__":
     trainer = YOLOTrainer(
         model="yolov8n.pt",
-        data="datasets/renesas/data.yaml"
+        data="datasets/renesas/data.yaml",
+        image_cache_dir="runs/image_cache"    # 影像只解碼一次，之後的 epoch 與訓練都直接讀 mmap
     )
 
+    # trainer.autotune()                   # 依此主機自動選擇 batch / workers (imgsz_candidates 可加入 imgsz)
     results = trainer.train()
     print(results)
@@ -0,0 +1,197 @@
+# training_telemetry.py
+# Step-level timing for ultralytics training, attached through callbacks (YOLOTrainer(telemetry=True)).
+# Each step is split into dataloader wait (previous step end -> batch ready, i.e. decoding + augmentation
+# the workers could not hide) and compute (forward / backward / optimizer). Validation and checkpoint
+# writes are timed by wrapping the trainer methods. RSS of the whole process tree and dataloader worker
+# CPU utilization are sampled every few steps. Results go to telemetry.json (per-epoch summary with the
+# dominant cost) and trace.json, which opens in chrome://tracing or https://ui.perfetto.dev.
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+TRAIN_TID, PHASE_TID = 0, 1  # trace rows: per-step spans, epoch / validation / checkpoint spans
+
+
+class TrainingTelemetry:
+    def __init__(self, output_dir: Optional[str] = None, sample_every: int = 10, sync_cuda: bool = True):
+        """
+        Args:
+            output_dir: folder for telemetry.json / trace.json (None = the trainer's save_dir)
+            sample_every: steps between RSS / worker utilization samples
+            sync_cuda: synchronize CUDA at the end of every step so compute time is not hidden in the
+                       next step's dataloader wait (costs a little overlap between host and device)
+        """
+        self.output_dir = output_dir
+        self.sample_every = sample_every
+        self.sync_cuda = sync_cuda
+        self.events: List[dict] = []
+        self.epochs: List[dict] = []
+        self._t0 = time.perf_counter()
+        self._epoch = None
+        self._step_start = self._last_end = None
+        self._steps = 0
+        self._cpu_times: Dict[int, float] = {}
+        self._last_sample = None
+        self._cuda = False
+        self._num_workers = 0
+
+    def callbacks(self) -> Dict[str, Callable]:
+        """{event: function} for YOLOTrainer(callbacks=...) / model.add_callback."""
+        return {
+            'on_train_start': self._on_train_start,
+            'on_train_epoch_start': self._on_epoch_start,
+            'on_train_batch_start': self._on_batch_start,
+            'on_train_batch_end': self._on_batch_end,
+            'on_fit_epoch_end': self._on_fit_epoch_end,
+            'on_train_end': self._on_train_end,
+        }
+
+    # ------------------------------
+    # Callbacks
+    # ------------------------------
+    def _on_train_start(self, trainer):
+        self.output_dir = self.output_dir or str(trainer.save_dir)
+        self._cuda = self.sync_cuda and trainer.device.type == 'cuda'
+        self._num_workers = trainer.train_loader.num_workers
+        trainer.validate = self._timed(trainer.validate, 'validate')
+        trainer.save_model = self._timed(trainer.save_model, 'checkpoint')
+        self._sample()
+
+    def _on_epoch_start(self, trainer):
+        now = self._now()
+        self._epoch = {'epoch': trainer.epoch + 1, 'start': now, 'wait': [], 'compute': [],
+                       'validate': 0.0, 'checkpoint': 0.0, 'rss': [], 'worker_util': []}
+        self._last_end = now
+
+    def _on_batch_start(self, trainer):
+        self._step_start = self._now()
+        self._epoch['wait'].append(self._step_start - self._last_end)
+        self._span('data_wait', self._last_end, self._step_start, TRAIN_TID)
+
+    def _on_batch_end(self, trainer):
+        if self._cuda:
+            import torch
+            torch.cuda.synchronize(trainer.device)
+        self._last_end = self._now()
+        self._epoch['compute'].append(self._last_end - self._step_start)
+        self._span('compute', self._step_start, self._last_end, TRAIN_TID)
+        self._steps += 1
+        if self._steps % self.sample_every == 0:
+            self._sample()
+
+    def _on_fit_epoch_end(self, trainer):
+        if self._epoch is None:
+            return
+        end = self._now()
+        self._sample()
+        e = self._epoch
+        self._span(f"epoch {e['epoch']}", e['start'], end, PHASE_TID)
+        wait, compute = np.array(e['wait']), np.array(e['compute'])
+        wall = end - e['start']
+        costs = {'data_wait': float(wait.sum()), 'compute': float(compute.sum()),
+                 'validate': e['validate'], 'checkpoint': e['checkpoint']}
+        costs['other'] = max(wall - sum(costs.values()), 0.0)
+        self.epochs.append({
+            'epoch': e['epoch'],
+            'steps': len(compute),
+            'wall_s': wall,
+            **{f'{k}_s': v for k, v in costs.items()},
+            'data_wait_ratio': costs['data_wait'] / max(costs['data_wait'] + costs['compute'], 1e-9),
+            **_percentiles('data_wait_ms', wait), **_percentiles('compute_ms', compute),
+            'peak_rss_mb': max(e['rss']) if e['rss'] else None,
+            'worker_util': float(np.mean(e['worker_util'])) if e['worker_util'] else None,
+            'bottleneck': max(costs, key=costs.get),
+        })
+        self._epoch = None
+        self._write_summary()
+
+    def _on_train_end(self, trainer):
+        self._write_summary()
+        with open(os.path.join(self.output_dir, 'trace.json'), 'w') as f:
+            json.dump({'traceEvents': self._metadata() + self.events, 'displayTimeUnit': 'ms'}, f)
+        last = self.epochs[-1] if self.epochs else None
+        if last:
+            print(f"Telemetry: epoch {last['epoch']} data wait {last['data_wait_s']:.1f}s, compute "
+                  f"{last['compute_s']:.1f}s, validate {last['validate_s']:.1f}s, checkpoint {last['checkpoint_s']:.1f}s "
+                  f"-> bottleneck: {last['bottleneck']}")
+        print(f"Telemetry written to {self.output_dir}/telemetry.json and trace.json")
+
+    # ------------------------------
+    # Helpers
+    # ------------------------------
+    def _now(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def _span(self, name: str, start: float, end: float, tid: int):
+        self.events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': tid,
+                            'ts': start * 1e6, 'dur': (end - start) * 1e6})
+
+    def _timed(self, method: Callable, name: str) -> Callable:
+        def wrapper(*args, **kwargs):
+            start = self._now()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                end = self._now()
+                self._span(name, start, end, PHASE_TID)
+                if self._epoch is not None:  # final_eval runs outside any epoch
+                    self._epoch[name] += end - start
+        return wrapper
+
+    def _sample(self):
+        """RSS of the process tree and CPU utilization of the dataloader workers since the last sample."""
+        now = self._now()
+        try:
+            import psutil
+        except ImportError:
+            import resource
+            rss, util = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, None  # peak, main process only
+        else:
+            process = psutil.Process()
+            rss, cpu_times = process.memory_info().rss, {}
+            for child in process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                    times = child.cpu_times()
+                    cpu_times[child.pid] = times.user + times.system
+                except psutil.Error:
+                    pass
+            util = None
+            if self._last_sample is not None and self._num_workers and now > self._last_sample:
+                busy = sum(t - self._cpu_times.get(pid, 0.0) for pid, t in cpu_times.items())
+                util = min(busy / ((now - self._last_sample) * self._num_workers), 1.0)
+            self._cpu_times = cpu_times
+        self._last_sample = now
+
+        counters = {'rss_mb': rss / 2 ** 20}
+        if util is not None:
+            counters['worker_util'] = util
+        for name, value in counters.items():
+            self.events.append({'name': name, 'ph': 'C', 'pid': 0, 'ts': now * 1e6, 'args': {name: value}})
+        if self._epoch is not None:
+            self._epoch['rss'].append(counters['rss_mb'])
+            if util is not None:
+                self._epoch['worker_util'].append(util)
+
+    def _write_summary(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        totals = {k: sum(e[k] for e in self.epochs)
+                  for k in ('data_wait_s', 'compute_s', 'validate_s', 'checkpoint_s', 'other_s', 'wall_s')}
+        with open(os.path.join(self.output_dir, 'telemetry.json'), 'w') as f:
+            json.dump({'totals': totals, 'epochs': self.epochs}, f, indent=2)
+
+    @staticmethod
+    def _metadata() -> List[dict]:
+        names = {TRAIN_TID: 'train steps', PHASE_TID: 'epochs / validate / checkpoint'}
+        return [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': name}}
+                for tid, name in names.items()]
+
+
+def _percentiles(name: str, seconds: np.ndarray) -> Dict[str, Optional[float]]:
+    if len(seconds) == 0:
+        return {f'{name}_p50': None, f'{name}_p95': None}
+    return {f'{name}_p50': float(np.percentile(seconds, 50) * 1000),
+            f'{name}_p95': float(np.percentile(seconds, 95) * 1000)}
@@ -9,6 +9,9 @@
 # 3. Optionally re-encoding the retained class IDs to new sequential values (e.g., 0,2 → 0,1).
 # 4. If an annotation file becomes empty after filtering and `remove_empty=True`,
 #    both the annotation and corresponding image file will be deleted.
+# 5. A parallel mode (`filter_dataset_parallel`) for large datasets: recursive discovery with a single
+#    directory scan, chunked filtering in a process/thread pool, atomic writes that skip unchanged files,
+#    and a summary report instead of per-file output.
 #
 # Use Case:
 # This tool is especially useful when training object detection models on a subset of classes,
@@ -22,6 +25,8 @@
 # 2. 根據使用者指定的類別 ID，保留這些類別的標註，移除其他類別。
 # 3. 可選擇是否重新編碼保留的類別 ID（例如將 0,2 轉為 0,1），保持類別編號連續。
 # 4. 若標註檔在篩選後為空，且設定為 `remove_empty=True`，則會自動刪除對應的標註檔與影像檔。
+# 5. 平行模式（`filter_dataset_parallel`）：遞迴掃描資料夾一次建立影像對照表，以行程/執行緒池分批篩選，
+#    以暫存檔+rename 原子寫入並略過內容未變的檔案，最後輸出統計摘要而非逐檔列印。
 #
 # 使用情境：
 # 此工具適用於欲針對部分目標類別進行模型訓練時的資料過濾，
@@ -33,16 +38,34 @@
 
 
 import os
-from typing import List, Dict
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from dataset_index import DatasetIndex
+from label_store import LabelStore, format_label_rows
 
 
 class ClassFilter:
-    def __init__(self, dataset_dir: str, keep_ids: List[int], reencode: bool = False, remove_empty: bool = False):
+    def __init__(self, dataset_dir: str, keep_ids: List[int], reencode: bool = False, remove_empty: bool = False,
+                 index: Optional[DatasetIndex] = None):
         self.dataset_dir = dataset_dir
         self.keep_ids = keep_ids
         self.reencode = reencode
         self.remove_empty = remove_empty
+        self.index = index
         self.supported_image_exts = ['.jpg', '.jpeg', '.png', '.bmp']
+        self.class_remap = self._build_class_remap()
+
+    def _build_class_remap(self) -> Dict[int, int]:
+        # old class id -> new class id, computed once instead of keep_ids.index() per line
+        remap = {}
+        for new_id, class_id in enumerate(self.keep_ids):
+            remap.setdefault(class_id, new_id if self.reencode else class_id)
+        return remap
 
     def filter_dataset(self):
         for file_name in os.listdir(self.dataset_dir):
@@ -54,16 +77,157 @@ class ClassFilter:
                     filtered_lines = self._filter_labels(txt_path)
                     print(f"Processing: {file_name} -> {len(filtered_lines)} valid annotations")
 
-                    if filtered_lines:
+                    if filtered_lines or not self.remove_empty:
                         with open(txt_path, 'w') as f:
                             f.writelines(filtered_lines)
-                    elif self.remove_empty:
+                    else:
                         os.remove(txt_path)
                         os.remove(image_path)
                         print(f"Removed: {file_name} and image {os.path.basename(image_path)} (empty annotations)")
                 else:
                     print(f"Warning: No image found for {file_name}")
 
+    def filter_dataset_parallel(self, workers: Optional[int] = None, chunk_size: int = 512,
+                                use_threads: bool = False, recursive: bool = True) -> Dict[str, int]:
+        """
+        Parallel version of `filter_dataset` for large datasets.
+
+        Args:
+            workers: pool size (None = os.cpu_count())
+            chunk_size: number of label files handled per task
+            use_threads: use a thread pool instead of a process pool (better on network storage)
+            recursive: also scan sub-directories of dataset_dir (ignored with an index, which has its own setting)
+
+        Returns:
+            summary counters (see `_filter_label_chunk`)
+        """
+        if self.index is not None:
+            self.index.refresh(workers)
+            label_paths = self.index.labels()
+            image_map = self.index.image_map(self.supported_image_exts)
+            untouched = self._labels_without_changes()
+        else:
+            label_paths, image_map = self._scan_dataset(recursive)
+            untouched = set()
+
+        pairs = []
+        missing_images = 0
+        for txt_path in label_paths:
+            image_path = image_map.get(os.path.splitext(txt_path)[0])
+            if image_path is None:
+                missing_images += 1
+            elif txt_path not in untouched:
+                pairs.append((txt_path, image_path))
+
+        chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+        summary = {'labels': len(label_paths), 'missing_images': missing_images, 'unchanged': len(untouched)}
+        errors = []
+
+        executor_cls = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+        with executor_cls(max_workers=workers) as executor:
+            results = executor.map(_filter_label_chunk, chunks, repeat(self.class_remap), repeat(self.remove_empty))
+            for counts, chunk_errors in results:
+                for key, value in counts.items():
+                    summary[key] = summary.get(key, 0) + value
+                errors.extend(chunk_errors)
+
+        summary['errors'] = len(errors)
+        self._print_summary(summary, errors)
+        return summary
+
+    def filter_with_label_store(self, store: LabelStore) -> Dict[str, int]:
+        """
+        Vectorized version of `filter_dataset_parallel` on a packed LabelStore: class filtering and
+        re-encoding run as array operations, and only files whose labels change are rewritten
+        (coordinates are written with 6 decimals). Rebuild the store afterwards, unchanged files are reused.
+
+        Returns:
+            summary counters, same keys as `filter_dataset_parallel`
+        """
+        image_map = self.absolute_image_map()
+        summary = {'labels': len(store), 'processed': 0, 'rewritten': 0, 'unchanged': 0, 'removed': 0,
+                   'kept_annotations': 0, 'dropped_annotations': 0, 'missing_images': 0}
+        errors = []
+        for start, rows, offsets, changed in store.remap_chunks(self.class_remap):
+            kept = np.diff(offsets)
+            for k in range(len(kept)):
+                i = start + k
+                txt_path = store.abspath(i)
+                image_path = image_map.get(os.path.splitext(txt_path)[0])
+                if image_path is None:
+                    summary['missing_images'] += 1
+                    continue
+                if store.flags[i]:
+                    errors.append(f"{txt_path}: malformed or unreadable label file")
+                    continue
+
+                summary['processed'] += 1
+                summary['kept_annotations'] += int(kept[k])
+                summary['dropped_annotations'] += int(store.offsets[i + 1] - store.offsets[i] - kept[k])
+                if kept[k] == 0 and self.remove_empty:
+                    os.remove(txt_path)
+                    os.remove(image_path)
+                    summary['removed'] += 1
+                elif changed[k]:
+                    _atomic_write(txt_path, format_label_rows(rows[offsets[k]:offsets[k + 1]]))
+                    summary['rewritten'] += 1
+                else:
+                    summary['unchanged'] += 1
+
+        summary['errors'] = len(errors)
+        self._print_summary(summary, errors)
+        return summary
+
+    def absolute_image_map(self) -> Dict[str, str]:
+        """{absolute path without extension: image path} for every image of the dataset (recursive)."""
+        if self.index is not None:
+            self.index.refresh()
+            image_map = self.index.image_map(self.supported_image_exts)
+        else:
+            _, image_map = self._scan_dataset(recursive=True)
+        return {os.path.abspath(stem): path for stem, path in image_map.items()}
+
+    def _labels_without_changes(self) -> set:
+        """Labels the index says would come out identical (every class kept under its own id), so they are
+        not even opened. Empty and malformed files are still processed."""
+        identity = {class_id for class_id, new_id in self.class_remap.items() if class_id == new_id}
+        return {label_path for label_path, classes in self.index.iter_label_classes()
+                if classes and identity.issuperset(classes)}
+
+    def _scan_dataset(self, recursive: bool) -> Tuple[List[str], Dict[str, str]]:
+        """Single os.scandir pass: returns label paths and a {path without extension: image path} map."""
+        ext_priority = {ext: i for i, ext in enumerate(self.supported_image_exts)}
+        label_paths = []
+        image_map = {}
+        stack = [self.dataset_dir]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(entry.path)
+                        continue
+                    stem, ext = os.path.splitext(entry.path)
+                    if ext == '.txt':
+                        label_paths.append(entry.path)
+                    elif ext in ext_priority:
+                        # keep the same extension preference as _find_corresponding_image
+                        current = image_map.get(stem)
+                        if current is None or ext_priority[ext] < ext_priority[os.path.splitext(current)[1]]:
+                            image_map[stem] = entry.path
+        label_paths.sort()
+        return label_paths, image_map
+
+    @staticmethod
+    def _print_summary(summary: Dict[str, int], errors: List[str]):
+        print("Filtering summary:")
+        for key in ('labels', 'processed', 'rewritten', 'unchanged', 'removed',
+                    'kept_annotations', 'dropped_annotations', 'missing_images', 'errors'):
+            print(f"  {key:<20}: {summary.get(key, 0)}")
+        for message in errors[:10]:
+            print(f"  Error: {message}")
+        if len(errors) > 10:
+            print(f"  ... and {len(errors) - 10} more errors")
 
     def _find_corresponding_image(self, txt_path: str) -> str or None:
         base_name = os.path.splitext(os.path.basename(txt_path))[0]
@@ -74,23 +238,75 @@ class ClassFilter:
         return None
 
     def _filter_labels(self, txt_path: str) -> List[str]:
-        filtered = []
         with open(txt_path, 'r') as f:
             lines = f.readlines()
+        filtered, _ = _remap_lines(lines, self.class_remap)
+        return filtered
 
-        for line in lines:
-            parts = line.strip().split()
-            if not parts:
-                continue
 
-            class_id = int(parts[0])
-            if class_id in self.keep_ids:
-                if self.reencode:
-                    new_class_id = self.keep_ids.index(class_id)
-                    parts[0] = str(new_class_id)
-                filtered.append(' '.join(parts) + '\n')
+def _remap_lines(lines: List[str], class_remap: Dict[int, int]) -> Tuple[List[str], int]:
+    """Keep lines whose class id is in class_remap (re-encoded). Returns (kept lines, dropped count)."""
+    filtered = []
+    dropped = 0
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
 
-        return filtered
+        new_class_id = class_remap.get(int(parts[0]))
+        if new_class_id is None:
+            dropped += 1
+            continue
+        parts[0] = str(new_class_id)
+        filtered.append(' '.join(parts) + '\n')
+
+    return filtered, dropped
+
+
+def _atomic_write(path: str, content: str):
+    """Write to a temp file in the same directory and rename it over `path`."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _filter_label_chunk(pairs: List[Tuple[str, str]], class_remap: Dict[int, int],
+                        remove_empty: bool) -> Tuple[Dict[str, int], List[str]]:
+    """Pool task: filter a chunk of (label path, image path) pairs. Module level so it can be pickled."""
+    counts = {'processed': 0, 'rewritten': 0, 'unchanged': 0, 'removed': 0,
+              'kept_annotations': 0, 'dropped_annotations': 0}
+    errors = []
+    for txt_path, image_path in pairs:
+        # one failing file (e.g. deleted concurrently) is recorded, it never aborts the pool
+        try:
+            with open(txt_path, 'r') as f:
+                original = f.read()
+            filtered, dropped = _remap_lines(original.splitlines(), class_remap)
+            if not filtered and remove_empty:
+                os.remove(txt_path)
+                os.remove(image_path)
+                outcome = 'removed'
+            elif ''.join(filtered) == original:
+                outcome = 'unchanged'
+            else:
+                _atomic_write(txt_path, ''.join(filtered))
+                outcome = 'rewritten'
+        except (OSError, ValueError) as e:
+            errors.append(f"{txt_path}: {e}")
+            continue
+
+        counts['processed'] += 1
+        counts['kept_annotations'] += len(filtered)
+        counts['dropped_annotations'] += dropped
+        counts[outcome] += 1
+
+    return counts, errors
 
 
 # ------------------------------
@@ -101,13 +317,19 @@ if __name__ == "__main__":
     ids_to_keep = [0]  # Keep only class 0 and 2
     should_reencode = False  # Reencode 0 -> 0, 2 -> 1
     delete_empty_files = True  # Remove images without relevant objects
+    use_parallel = True  # Recursive scan + process pool, prints a summary instead of every file
+    use_index = True  # Persistent index: later runs skip files whose classes are already filtered
 
     yolo_filter = ClassFilter(
         dataset_dir=dataset_directory,
         keep_ids=ids_to_keep,
         reencode=should_reencode,
-        remove_empty=delete_empty_files
+        remove_empty=delete_empty_files,
+        index=DatasetIndex(dataset_directory) if use_parallel and use_index else None
     )
 
-    yolo_filter.filter_dataset()
+    if use_parallel:
+        yolo_filter.filter_dataset_parallel(workers=None, chunk_size=512)
+    else:
+        yolo_filter.filter_dataset()
     print("Dataset filtering completed.")
@@ -1,11 +1,49 @@
+import csv
+import json
 import os
-from typing import List
+import shutil
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from dataset_index import DatasetIndex
+from image_checker import ImageChecker
+from label_store import LabelStore
+
+# 問題類型 -> 套用報告時要處理的檔案（image / label / pair；lines = 只移除標註檔中的重複列）
+ISSUE_TARGETS = {
+    'missing_label': 'image',
+    'missing_image': 'label',
+    'unreadable': 'pair',
+    'malformed_columns': 'pair',
+    'non_numeric': 'pair',
+    'nan': 'pair',
+    'invalid_class': 'pair',
+    'out_of_range': 'pair',
+    'non_positive_size': 'pair',
+    'duplicate': 'lines',
+    'near_duplicate': 'pair',
+    'truncated_image': 'pair',
+    'corrupt_image': 'pair',
+}
+# 重疊的框也可能是正確標註（例如人群），只有在 issues 中明確指定時才處理
+REVIEW_ONLY_ISSUES = ('near_duplicate',)
+REPORT_FIELDS = ['issue', 'label_path', 'image_path', 'count']
 
 class DatasetChecker:
-    def __init__(self, dataset_dir: str, allowed_class_ids: List[int]):
+    def __init__(self, dataset_dir: str, allowed_class_ids: List[int], index: Optional[DatasetIndex] = None,
+                 label_store: Optional[LabelStore] = None):
         self.dataset_dir = dataset_dir
         self.allowed_class_ids = allowed_class_ids
         self.supported_image_exts = ['.jpg', '.jpeg', '.png', '.bmp']
+        # 若提供 index，檔案清單與類別 ID 直接由索引取得，只有變動過的檔案會被重新讀取
+        self.index = index
+        # 若提供 label_store（請先以 LabelStore.build 更新），類別檢查以向量化運算一次完成
+        self.label_store = label_store
+        self._outside_allowed = None
 
     def _get_image_files(self):
         return [f for f in os.listdir(self.dataset_dir)
@@ -14,7 +52,33 @@ class DatasetChecker:
     def _get_label_files(self):
         return [f for f in os.listdir(self.dataset_dir) if f.endswith('.txt')]
 
+    def _collect_paths(self) -> Tuple[List[str], List[str]]:
+        if self.index is not None:
+            self.index.refresh()
+            return self.index.images(self.supported_image_exts), self.index.labels()
+        return ([os.path.join(self.dataset_dir, f) for f in self._get_image_files()],
+                [os.path.join(self.dataset_dir, f) for f in self._get_label_files()])
+
+    def _build_image_map(self, image_paths: List[str]) -> dict:
+        # 去副檔名路徑 -> 影像路徑，副檔名優先順序與 supported_image_exts 相同
+        priority = {ext: i for i, ext in enumerate(self.supported_image_exts)}
+        image_map = {}
+        for image_path in sorted(image_paths, key=lambda p: priority[os.path.splitext(p)[1].lower()]):
+            image_map.setdefault(os.path.splitext(image_path)[0], image_path)
+        return image_map
+
     def _has_only_allowed_classes(self, label_path: str) -> bool:
+        if self.label_store is not None:
+            i = self.label_store.find(label_path)
+            if i >= 0:
+                if self._outside_allowed is None:
+                    self._outside_allowed = self.label_store.files_with_classes_outside(self.allowed_class_ids)
+                return not self._outside_allowed[i]
+
+        if self.index is not None:
+            class_ids = self.index.label_classes(label_path)
+            return class_ids is not None and set(class_ids).issubset(self.allowed_class_ids)
+
         with open(label_path, 'r') as f:
             lines = f.readlines()
         for line in lines:
@@ -30,31 +94,23 @@ class DatasetChecker:
         return True
 
     def clean_dataset(self):
-        image_files = self._get_image_files()
-        label_files = self._get_label_files()
+        image_paths, label_paths = self._collect_paths()
 
-        image_basenames = {os.path.splitext(f)[0] for f in image_files}
-        label_basenames = {os.path.splitext(f)[0] for f in label_files}
+        label_basenames = {os.path.splitext(p)[0] for p in label_paths}
+        image_map = self._build_image_map(image_paths)
 
         # 檢查：圖片沒有對應標註
-        for image_file in image_files:
-            basename, ext = os.path.splitext(image_file)
-            if basename not in label_basenames:
-                os.remove(os.path.join(self.dataset_dir, image_file))
-                print(f"Removed image without label: {image_file}")
+        for image_path in image_paths:
+            if os.path.splitext(image_path)[0] not in label_basenames:
+                os.remove(image_path)
+                print(f"Removed image without label: {os.path.basename(image_path)}")
 
         # 檢查：標註檔沒有對應圖片，或含有非法類別
-        for label_file in label_files:
-            basename = os.path.splitext(label_file)[0]
-            label_path = os.path.join(self.dataset_dir, label_file)
+        for label_path in label_paths:
+            label_file = os.path.basename(label_path)
 
             # 找對應圖片
-            image_path = None
-            for ext in self.supported_image_exts:
-                possible_image = os.path.join(self.dataset_dir, basename + ext)
-                if os.path.exists(possible_image):
-                    image_path = possible_image
-                    break
+            image_path = image_map.get(os.path.splitext(label_path)[0])
 
             if not image_path:
                 os.remove(label_path)
@@ -69,6 +125,245 @@ class DatasetChecker:
 
         print("Dataset check and cleaning completed.")
 
+    # ------------------------------
+    # 深度驗證（dry-run，不會刪除任何檔案）
+    # ------------------------------
+    def validate(self, report_path: Optional[str] = None, workers: Optional[int] = None, chunk_size: int = 512,
+                 near_duplicate_iou: float = 0.9, coord_tolerance: float = 1e-3,
+                 check_images: bool = False, full_decode: bool = False) -> List[Dict]:
+        """
+        檢查所有標註框並產生報告，不修改資料集。
+        :param report_path: 報告輸出路徑（.json 或 .csv），None 則不寫檔
+        :param workers: 行程池大小（None = CPU 核心數）
+        :param chunk_size: 每個工作處理的標註檔數量
+        :param near_duplicate_iou: 同類別框 IoU 大於等於此值視為近似重複
+        :param coord_tolerance: 框邊界超出 [0, 1] 的容許誤差
+        :param check_images: 是否以 ImageChecker 檢查影像是否截斷或損毀（有 index 時結果會被快取）
+        :param full_decode: 影像檢查是否完整解碼（預設只讀標頭）
+        :return: 問題列表，每筆為 {issue, label_path, image_path, count}
+        """
+        image_paths, label_paths = self._collect_paths()
+        label_basenames = {os.path.splitext(p)[0] for p in label_paths}
+        image_map = self._build_image_map(image_paths)
+
+        records = [{'issue': 'missing_label', 'label_path': '', 'image_path': p, 'count': 1}
+                   for p in image_paths if os.path.splitext(p)[0] not in label_basenames]
+
+        paired = []
+        for label_path in label_paths:
+            image_path = image_map.get(os.path.splitext(label_path)[0])
+            if image_path is None:
+                records.append({'issue': 'missing_image', 'label_path': label_path, 'image_path': '', 'count': 1})
+            else:
+                paired.append(label_path)
+
+        paired_set = set(paired)
+        chunks = [paired[i:i + chunk_size] for i in range(0, len(paired), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_validate_label_chunk, chunks, repeat(list(self.allowed_class_ids)),
+                                   repeat(near_duplicate_iou), repeat(coord_tolerance))
+            for chunk_issues in results:
+                for label_path, issue, count in chunk_issues:
+                    records.append({'issue': issue, 'label_path': label_path,
+                                    'image_path': image_map[os.path.splitext(label_path)[0]], 'count': count})
+
+        if check_images:
+            image_checker = ImageChecker(self.index, full_decode=full_decode, workers=workers)
+            for image_path, info in image_checker.check(image_paths).items():
+                if info['status'] != 'ok':
+                    label_path = os.path.splitext(image_path)[0] + '.txt'
+                    records.append({'issue': f"{info['status']}_image", 'image_path': image_path, 'count': 1,
+                                    'label_path': label_path if label_path in paired_set else ''})
+
+        totals = Counter(r['issue'] for r in records)
+        print(f"Validated {len(paired)} image-label pairs, {len(records)} issues found")
+        for issue, n in sorted(totals.items()):
+            print(f"  {issue:<18}: {n} files")
+        if report_path:
+            self._write_report(report_path, records)
+            print(f"Report written to '{report_path}'")
+        return records
+
+    @staticmethod
+    def _write_report(report_path: str, records: List[Dict]):
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        if report_path.endswith('.csv'):
+            with open(report_path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            summary = dict(Counter(r['issue'] for r in records))
+            with open(report_path, 'w') as f:
+                json.dump({'summary': summary, 'issues': records}, f, indent=2)
+
+    @staticmethod
+    def load_report(report_path: str) -> List[Dict]:
+        if report_path.endswith('.csv'):
+            with open(report_path, 'r', newline='') as f:
+                return list(csv.DictReader(f))
+        with open(report_path, 'r') as f:
+            return json.load(f)['issues']
+
+    def apply_report(self, report: Union[str, List[Dict]], action: str = 'quarantine',
+                     quarantine_dir: Optional[str] = None, issues: Optional[Sequence[str]] = None) -> int:
+        """
+        依 validate() 的報告刪除或隔離檔案（明確的破壞性步驟）。
+        :param report: 報告路徑或 validate() 的回傳值
+        :param action: 'quarantine'（移到 quarantine_dir，保留相對路徑）或 'delete'
+        :param quarantine_dir: 隔離資料夾（預設 <dataset_dir>_quarantine）
+        :param issues: 只處理這些問題類型（None = 全部，但不含 REVIEW_ONLY_ISSUES）
+        :return: 處理的檔案數
+        """
+        if action not in ('quarantine', 'delete'):
+            raise ValueError("action must be 'quarantine' or 'delete'")
+        records = self.load_report(report) if isinstance(report, str) else report
+        quarantine_dir = quarantine_dir or os.path.normpath(self.dataset_dir) + '_quarantine'
+
+        targets, dedup_labels = set(), set()
+        for r in records:
+            if (r['issue'] in REVIEW_ONLY_ISSUES) if issues is None else (r['issue'] not in issues):
+                continue
+            target = ISSUE_TARGETS[r['issue']]
+            if target == 'lines' and r['label_path']:
+                dedup_labels.add(r['label_path'])
+            if target in ('label', 'pair') and r['label_path']:
+                targets.add(r['label_path'])
+            if target in ('image', 'pair') and r['image_path']:
+                targets.add(r['image_path'])
+
+        handled = 0
+        for path in sorted(targets):
+            if not os.path.exists(path):
+                continue
+            if action == 'delete':
+                os.remove(path)
+            else:
+                dst = os.path.join(quarantine_dir, os.path.relpath(path, self.dataset_dir))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.move(path, dst)
+            handled += 1
+        print(f"{'Deleted' if action == 'delete' else 'Quarantined'} {handled} files")
+
+        # 重複的框只移除多餘的列，影像與其他標註保留（quarantine 時先備份原始標註檔）
+        deduplicated = 0
+        for label_path in sorted(dedup_labels - targets):
+            if not os.path.exists(label_path):
+                continue
+            if action == 'quarantine':
+                dst = os.path.join(quarantine_dir, os.path.relpath(label_path, self.dataset_dir))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.copy2(label_path, dst)
+            _drop_duplicate_lines(label_path)
+            deduplicated += 1
+        if deduplicated:
+            print(f"Removed duplicate boxes from {deduplicated} label files")
+        return handled + deduplicated
+
+
+def _drop_duplicate_lines(label_path: str):
+    """保留每個框第一次出現的那一列（以數值比較，與 validate 的 'duplicate' 判斷一致）"""
+    with open(label_path, 'r') as f:
+        lines = f.read().splitlines()
+    seen, kept = set(), []
+    for line in lines:
+        try:
+            key = tuple(float(p) for p in line.split())
+        except ValueError:
+            key = None  # 無法解析的列原樣保留
+        if key and len(key) == 5:
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(line)
+    with open(label_path, 'w') as f:
+        f.write('\n'.join(kept) + ('\n' if kept else ''))
+
+
+def _validate_label_chunk(label_paths: List[str], allowed_class_ids: List[int], near_duplicate_iou: float,
+                          coord_tolerance: float) -> List[Tuple[str, str, int]]:
+    """行程池工作：回傳 [(標註檔路徑, 問題類型, 受影響的框數)]。整個 chunk 的框一次以 NumPy 檢查。"""
+    issues = []
+    rows, file_ids = [], []
+    for f_idx, label_path in enumerate(label_paths):
+        try:
+            with open(label_path, 'r') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            issues.append((label_path, 'unreadable', 1))
+            continue
+        bad_columns = non_numeric = 0
+        for line in lines:
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) != 5:
+                bad_columns += 1
+                continue
+            try:
+                rows.append([float(p) for p in parts])
+            except ValueError:
+                non_numeric += 1
+                continue
+            file_ids.append(f_idx)
+        if bad_columns:
+            issues.append((label_path, 'malformed_columns', bad_columns))
+        if non_numeric:
+            issues.append((label_path, 'non_numeric', non_numeric))
+
+    boxes = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    fid = np.array(file_ids, dtype=np.int64)
+
+    def report(mask: np.ndarray, issue: str):
+        counts = np.bincount(fid[mask], minlength=len(label_paths))
+        issues.extend((label_paths[i], issue, int(counts[i])) for i in np.flatnonzero(counts))
+
+    finite = np.isfinite(boxes).all(axis=1)
+    cls = boxes[:, 0]
+    xc, yc, w, h = boxes[:, 1], boxes[:, 2], boxes[:, 3], boxes[:, 4]
+    with np.errstate(invalid='ignore'):
+        x1, y1, x2, y2 = xc - w / 2, yc - h / 2, xc + w / 2, yc + h / 2
+        valid_class = (cls == np.round(cls)) & np.isin(cls, allowed_class_ids)
+        out_of_range = ((boxes[:, 1:] < 0) | (boxes[:, 1:] > 1)).any(axis=1) | \
+            (np.minimum(x1, y1) < -coord_tolerance) | (np.maximum(x2, y2) > 1 + coord_tolerance)
+        non_positive = (w <= 0) | (h <= 0)
+    report(~finite, 'nan')
+    report(finite & ~valid_class, 'invalid_class')
+    report(finite & out_of_range, 'out_of_range')
+    report(finite & non_positive, 'non_positive_size')
+
+    # 完全重複：依 (檔案, 框內容) 排序後比較相鄰列
+    if len(boxes) > 1:
+        order = np.lexsort((boxes[:, 4], boxes[:, 3], boxes[:, 2], boxes[:, 1], boxes[:, 0], fid))
+        same = (fid[order][1:] == fid[order][:-1]) & (boxes[order][1:] == boxes[order][:-1]).all(axis=1)
+        duplicate = np.zeros(len(boxes), dtype=bool)
+        duplicate[order[1:][same]] = True
+        report(duplicate, 'duplicate')
+
+    # 近似重複：每個檔案內同類別框兩兩 IoU（不含完全重複）
+    near = np.zeros(len(boxes), dtype=bool)
+    ok = finite & ~non_positive
+    starts = np.flatnonzero(np.r_[True, fid[1:] != fid[:-1]]) if len(fid) else np.array([], dtype=np.int64)
+    ends = np.r_[starts[1:], len(fid)]
+    for start, end in zip(starts, ends):
+        if end - start < 2:
+            continue
+        idx = np.arange(start, end)[ok[start:end]]
+        if len(idx) < 2:
+            continue
+        bx1, by1, bx2, by2 = x1[idx], y1[idx], x2[idx], y2[idx]
+        iw = np.clip(np.minimum(bx2[:, None], bx2) - np.maximum(bx1[:, None], bx1), 0, None)
+        ih = np.clip(np.minimum(by2[:, None], by2) - np.maximum(by1[:, None], by1), 0, None)
+        inter = iw * ih
+        area = (bx2 - bx1) * (by2 - by1)
+        iou = inter / (area[:, None] + area - inter)
+        pairs = np.triu((iou >= near_duplicate_iou) & (cls[idx][:, None] == cls[idx]), k=1)
+        pairs &= ~(boxes[idx][:, None, :] == boxes[idx][None, :, :]).all(axis=2)
+        near[idx[pairs.any(axis=0)]] = True
+    report(near, 'near_duplicate')
+
+    return issues
+
 # ------------------------------
 # ⚙️ 使用範例配置
 # ------------------------------
@@ -76,5 +371,12 @@ if __name__ == "__main__":
     dataset_path = "datasets/human_dataset/coco_dataset"  # 你的資料集資料夾
     allowed_classes = [0]  # 只允許 class 0
 
-    checker = DatasetChecker(dataset_dir=dataset_path, allowed_class_ids=allowed_classes)
-    checker.clean_dataset()
+    use_index = True  # 使用持久化索引，重複執行時只重新解析變動過的標註檔
+
+    index = DatasetIndex(dataset_path, recursive=False) if use_index else None
+    checker = DatasetChecker(dataset_dir=dataset_path, allowed_class_ids=allowed_classes, index=index)
+
+    dry_run = True  # True: 只產生報告；False: 依報告將問題檔案移到隔離資料夾
+    issues = checker.validate(report_path="output/dataset_report.json")
+    if not dry_run:
+        checker.apply_report(issues, action='quarantine')
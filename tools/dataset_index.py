@@ -0,0 +1,322 @@
+"""========================================================================================================
+#
+# ==============================================
+# DatasetIndex is a persistent, incremental index of a YOLO-style dataset stored in a single SQLite file.
+# Its main capabilities include:
+# 1. Scanning the dataset once with os.scandir and recording every image / label file with its size and mtime.
+# 2. On later runs, only re-stating the directory tree and re-parsing label files whose size or mtime changed.
+# 3. Caching the class ids of every label file, so tools can check or filter classes without opening files.
+# 4. Serving image-label pairing (same directory, same file stem) to ClassFilter, DatasetChecker and
+#    DatasetPreparer.
+#
+# Use Case:
+# Repeated cleaning / filtering / splitting runs on very large datasets, where rescanning and re-parsing
+# every file on each run dominates the run time.
+# ==============================================
+#
+# ==============================================
+# DatasetIndex 是一個以單一 SQLite 檔儲存的 YOLO 資料集持久化、增量索引。
+# 它的主要功能包括：
+# 1. 以 os.scandir 掃描資料集，記錄每個影像 / 標註檔的大小與修改時間。
+# 2. 之後的執行只重新 stat 檔案，並只重新解析大小或修改時間有變動的標註檔。
+# 3. 快取每個標註檔的類別 ID，工具不需開檔即可檢查或篩選類別。
+# 4. 提供影像與標註的配對（同資料夾、同檔名），供 ClassFilter、DatasetChecker、DatasetPreparer 使用。
+#
+# 使用情境：
+# 大型資料集上反覆執行清理、篩選、分割時，避免每次都重新掃描與解析所有檔案。
+# ==============================================
+#
+========================================================================================================"""
+
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+IMAGE_KIND = 0
+LABEL_KIND = 1
+
+
+class DatasetIndex:
+    def __init__(
+        self,
+        dataset_dir: str,
+        index_path: Optional[str] = None,
+        image_extensions: Sequence[str] = ('.jpg', '.jpeg', '.png', '.bmp'),
+        annotation_extension: str = '.txt',
+        recursive: bool = True,
+    ):
+        """
+        Args:
+            dataset_dir: dataset root folder
+            index_path: SQLite file (default: <dataset_dir>/.dataset_index.sqlite)
+            image_extensions: image file extensions to index (lower case)
+            annotation_extension: label file extension
+            recursive: also index sub-directories
+        """
+        self.dataset_dir = os.path.abspath(dataset_dir)
+        self.index_path = index_path or os.path.join(self.dataset_dir, '.dataset_index.sqlite')
+        self.image_extensions = tuple(ext.lower() for ext in image_extensions)
+        self.annotation_extension = annotation_extension
+        self.recursive = recursive
+
+        self.conn = sqlite3.connect(self.index_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, stem TEXT NOT NULL, kind INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_stem ON files(stem)")
+            # classes: space separated class id per annotation line, NULL if the file could not be parsed
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS labels (path TEXT PRIMARY KEY, num_boxes INTEGER, classes TEXT)"
+            )
+            # image header / integrity results (ImageChecker), valid while size and mtime_ns match `files`
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS image_info ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, width INTEGER, height INTEGER, "
+                "mode TEXT, format TEXT, orientation INTEGER, decoded INTEGER, status TEXT, error TEXT)"
+            )
+            # 64-bit perceptual hashes (ImageDeduplicator), stored as signed integers
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS image_hash ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, ahash INTEGER, dhash INTEGER, phash INTEGER)"
+            )
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------
+    # Scanning
+    # ------------------------------
+    def refresh(self, workers: Optional[int] = None) -> Dict[str, int]:
+        """
+        Bring the index up to date with the files on disk.
+
+        Only files whose size or mtime changed are written, and only changed label files are parsed
+        (in a process pool when there are many of them).
+
+        Returns:
+            counters: added / modified / removed / unchanged / parsed_labels
+        """
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self.conn.execute(
+            "SELECT path, size, mtime_ns FROM files")}
+        counts = {'added': 0, 'modified': 0, 'removed': 0, 'unchanged': 0}
+        upserts = []
+        changed_labels = []
+
+        for rel_path, kind, size, mtime_ns in self._scan():
+            previous = known.pop(rel_path, None)
+            if previous == (size, mtime_ns):
+                counts['unchanged'] += 1
+                continue
+            counts['added' if previous is None else 'modified'] += 1
+            upserts.append((rel_path, os.path.splitext(rel_path)[0], kind, size, mtime_ns))
+            if kind == LABEL_KIND:
+                changed_labels.append(rel_path)
+
+        removed = [(path,) for path in known]
+        counts['removed'] = len(removed)
+
+        parsed = self._parse_labels(changed_labels, workers)
+        counts['parsed_labels'] = len(parsed)
+
+        with self.conn:
+            self.conn.executemany("DELETE FROM files WHERE path = ?", removed)
+            self.conn.executemany("DELETE FROM labels WHERE path = ?", removed)
+            self.conn.executemany("DELETE FROM image_info WHERE path = ?", removed)
+            self.conn.executemany("DELETE FROM image_hash WHERE path = ?", removed)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files (path, stem, kind, size, mtime_ns) VALUES (?, ?, ?, ?, ?)", upserts)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO labels (path, num_boxes, classes) VALUES (?, ?, ?)", parsed)
+        return counts
+
+    def _scan(self) -> Iterator[Tuple[str, int, int, int]]:
+        stack = [self.dataset_dir]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive:
+                            stack.append(entry.path)
+                        continue
+                    ext = os.path.splitext(entry.name)[1]
+                    if ext == self.annotation_extension:
+                        kind = LABEL_KIND
+                    elif ext.lower() in self.image_extensions:
+                        kind = IMAGE_KIND
+                    else:
+                        continue
+                    st = entry.stat()
+                    yield os.path.relpath(entry.path, self.dataset_dir), kind, st.st_size, st.st_mtime_ns
+
+    def _parse_labels(self, rel_paths: List[str], workers: Optional[int]) -> List[Tuple[str, Optional[int], Optional[str]]]:
+        abs_paths = [os.path.join(self.dataset_dir, p) for p in rel_paths]
+        if len(abs_paths) < 2048 or workers == 1:
+            results = list(map(_parse_label_classes, abs_paths))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_parse_label_classes, abs_paths, chunksize=512))
+        return [(rel, num_boxes, classes) for rel, (num_boxes, classes) in zip(rel_paths, results)]
+
+    # ------------------------------
+    # Queries
+    # ------------------------------
+    def abspath(self, rel_path: str) -> str:
+        return os.path.join(self.dataset_dir, rel_path)
+
+    def images(self, image_extensions: Optional[Sequence[str]] = None) -> List[str]:
+        exts = self._exts(image_extensions)
+        return [self.abspath(path) for (path,) in self.conn.execute(
+            "SELECT path FROM files WHERE kind = ? ORDER BY path", (IMAGE_KIND,))
+            if os.path.splitext(path)[1].lower() in exts]
+
+    def labels(self) -> List[str]:
+        return [self.abspath(path) for (path,) in self.conn.execute(
+            "SELECT path FROM files WHERE kind = ? ORDER BY path", (LABEL_KIND,))]
+
+    def image_map(self, image_extensions: Optional[Sequence[str]] = None) -> Dict[str, str]:
+        """{absolute path without extension: image path}; when several images share a stem the first
+        extension in `image_extensions` wins."""
+        exts = self._exts(image_extensions)
+        priority = {ext: i for i, ext in enumerate(exts)}
+        image_map = {}
+        best = {}
+        for path, stem in self.conn.execute("SELECT path, stem FROM files WHERE kind = ?", (IMAGE_KIND,)):
+            rank = priority.get(os.path.splitext(path)[1].lower())
+            if rank is None:
+                continue
+            if stem not in best or rank < best[stem]:
+                best[stem] = rank
+                image_map[self.abspath(stem)] = self.abspath(path)
+        return image_map
+
+    def pairs(self, image_extensions: Optional[Sequence[str]] = None) -> List[Tuple[str, str]]:
+        """(image path, label path) for every image that has a label file."""
+        label_stems = {stem for (stem,) in self.conn.execute(
+            "SELECT stem FROM files WHERE kind = ?", (LABEL_KIND,))}
+        return sorted(
+            (image_path, stem + self.annotation_extension)
+            for stem, image_path in self.image_map(image_extensions).items()
+            if os.path.relpath(stem, self.dataset_dir) in label_stems
+        )
+
+    def label_stats(self) -> List[Tuple[str, int, int]]:
+        """(label path, size, mtime_ns) for every label file, sorted by path."""
+        return [(self.abspath(path), size, mtime_ns) for path, size, mtime_ns in self.conn.execute(
+            "SELECT path, size, mtime_ns FROM files WHERE kind = ? ORDER BY path", (LABEL_KIND,))]
+
+    def iter_label_classes(self) -> Iterator[Tuple[str, Optional[List[int]]]]:
+        """Yields (label path, class id per annotation) from the cache; None if the file is malformed."""
+        for path, classes in self.conn.execute("SELECT path, classes FROM labels ORDER BY path"):
+            yield self.abspath(path), (None if classes is None else [int(c) for c in classes.split()])
+
+    def label_classes(self, label_path: str) -> Optional[List[int]]:
+        row = self.conn.execute(
+            "SELECT classes FROM labels WHERE path = ?", (os.path.relpath(label_path, self.dataset_dir),)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return [int(c) for c in row[0].split()]
+
+    def images_to_check(self, full_decode: bool = False) -> List[Tuple[str, int, int]]:
+        """(image path, size, mtime_ns) of images without an up-to-date image_info row.
+        With full_decode, images that were only header-checked are returned as well. Header-checked images
+        flagged as truncated are always re-checked (cheap, and clears results of older, stricter checks)."""
+        return self._stale_images('image_info', " OR i.decoded = 0" if full_decode else
+                                  " OR (i.decoded = 0 AND i.status = 'truncated')")
+
+    def _stale_images(self, table: str, extra_condition: str = "") -> List[Tuple[str, int, int]]:
+        query = (f"SELECT f.path, f.size, f.mtime_ns FROM files f LEFT JOIN {table} i ON i.path = f.path "
+                 f"WHERE f.kind = ? AND (i.path IS NULL OR i.size != f.size OR i.mtime_ns != f.mtime_ns"
+                 f"{extra_condition})")
+        return [(self.abspath(path), size, mtime_ns) for path, size, mtime_ns in self.conn.execute(query, (IMAGE_KIND,))]
+
+    def update_image_info(self, rows: List[Dict]):
+        """Store ImageChecker results (dicts with path, size, mtime_ns and the image_info columns)."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO image_info (path, size, mtime_ns, width, height, mode, format, "
+                "orientation, decoded, status, error) VALUES (:path, :size, :mtime_ns, :width, :height, "
+                ":mode, :format, :orientation, :decoded, :status, :error)",
+                [dict(row, path=os.path.relpath(row['path'], self.dataset_dir)) for row in rows]
+            )
+
+    def image_info(self) -> Dict[str, Dict]:
+        """{image path: info} for every image with an up-to-date image_info row."""
+        cursor = self.conn.execute(
+            "SELECT i.path, i.width, i.height, i.mode, i.format, i.orientation, i.decoded, i.status, i.error "
+            "FROM image_info i JOIN files f ON f.path = i.path "
+            "WHERE i.size = f.size AND i.mtime_ns = f.mtime_ns"
+        )
+        columns = [d[0] for d in cursor.description][1:]
+        return {self.abspath(row[0]): dict(zip(columns, row[1:])) for row in cursor}
+
+    def images_to_hash(self) -> List[Tuple[str, int, int]]:
+        """(image path, size, mtime_ns) of images without up-to-date perceptual hashes."""
+        return self._stale_images('image_hash')
+
+    def update_image_hashes(self, rows: List[Tuple[str, int, int, int, int, int]]):
+        """Store (image path, size, mtime_ns, ahash, dhash, phash) rows with unsigned 64-bit hashes
+        (None hashes mark an unreadable image, so it is not hashed again until it changes)."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO image_hash (path, size, mtime_ns, ahash, dhash, phash) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(os.path.relpath(path, self.dataset_dir), size, mtime_ns,
+                  *(None if h is None else _to_signed64(h) for h in hashes))
+                 for path, size, mtime_ns, *hashes in rows]
+            )
+
+    def image_hashes(self, hash_name: str = 'phash') -> Dict[str, int]:
+        """{image path: unsigned 64-bit hash} for every readable image with an up-to-date hash."""
+        if hash_name not in ('ahash', 'dhash', 'phash'):
+            raise ValueError(f"Unknown hash '{hash_name}'")
+        return {self.abspath(path): value & 0xFFFFFFFFFFFFFFFF for path, value in self.conn.execute(
+            f"SELECT h.path, h.{hash_name} FROM image_hash h JOIN files f ON f.path = h.path "
+            f"WHERE h.size = f.size AND h.mtime_ns = f.mtime_ns AND h.{hash_name} IS NOT NULL")}
+
+    def _exts(self, image_extensions: Optional[Sequence[str]]) -> Tuple[str, ...]:
+        return self.image_extensions if image_extensions is None else tuple(e.lower() for e in image_extensions)
+
+
+def _to_signed64(value: int) -> int:
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _parse_label_classes(label_path: str) -> Tuple[Optional[int], Optional[str]]:
+    """Pool task: (number of annotations, space separated class ids) or (None, None) if malformed."""
+    class_ids = []
+    try:
+        with open(label_path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if parts:
+                    class_ids.append(str(int(parts[0])))
+    except (OSError, ValueError):
+        return None, None
+    return len(class_ids), ' '.join(class_ids)
+
+
+# ------------------------------
+# ⚙️ User Configuration
+# ------------------------------
+if __name__ == "__main__":
+    dataset_directory = "datasets/human_dataset"
+
+    with DatasetIndex(dataset_directory) as index:
+        print(f"Index refreshed: {index.refresh()}")
+        print(f"Image-label pairs: {len(index.pairs())}")
@@ -9,6 +9,9 @@
 #    based on user-defined ratios.
 # 3. Writing the results into three files: train.txt, val.txt, and test.txt,
 #    each listing the full paths of images in the corresponding set.
+# 4. Optional stratified splitting (`stratify=True`) that keeps every class, including rare ones, close to the
+#    requested ratios in each split, and optional grouping (`group_by`) so related frames (same folder / video)
+#    never end up in different splits.
 #
 # Use Case:
 # This tool is especially helpful for preparing datasets for object detection models such as YOLO,
@@ -22,6 +25,8 @@
 #    並確認是否有對應的標註檔案（如 .txt）。
 # 2. 將符合條件的影像-標註對，依據訓練、驗證、測試的比例（可自訂）進行隨機分割。
 # 3. 將分割結果分別寫入 train.txt、val.txt、test.txt 檔案中，每行為影像檔案的完整路徑。
+# 4. 可選的分層分割（`stratify=True`），讓每個類別（包含稀有類別）在各分割中都接近指定比例；
+#    以及分組（`group_by`），讓相關的影格（同資料夾 / 同影片）不會被分到不同的分割。
 #
 # 使用情境：
 # 適用於如 YOLO 等物件偵測模型訓練前的資料準備階段，能夠自動掃描資料並分割成訓練集、驗證集與測試集。
@@ -31,7 +36,19 @@
 
 import os
 import random
-from typing import List, Tuple
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from dataset_index import DatasetIndex
+
+SPLIT_NAMES = ('train', 'val', 'test')
+# trailing frame number of video frame file names, e.g. "clip01_000123" -> "clip01"
+# frame number after a separator or 'frame' (clip3_frame_0001, clip3-0001, clip3frame12); 'img123' is not one
+FRAME_SUFFIX = re.compile(r'([_\-. ]+(frame)?[_\-. ]*|frame[_\-. ]*)\d+$', re.IGNORECASE)
 
 class DatasetPreparer:
     def __init__(
@@ -43,7 +60,12 @@ class DatasetPreparer:
         test_ratio: float = 0.05,
         image_extensions: Tuple[str, ...] = ('.jpg', '.jpeg', '.png'),
         annotation_extension: str = '.txt',
-        seed: int = 42
+        seed: int = 42,
+        index: Optional[DatasetIndex] = None,
+        stratify: bool = False,
+        group_by: Union[None, str, Callable[[str], str]] = None,
+        duplicate_groups: Optional[List[List[str]]] = None,
+        workers: Optional[int] = None
     ):
         self.dataset_root = dataset_root
         self.output_dir = output_dir
@@ -53,6 +75,11 @@ class DatasetPreparer:
         self.image_extensions = image_extensions
         self.annotation_extension = annotation_extension
         self.seed = seed
+        self.index = index
+        self.stratify = stratify
+        self.group_by = group_by  # None, 'folder', 'video' or a callable(image_path) -> group key
+        self.duplicate_groups = duplicate_groups  # e.g. ImageDeduplicator.find_groups(), kept in one split
+        self.workers = workers
         self.image_label_pairs: List[str] = []
 
         self._validate_ratios()
@@ -64,6 +91,10 @@ class DatasetPreparer:
             raise ValueError("Train, validation, and test ratios must sum to 1.0")
 
     def collect_valid_pairs(self):
+        if self.index is not None:
+            self._collect_pairs_from_index()
+            return
+
         print(f"Scanning '{self.dataset_root}' for image-label pairs...")
         for root, _, files in os.walk(self.dataset_root):
             for file in files:
@@ -77,7 +108,21 @@ class DatasetPreparer:
                         print(f"Warning: Missing annotation for image '{image_path}'")
         print(f"Total valid image-label pairs found: {len(self.image_label_pairs)}")
 
+    def _collect_pairs_from_index(self):
+        print(f"Refreshing index '{self.index.index_path}'...")
+        print(f"Index changes: {self.index.refresh()}")
+        if self.index.annotation_extension != self.annotation_extension:
+            raise ValueError("Index annotation_extension does not match the preparer's annotation_extension")
+        self.image_label_pairs = [image_path for image_path, _ in self.index.pairs(self.image_extensions)]
+        missing = len(self.index.images(self.image_extensions)) - len(self.image_label_pairs)
+        if missing:
+            print(f"Warning: {missing} images have no annotation")
+        print(f"Total valid image-label pairs found: {len(self.image_label_pairs)}")
+
     def split_dataset(self):
+        if self.stratify or self.group_by is not None or self.duplicate_groups:
+            return self._split_stratified()
+
         print("Splitting dataset into train/val/test...")
         random.shuffle(self.image_label_pairs)
         total = len(self.image_label_pairs)
@@ -94,6 +139,156 @@ class DatasetPreparer:
 
         return train_set, val_set, test_set
 
+    def _split_stratified(self):
+        print("Splitting dataset into train/val/test (stratified)...")
+        group_ids = self._group_ids()
+        item_ptr, item_classes, item_counts = self._class_counts_per_group(group_ids)
+        assignment = self._assign_groups(item_ptr, item_classes, item_counts)[group_ids]
+
+        splits = tuple([self.image_label_pairs[i] for i in np.flatnonzero(assignment == s)]
+                       for s in range(len(SPLIT_NAMES)))
+        for name, split in zip(('Train', 'Validation', 'Test'), splits):
+            print(f"{name} set size: {len(split)}")
+        return splits
+
+    def _group_key(self, image_path: str) -> str:
+        if self.group_by == 'folder':
+            return os.path.dirname(image_path)
+        if self.group_by == 'video':
+            folder, name = os.path.split(os.path.splitext(image_path)[0])
+            prefix = FRAME_SUFFIX.sub('', name)
+            # only a named clip groups its frames; all-numeric names (COCO ids, dates) stay separate images
+            if not re.search('[a-zA-Z]', prefix):
+                prefix = name
+            return os.path.join(folder, prefix)
+        return self.group_by(image_path)
+
+    def _group_ids(self) -> np.ndarray:
+        """Group id per image (every image is its own group without group_by), duplicate groups merged."""
+        if self.group_by is None:
+            group_ids = np.arange(len(self.image_label_pairs), dtype=np.int64)
+        else:
+            keys = {}
+            group_ids = np.array([keys.setdefault(self._group_key(p), len(keys)) for p in self.image_label_pairs],
+                                 dtype=np.int64)
+        if self.duplicate_groups:
+            group_ids = self._merge_duplicate_groups(group_ids)
+        return group_ids
+
+    def _merge_duplicate_groups(self, group_ids: np.ndarray) -> np.ndarray:
+        position = {os.path.abspath(p): i for i, p in enumerate(self.image_label_pairs)}
+        parent = np.arange(int(group_ids.max()) + 1 if len(group_ids) else 0)
+
+        def find(g: int) -> int:
+            while parent[g] != g:
+                parent[g] = parent[parent[g]]
+                g = parent[g]
+            return g
+
+        for duplicates in self.duplicate_groups:
+            members = [group_ids[position[p]] for p in map(os.path.abspath, duplicates) if p in position]
+            for g in members[1:]:
+                parent[find(g)] = find(members[0])
+        roots = np.array([find(g) for g in range(len(parent))], dtype=np.int64)
+        return np.unique(roots, return_inverse=True)[1][group_ids]
+
+    def _class_counts_per_group(self, group_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Class multiset of every group in CSR form: the classes of group g are
+        classes[ptr[g]:ptr[g + 1]] with instance counts counts[ptr[g]:ptr[g + 1]].
+        Images without annotations count as one instance of a pseudo class (max class id + 1).
+        """
+        label_paths = [os.path.splitext(p)[0] + self.annotation_extension for p in self.image_label_pairs]
+        if self.index is not None:
+            lengths, class_ids, malformed = self._class_ids_from_index(label_paths)
+        else:
+            chunks = [label_paths[i:i + 2048] for i in range(0, len(label_paths), 2048)]
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                parts = list(executor.map(_read_class_ids, chunks))
+            lengths = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+            class_ids = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+            malformed = int(sum(p[2] for p in parts))
+        if malformed:
+            print(f"Warning: {malformed} malformed label files are treated as background images")
+
+        # negative class ids would corrupt the group * num_classes + class keys
+        negative = class_ids < 0
+        if negative.any():
+            print(f"Warning: skipped {int(negative.sum())} annotations with a negative class id")
+            file_of_row = np.repeat(np.arange(len(lengths)), lengths)
+            lengths = np.bincount(file_of_row[~negative], minlength=len(lengths)).astype(np.int64)
+            class_ids = class_ids[~negative]
+
+        background = int(class_ids.max()) + 1 if len(class_ids) else 0
+        empty = np.flatnonzero(lengths == 0)
+        row_groups = np.concatenate([np.repeat(group_ids, lengths), group_ids[empty]])
+        row_classes = np.concatenate([class_ids, np.full(len(empty), background, dtype=np.int64)])
+
+        num_classes = background + 1
+        keys, counts = np.unique(row_groups * num_classes + row_classes, return_counts=True)
+        num_groups = int(group_ids.max()) + 1 if len(group_ids) else 0
+        ptr = np.searchsorted(keys // num_classes, np.arange(num_groups + 1))
+        return ptr, keys % num_classes, counts
+
+    def _class_ids_from_index(self, label_paths: List[str]) -> Tuple[np.ndarray, np.ndarray, int]:
+        """(annotations per file, class ids in file order, malformed file count) streamed from the index cache."""
+        position = {os.path.abspath(p): i for i, p in enumerate(label_paths)}
+        lengths = np.zeros(len(label_paths), dtype=np.int64)
+        files, ids = array('q'), array('q')
+        malformed = 0
+        for path, classes in self.index.iter_label_classes():
+            i = position.get(path)
+            if i is None:
+                continue
+            if classes is None:  # malformed: treated as a background image, like _read_class_ids
+                malformed += 1
+                continue
+            lengths[i] = len(classes)
+            files.extend([i] * len(classes))
+            ids.extend(classes)
+        # the index yields files in path order; a stable sort restores the order of label_paths
+        order = np.argsort(np.frombuffer(files, dtype=np.int64), kind='stable')
+        return lengths, np.frombuffer(ids, dtype=np.int64)[order], malformed
+
+    def _assign_groups(self, ptr: np.ndarray, classes: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        """
+        Greedy iterative stratification in one pass over the groups: groups containing the rarest classes
+        are placed first, each into the split that is furthest below its target for the group's rarest class.
+        """
+        ratios = [self.train_ratio, self.val_ratio, self.test_ratio]
+        active = [s for s, r in enumerate(ratios) if r > 0]
+        num_groups = len(ptr) - 1
+        num_classes = int(classes.max()) + 1 if len(classes) else 1
+
+        class_totals = np.bincount(classes, weights=counts, minlength=num_classes)
+        totals_list = class_totals.tolist()
+        # [split][class] instances still wanted, and groups still wanted per split
+        need = [(class_totals * r).tolist() for r in ratios]
+        need_groups = [num_groups * r for r in ratios]
+
+        # rarest class of each group, ties broken randomly but reproducibly
+        frequency = class_totals[classes]
+        rarest = np.full(num_groups, np.inf)
+        group_of_entry = np.repeat(np.arange(num_groups), np.diff(ptr))
+        np.minimum.at(rarest, group_of_entry, frequency)
+        rng = np.random.default_rng(self.seed)
+        order = np.lexsort((rng.random(num_groups), rarest))
+
+        assignment = np.zeros(num_groups, dtype=np.int8)
+        ptr_list, classes_list, counts_list = ptr.tolist(), classes.tolist(), counts.tolist()
+        for g in order.tolist():
+            entries = range(ptr_list[g], ptr_list[g + 1])
+            if not entries:
+                continue
+            rare = min(entries, key=lambda e: totals_list[classes_list[e]])
+            rare_class = classes_list[rare]
+            best = max(active, key=lambda s: (need[s][rare_class], need_groups[s]))
+            assignment[g] = best
+            for e in entries:
+                need[best][classes_list[e]] -= counts_list[e]
+            need_groups[best] -= 1
+        return assignment
+
     def write_split_files(self, train_set: List[str], val_set: List[str], test_set: List[str]):
         os.makedirs(self.output_dir, exist_ok=True)
         self._write_file('train.txt', train_set)
@@ -101,11 +296,11 @@ class DatasetPreparer:
         self._write_file('test.txt', test_set)
         print(f"Split files written to '{self.output_dir}'")
 
-    def _write_file(self, filename: str, dataset: List[str]):
+    def _write_file(self, filename: str, dataset: List[str], chunk_size: int = 65536):
         path = os.path.join(self.output_dir, filename)
-        with open(path, 'w') as f:
-            for img_path in dataset:
-                f.write(f"{img_path}\n")
+        with open(path, 'w', buffering=1 << 20) as f:
+            for i in range(0, len(dataset), chunk_size):
+                f.write(''.join(f"{img_path}\n" for img_path in dataset[i:i + chunk_size]))
         print(f"{filename}: {len(dataset)} entries")
 
     def run(self):
@@ -113,6 +308,32 @@ class DatasetPreparer:
         train_set, val_set, test_set = self.split_dataset()
         self.write_split_files(train_set, val_set, test_set)
 
+
+def _read_class_ids(label_paths: List[str]) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Pool task: (number of annotations per file, concatenated class ids, malformed file count) for a chunk
+    of label files. Unreadable files and files with a non-integer class id are treated as empty."""
+    lengths = np.zeros(len(label_paths), dtype=np.int64)
+    class_ids = []
+    malformed = 0
+    for i, label_path in enumerate(label_paths):
+        file_ids = []
+        try:
+            with open(label_path, 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    if parts:
+                        value = float(parts[0])
+                        if not value.is_integer():
+                            raise ValueError(f"class id {parts[0]}")
+                        file_ids.append(int(value))
+        except (OSError, ValueError):
+            malformed += 1
+            continue
+        class_ids.extend(file_ids)
+        lengths[i] = len(file_ids)
+    return lengths, np.array(class_ids, dtype=np.int64), malformed
+
+
 # =======================
 # 🛠️ Configuration Section
 # =======================
@@ -125,6 +346,9 @@ if __name__ == "__main__":
         test_ratio=0.0,
         image_extensions=('.jpg', '.jpeg', '.png'),
         annotation_extension='.txt',
-        seed=123
+        seed=123,
+        index=DatasetIndex("datasets/human_dataset", image_extensions=('.jpg', '.jpeg', '.png')),
+        stratify=True,                    # Keep class ratios (incl. rare classes) in every split
+        group_by=None                     # None / 'folder' / 'video': keep related frames in one split
     )
     preparer.run()
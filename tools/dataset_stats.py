@@ -0,0 +1,369 @@
+"""========================================================================================================
+#
+# ==============================================
+# DatasetStats computes the statistics needed to choose imgsz, class lists and split ratios for a YOLO dataset.
+# Its main capabilities include:
+# 1. Per-class instance counts and image counts, and the boxes-per-image distribution.
+# 2. Box width / height / size and aspect-ratio histograms in pixels of the original images.
+# 3. The share of objects (overall and per class) that end up smaller than N pixels when the image is
+#    resized to each candidate imgsz, so the effect of a smaller or larger imgsz can be read off directly.
+# 4. k-means clustering of box shapes (1 - IoU distance, like YOLO autoanchor) at the training imgsz,
+#    with the mean best IoU and the best possible recall of the resulting anchors.
+# 5. Everything is computed with NumPy in parallel chunks over a LabelStore; labels and image sizes come
+#    from the DatasetIndex caches (LabelStore / ImageChecker), so a rerun only parses and reads changed files.
+#    Results are written as JSON, optionally with a PNG overview (matplotlib).
+#
+# Use Case:
+# Inspecting a dataset before training: which imgsz keeps small objects detectable, which classes are rare,
+# and how box shapes are distributed.
+# ==============================================
+#
+# ==============================================
+# DatasetStats 計算選擇 imgsz、類別清單與分割比例所需的 YOLO 資料集統計資訊。
+# 它的主要功能包括：
+# 1. 各類別的實例數與影像數，以及每張影像的框數分佈。
+# 2. 以原始影像像素計算的框寬、框高、框大小與長寬比直方圖。
+# 3. 影像縮放到各候選 imgsz 時，小於 N 像素的物件比例（整體與各類別），可直接比較不同 imgsz 的影響。
+# 4. 以 k-means（1 - IoU 距離，與 YOLO autoanchor 相同）在訓練 imgsz 下對框形狀分群，
+#    並計算 anchors 的平均最佳 IoU 與最佳可能召回率（BPR）。
+# 5. 全部以 NumPy 在 LabelStore 上分塊平行計算；標註與影像尺寸來自 DatasetIndex 的快取
+#    （LabelStore / ImageChecker），重新執行時只會解析與讀取有變更的檔案。
+#    結果輸出為 JSON，並可選擇輸出 PNG 圖表（matplotlib）。
+#
+# 使用情境：
+# 訓練前檢視資料集：哪個 imgsz 能保留小物件、哪些類別稀少、框的形狀如何分佈。
+# ==============================================
+#
+========================================================================================================"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from dataset_index import DatasetIndex
+from image_checker import ImageChecker
+from label_store import LabelStore
+
+SIZE_BINS = np.array([0, 4, 8, 16, 32, 64, 96, 128, 256, 512, 1024, 2048, np.inf])  # pixels
+ASPECT_BINS = np.array([0, 1 / 8, 1 / 4, 1 / 2, 2 / 3, 3 / 2, 2, 4, 8, np.inf])     # width / height
+MAX_BOXES_BIN = 100  # boxes-per-image histogram: the last bin holds every image with more boxes
+
+
+class DatasetStats:
+    def __init__(self, index: DatasetIndex, store_dir: str, names: Optional[Sequence[str]] = None,
+                 workers: Optional[int] = None, files_per_chunk: int = 65536):
+        """
+        Args:
+            index: DatasetIndex of the dataset (refreshed on every run)
+            store_dir: LabelStore folder, built or incrementally rebuilt on every run
+            names: class names by id, used in the report and the plots
+            workers: process pool size (None = os.cpu_count())
+            files_per_chunk: label files per statistics task
+        """
+        self.index = index
+        self.store_dir = store_dir
+        self.names = list(names) if names is not None else None
+        self.workers = workers
+        self.files_per_chunk = files_per_chunk
+
+    def compute(self, imgsz_candidates: Sequence[int] = (320, 640, 1280), small_thresholds: Sequence[int] = (8, 16, 32),
+                num_anchors: int = 9, anchor_imgsz: Optional[int] = None, kmeans_samples: int = 200000,
+                seed: int = 0) -> Dict:
+        """
+        Compute every statistic.
+
+        Args:
+            imgsz_candidates: imgsz values for the small object analysis
+            small_thresholds: an object is "smaller than N" when its longer side is below N pixels after the
+                              image is resized so its longer side equals imgsz (ultralytics letterbox)
+            num_anchors: k-means clusters (0 = skip clustering)
+            anchor_imgsz: imgsz the anchors are computed at (None = the largest candidate not above 640)
+            kmeans_samples: boxes sampled for clustering
+            seed: seed for the k-means sample and initialization
+
+        Returns:
+            report dict (also what save() writes)
+        """
+        store = LabelStore.build(self.store_dir, index=self.index, workers=self.workers)
+        image_sizes = self._image_sizes(store)
+        imgsz_candidates = sorted(imgsz_candidates)
+        if anchor_imgsz is None:
+            anchor_imgsz = max([s for s in imgsz_candidates if s <= 640] or imgsz_candidates[:1])
+        sample_rate = min(1.0, kmeans_samples / max(store.num_boxes, 1))
+
+        ranges = [(start, min(start + self.files_per_chunk, len(store)))
+                  for start in range(0, len(store), self.files_per_chunk)]
+        totals = None
+        samples = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            results = executor.map(_chunk_stats, repeat(self.store_dir), ranges,
+                                    [image_sizes[start:end] for start, end in ranges], repeat(imgsz_candidates),
+                                    repeat(small_thresholds), repeat(sample_rate), repeat(seed))
+            for partial, sample in results:
+                totals = partial if totals is None else _merge(totals, partial)
+                samples.append(sample)
+        if totals is None:
+            raise ValueError(f"No label files in '{store.root}'")
+        sample = np.concatenate(samples)
+
+        report = self._report(store, totals, image_sizes, imgsz_candidates, small_thresholds)
+        if num_anchors and len(sample) >= num_anchors:
+            report['anchors'] = kmeans_anchors(sample * anchor_imgsz, num_anchors, seed=seed)
+            report['anchors']['imgsz'] = anchor_imgsz
+        self.report = report
+        return report
+
+    def _image_sizes(self, store: LabelStore) -> np.ndarray:
+        """float64 (M, 2) width / height of the image of each label file as loaded (EXIF rotation applied),
+        NaN when the image is missing or unreadable. Only new or changed images are read (header only)."""
+        info = ImageChecker(self.index, workers=self.workers).check()
+        image_map = self.index.image_map()
+        sizes = np.full((len(store), 2), np.nan)
+        for i in range(len(store)):
+            image_path = image_map.get(os.path.splitext(store.abspath(i))[0])
+            row = info.get(image_path) if image_path else None
+            if row and row['status'] == 'ok' and row['width']:
+                rotated = row['orientation'] in (5, 6, 7, 8)
+                sizes[i] = (row['height'], row['width']) if rotated else (row['width'], row['height'])
+        return sizes
+
+    def _report(self, store: LabelStore, totals: Dict[str, np.ndarray], image_sizes: np.ndarray,
+                imgsz_candidates: List[int], small_thresholds: Sequence[int]) -> Dict:
+        nc = len(totals['instances'])
+        names = [self.names[c] if self.names and c < len(self.names) else str(c) for c in range(nc)]
+        boxes_per_image = store.boxes_per_file()
+        measured = totals['measured_instances']
+        small = {
+            str(imgsz): {
+                str(threshold): {
+                    'all': float(totals['small'][i, j].sum() / max(measured.sum(), 1)),
+                    'per_class': {names[c]: float(totals['small'][i, j, c] / measured[c])
+                                  for c in range(nc) if measured[c]},
+                } for j, threshold in enumerate(small_thresholds)
+            } for i, imgsz in enumerate(imgsz_candidates)
+        }
+        valid_sizes = image_sizes[~np.isnan(image_sizes[:, 0])]
+        return {
+            'root': store.root,
+            'images': len(store),
+            'boxes': int(store.num_boxes),
+            'empty_images': int((boxes_per_image == 0).sum()),
+            'images_without_size': int(len(store) - len(valid_sizes)),
+            'malformed_labels': int((store.flags != 0).sum()),
+            'classes': {names[c]: {'id': c, 'instances': int(totals['instances'][c]),
+                                   'images': int(totals['images'][c])} for c in range(nc)},
+            'boxes_per_image': {'mean': float(boxes_per_image.mean()) if len(store) else 0.0,
+                                'median': float(np.median(boxes_per_image)) if len(store) else 0.0,
+                                'max': int(boxes_per_image.max()) if len(store) else 0,
+                                'histogram': totals['boxes_per_image'].tolist()},
+            'image_size': {'width_median': float(np.median(valid_sizes[:, 0])) if len(valid_sizes) else None,
+                           'height_median': float(np.median(valid_sizes[:, 1])) if len(valid_sizes) else None},
+            'box_pixels': {'bins': _bin_labels(SIZE_BINS),
+                           'width': totals['width_hist'].tolist(),
+                           'height': totals['height_hist'].tolist(),
+                           'size': totals['size_hist'].tolist()},  # sqrt(width * height)
+            'aspect_ratio': {'bins': _bin_labels(ASPECT_BINS), 'histogram': totals['aspect_hist'].tolist()},
+            'small_objects': small,
+        }
+
+    def save(self, output_path: str, plot: bool = False) -> str:
+        """Write the last report as JSON (and <output>.png with plot=True)."""
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump(self.report, f, indent=2, ensure_ascii=False)
+        print(f"Dataset statistics written to {output_path}")
+        if plot:
+            plot_path = os.path.splitext(output_path)[0] + '.png'
+            plot_report(self.report, plot_path)
+            print(f"Plots written to {plot_path}")
+        return output_path
+
+    def print_summary(self):
+        r = self.report
+        print(f"Images: {r['images']} ({r['empty_images']} empty), boxes: {r['boxes']}, "
+              f"boxes/image: {r['boxes_per_image']['mean']:.2f} mean, {r['boxes_per_image']['max']} max")
+        print(f"{'class':<20}{'instances':>12}{'images':>10}")
+        for name, c in r['classes'].items():
+            print(f"{name:<20}{c['instances']:>12}{c['images']:>10}")
+        for imgsz, shares in r['small_objects'].items():
+            text = ', '.join(f"<{t}px {s['all']:.1%}" for t, s in shares.items())
+            print(f"imgsz {imgsz}: {text}")
+        if 'anchors' in r:
+            a = r['anchors']
+            print(f"Anchors @ {a['imgsz']}: {a['anchors']} (mean best IoU {a['mean_best_iou']:.3f}, BPR {a['bpr']:.3f})")
+
+
+def _chunk_stats(store_dir: str, file_range: Tuple[int, int], image_sizes: np.ndarray, imgsz_candidates: List[int],
+                 small_thresholds: Sequence[int], sample_rate: float, seed: int
+                 ) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """Pool task: partial statistics of files [start, end) and a sample of normalized-to-long-side box (w, h)."""
+    store = LabelStore(store_dir)
+    start, end = file_range
+    offsets = np.asarray(store.offsets[start:end + 1])
+    rows = np.asarray(store.labels[offsets[0]:offsets[-1]])
+    counts = np.diff(offsets)
+    file_of_row = np.repeat(np.arange(end - start), counts)
+    valid = rows[:, 0] >= 0  # negative / NaN class ids are left out of the class statistics
+    rows, file_of_row = rows[valid], file_of_row[valid]
+    classes = rows[:, 0].astype(np.int64)
+    nc = int(classes.max()) + 1 if len(classes) else 0
+
+    totals = {
+        'instances': np.bincount(classes, minlength=nc),
+        'images': np.bincount(np.unique(file_of_row * max(nc, 1) + classes) % max(nc, 1), minlength=nc)[:nc],
+        'boxes_per_image': np.bincount(np.minimum(counts, MAX_BOXES_BIN), minlength=MAX_BOXES_BIN + 1),
+    }
+
+    # pixel statistics, only for boxes whose image size is known
+    size = image_sizes[file_of_row]
+    measured = ~np.isnan(size[:, 0])
+    classes_m = classes[measured]
+    w = rows[measured, 3] * size[measured, 0]
+    h = rows[measured, 4] * size[measured, 1]
+    totals['measured_instances'] = np.bincount(classes_m, minlength=nc)
+    totals['width_hist'] = np.histogram(w, SIZE_BINS)[0]
+    totals['height_hist'] = np.histogram(h, SIZE_BINS)[0]
+    totals['size_hist'] = np.histogram(np.sqrt(w * h), SIZE_BINS)[0]
+    totals['aspect_hist'] = np.histogram(w / np.maximum(h, 1e-9), ASPECT_BINS)[0]
+
+    # box longer side relative to the image longer side: multiply by imgsz for pixels after resizing
+    long_side = size[measured].max(axis=1)
+    rel = np.maximum(w, h) / long_side
+    small = np.zeros((len(imgsz_candidates), len(small_thresholds), nc), dtype=np.int64)
+    for i, imgsz in enumerate(imgsz_candidates):
+        for j, threshold in enumerate(small_thresholds):
+            small[i, j] = np.bincount(classes_m[rel * imgsz < threshold], minlength=nc)
+    totals['small'] = small
+
+    pick = np.random.default_rng([seed, start]).random(len(w)) < sample_rate
+    sample = np.stack([w[pick], h[pick]], axis=1) / long_side[pick, None]
+    return totals, sample
+
+
+def _merge(a: Dict[str, np.ndarray], b: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Sum partial statistics; per-class arrays (last axis) are padded to the larger class count."""
+    merged = {}
+    for key in a:
+        x, y = a[key], b[key]
+        if x.shape != y.shape:
+            shape = np.maximum(x.shape, y.shape)
+            x = np.pad(x, [(0, s - d) for s, d in zip(shape, x.shape)])
+            y = np.pad(y, [(0, s - d) for s, d in zip(shape, y.shape)])
+        merged[key] = x + y
+    return merged
+
+
+def _bin_labels(edges: np.ndarray) -> List[str]:
+    fmt = lambda v: 'inf' if np.isinf(v) else f"{v:.3g}"
+    return [f"{fmt(lo)}-{fmt(hi)}" for lo, hi in zip(edges[:-1], edges[1:])]
+
+
+def wh_iou(wh: np.ndarray, anchors: np.ndarray) -> np.ndarray:
+    """(n, k) IoU of boxes and anchors given as (w, h), both centered at the origin."""
+    inter = np.minimum(wh[:, None, 0], anchors[None, :, 0]) * np.minimum(wh[:, None, 1], anchors[None, :, 1])
+    return inter / (wh[:, None].prod(2) + anchors[None].prod(2) - inter)
+
+
+def kmeans_anchors(wh: np.ndarray, k: int = 9, iterations: int = 100, ratio_threshold: float = 4.0,
+                   seed: int = 0) -> Dict:
+    """
+    k-means on box (w, h) with 1 - IoU as distance (k-means++ initialization, median update).
+
+    Returns:
+        {'anchors': [[w, h], ...] sorted by area, 'mean_best_iou', 'bpr'}; bpr is the share of boxes with an
+        anchor within `ratio_threshold` in both width and height (the YOLO autoanchor criterion)
+    """
+    rng = np.random.default_rng(seed)
+    wh = wh[(wh > 1).all(axis=1)].astype(np.float64)  # boxes under 2 px carry no shape information
+    if len(wh) < k:
+        raise ValueError(f"Only {len(wh)} boxes for {k} clusters")
+    anchors = wh[[rng.integers(len(wh))]]
+    while len(anchors) < k:
+        distance = (1 - wh_iou(wh, anchors).max(axis=1)) ** 2
+        total = distance.sum()  # 0 when every box shape is already an anchor
+        anchors = np.vstack([anchors, wh[rng.choice(len(wh), p=distance / total if total > 0 else None)]])
+
+    assignment = None
+    for _ in range(iterations):
+        new_assignment = wh_iou(wh, anchors).argmax(axis=1)
+        if assignment is not None and (new_assignment == assignment).all():
+            break
+        assignment = new_assignment
+        for c in range(k):
+            members = wh[assignment == c]
+            if len(members):
+                anchors[c] = np.median(members, axis=0)
+
+    anchors = anchors[np.argsort(anchors.prod(axis=1))]
+    ratio = wh[:, None] / anchors[None]
+    best_ratio = np.minimum(ratio, 1 / ratio).min(axis=2).max(axis=1)
+    return {'anchors': np.round(anchors, 1).tolist(),
+            'mean_best_iou': float(wh_iou(wh, anchors).max(axis=1).mean()),
+            'bpr': float((best_ratio > 1 / ratio_threshold).mean())}
+
+
+def plot_report(report: Dict, plot_path: str):
+    """Overview figure of a report: class counts, boxes per image, box sizes, aspect ratios, small objects."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(2, 3, figsize=(18, 10))
+    names = list(report['classes'])
+    axes[0, 0].bar(names, [c['instances'] for c in report['classes'].values()])
+    axes[0, 0].set_title('Instances per class')
+    axes[0, 0].tick_params(axis='x', rotation=90)
+
+    hist = report['boxes_per_image']['histogram']
+    axes[0, 1].bar(range(len(hist)), hist)
+    axes[0, 1].set_title(f'Boxes per image (last bin: >= {MAX_BOXES_BIN})')
+
+    bins = report['box_pixels']['bins']
+    x = np.arange(len(bins))
+    for offset, key in ((-0.25, 'width'), (0, 'height'), (0.25, 'size')):
+        axes[0, 2].bar(x + offset, report['box_pixels'][key], width=0.25, label=key)
+    axes[0, 2].set_xticks(x, bins, rotation=45)
+    axes[0, 2].set_title('Box pixels (original images)')
+    axes[0, 2].legend()
+
+    axes[1, 0].bar(report['aspect_ratio']['bins'], report['aspect_ratio']['histogram'])
+    axes[1, 0].set_title('Aspect ratio (w / h)')
+    axes[1, 0].tick_params(axis='x', rotation=45)
+
+    imgsz = list(report['small_objects'])
+    for threshold in next(iter(report['small_objects'].values()), {}):
+        axes[1, 1].plot(imgsz, [report['small_objects'][s][threshold]['all'] for s in imgsz], marker='o',
+                        label=f'< {threshold} px')
+    axes[1, 1].set_title('Share of small objects by imgsz')
+    axes[1, 1].legend()
+
+    if 'anchors' in report:
+        anchors = np.array(report['anchors']['anchors'])
+        axes[1, 2].scatter(anchors[:, 0], anchors[:, 1])
+        axes[1, 2].set_title(f"k-means anchors @ {report['anchors']['imgsz']} "
+                             f"(BPR {report['anchors']['bpr']:.3f})")
+        axes[1, 2].set_xlabel('w')
+        axes[1, 2].set_ylabel('h')
+    else:
+        axes[1, 2].axis('off')
+
+    fig.tight_layout()
+    fig.savefig(plot_path, dpi=100)
+    plt.close(fig)
+
+
+# ------------------------------
+# ⚙️ User Configuration
+# ------------------------------
+if __name__ == "__main__":
+    dataset_directory = "datasets/human_dataset"
+    store_directory = "datasets/human_dataset_labels"
+
+    stats = DatasetStats(DatasetIndex(dataset_directory), store_directory)
+    stats.compute(imgsz_candidates=(320, 480, 640, 960, 1280), small_thresholds=(8, 16, 32), num_anchors=9)
+    stats.print_summary()
+    stats.save("runs/dataset_stats.json", plot=True)
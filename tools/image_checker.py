@@ -0,0 +1,144 @@
+"""========================================================================================================
+#
+# ==============================================
+# ImageChecker detects truncated or corrupt images in a dataset before they reach the training dataloader.
+# Its main capabilities include:
+# 1. Reading only the image header (size, mode, format, EXIF orientation) by default, plus a cheap
+#    end-of-image marker search in the last few KB for JPEG (FF D9) and PNG (IEND) to catch truncated files
+#    (trailing data after the marker, as written by many cameras, is accepted).
+# 2. Fully decoding images only when `full_decode=True`.
+# 3. Running the checks in a thread (or process) pool.
+# 4. Caching the results and image dimensions in the DatasetIndex, keyed by file size and mtime,
+#    so unchanged images are never checked twice and later steps can use the dimensions without decoding.
+#
+# Use Case:
+# Validating large image datasets quickly, instead of finding corrupt files as crashes or warnings
+# deep inside training.
+# ==============================================
+#
+# ==============================================
+# ImageChecker 在影像進入訓練 dataloader 之前找出截斷或損毀的影像。
+# 它的主要功能包括：
+# 1. 預設只讀取影像標頭（尺寸、色彩模式、格式、EXIF 方向），並以檢查 JPEG（FF D9）與 PNG（IEND）
+#    結尾標記（搜尋檔案最後數 KB，允許標記後的附加資料）的方式低成本地找出截斷的檔案。
+# 2. 只有在 `full_decode=True` 時才完整解碼影像。
+# 3. 以執行緒（或行程）池平行檢查。
+# 4. 將結果與影像尺寸快取於 DatasetIndex，以檔案大小與修改時間為鍵，未變動的影像不會重複檢查，
+#    後續步驟也能直接取得尺寸而不需解碼。
+#
+# 使用情境：
+# 快速驗證大型影像資料集，避免損毀檔案在訓練過程中才造成錯誤或警告。
+# ==============================================
+#
+========================================================================================================"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from dataset_index import DatasetIndex
+
+EXIF_ORIENTATION = 0x0112
+END_MARKER_SEARCH_BYTES = 4096  # camera / phone firmware often appends data after the end-of-image marker
+INFO_COLUMNS = ('width', 'height', 'mode', 'format', 'orientation', 'decoded', 'status', 'error')
+
+
+class ImageChecker:
+    def __init__(self, index: Optional[DatasetIndex] = None, full_decode: bool = False,
+                 workers: Optional[int] = None, use_threads: bool = True):
+        """
+        Args:
+            index: DatasetIndex used as result cache (None = check every image every time)
+            full_decode: decode the full image data instead of checking the header only
+            workers: pool size (None = executor default)
+            use_threads: thread pool (I/O bound header checks) or process pool (CPU bound full decode)
+        """
+        self.index = index
+        self.full_decode = full_decode
+        self.workers = workers
+        self.use_threads = use_threads
+
+    def check(self, image_paths: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """
+        Check images, only re-checking images that changed when an index is used.
+
+        Args:
+            image_paths: images to return results for (None = every image in the index)
+
+        Returns:
+            {image path: {width, height, mode, format, orientation, decoded, status, error}}
+            status is 'ok', 'truncated' or 'corrupt'
+        """
+        if self.index is None:
+            if image_paths is None:
+                raise ValueError("image_paths is required without an index")
+            entries = [(path, 0, 0) for path in image_paths]
+            return {row['path']: {k: row[k] for k in INFO_COLUMNS} for row in self._run(entries)}
+
+        self.index.refresh()
+        entries = self.index.images_to_check(self.full_decode)
+        if entries:
+            print(f"Checking {len(entries)} new or changed images...")
+            self.index.update_image_info(self._run(entries))
+        info = self.index.image_info()
+        if image_paths is not None:
+            info = {path: info[path] for path in map(os.path.abspath, image_paths) if path in info}
+        return info
+
+    def _run(self, entries: List[Tuple[str, int, int]]) -> List[Dict]:
+        executor_cls = ThreadPoolExecutor if self.use_threads else ProcessPoolExecutor
+        with executor_cls(max_workers=self.workers) as executor:
+            return list(executor.map(check_image, entries, repeat(self.full_decode), chunksize=64))
+
+    @staticmethod
+    def summarize(info: Dict[str, Dict]):
+        bad = {path: row for path, row in info.items() if row['status'] != 'ok'}
+        print(f"Images checked: {len(info)}, problems: {len(bad)}")
+        for path, row in sorted(bad.items())[:20]:
+            print(f"  {row['status']}: {path} ({row['error']})")
+        if len(bad) > 20:
+            print(f"  ... and {len(bad) - 20} more")
+
+
+def check_image(entry: Tuple[str, int, int], full_decode: bool = False) -> Dict:
+    """Pool task: check one (path, size, mtime_ns) entry and return an image_info row."""
+    path, size, mtime_ns = entry
+    row = {'path': path, 'size': size, 'mtime_ns': mtime_ns, 'width': None, 'height': None, 'mode': None,
+           'format': None, 'orientation': None, 'decoded': int(full_decode), 'status': 'ok', 'error': None}
+    try:
+        with Image.open(path) as im:
+            row['width'], row['height'] = im.size
+            row['mode'], row['format'] = im.mode, im.format
+            row['orientation'] = im.getexif().get(EXIF_ORIENTATION, 1)
+            if full_decode:
+                im.load()
+        if not full_decode and not _has_end_marker(path, row['format']):
+            row['status'], row['error'] = 'truncated', 'missing end-of-image marker'
+    except Exception as e:  # PIL raises many different exception types for broken files
+        row['status'], row['error'] = 'corrupt', f"{type(e).__name__}: {e}"
+    return row
+
+
+def _has_end_marker(path: str, image_format: Optional[str]) -> bool:
+    """Cheap truncation check: only reads the last few KB of the file, trailing data after the marker is fine."""
+    if image_format not in ('JPEG', 'PNG'):
+        return True
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - END_MARKER_SEARCH_BYTES, 0))
+        tail = f.read()
+    return (b'\xff\xd9' if image_format == 'JPEG' else b'IEND') in tail
+
+
+# ------------------------------
+# ⚙️ User Configuration
+# ------------------------------
+if __name__ == "__main__":
+    dataset_directory = "datasets/human_dataset"
+    decode_everything = False  # True: full decode (slower, catches corrupt pixel data)
+
+    checker = ImageChecker(DatasetIndex(dataset_directory), full_decode=decode_everything)
+    ImageChecker.summarize(checker.check())
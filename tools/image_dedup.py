@@ -0,0 +1,246 @@
+"""========================================================================================================
+#
+# ==============================================
+# ImageDeduplicator finds near-identical images (e.g. consecutive video frames) with perceptual hashes.
+# Its main capabilities include:
+# 1. Computing 64-bit aHash / dHash / pHash for every image in a process pool.
+# 2. Caching the hashes in the DatasetIndex (keyed by file size and mtime), so only new or changed
+#    images are hashed again (unreadable images are cached too).
+# 3. Finding near-duplicates with a BK-tree over Hamming distance instead of O(N^2) pairwise comparison,
+#    and grouping them around representative images (every member within max_distance of its
+#    representative, so slowly changing frames are not chained into one huge group).
+# 4. Either dropping all but one image of each group (delete or quarantine, together with the labels),
+#    or handing the groups to DatasetPreparer (`duplicate_groups`) so every group stays in a single split.
+#
+# Use Case:
+# Datasets built from video, where near-identical frames leak between train and val and waste training time.
+# ==============================================
+#
+# ==============================================
+# ImageDeduplicator 以感知雜湊（perceptual hash）找出幾乎相同的影像（例如連續的影片影格）。
+# 它的主要功能包括：
+# 1. 以行程池計算每張影像的 64-bit aHash / dHash / pHash。
+# 2. 將雜湊值快取於 DatasetIndex（以檔案大小與修改時間為鍵），只有新增或變動的影像才重新計算（無法讀取的影像也會快取）。
+# 3. 以漢明距離 BK-tree 搜尋近似重複影像（而非 O(N^2) 兩兩比對），並以代表影像為中心分成重複群組
+#    （每個成員與代表影像的距離都在 max_distance 內，緩慢變化的影格不會串成一個大群組）。
+# 4. 每個群組只保留一張影像（刪除或移到隔離資料夾，連同標註檔），
+#    或將群組交給 DatasetPreparer（`duplicate_groups`），讓同一群組留在同一個分割中。
+#
+# 使用情境：
+# 由影片擷取的資料集，避免幾乎相同的影格同時出現在 train 與 val，並減少重複樣本浪費的訓練時間。
+# ==============================================
+#
+========================================================================================================"""
+
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from dataset_index import DatasetIndex
+
+HASH_NAMES = ('ahash', 'dhash', 'phash')
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+DCT_32 = _dct_matrix(32)
+BIT_WEIGHTS = 1 << np.arange(63, -1, -1, dtype=np.uint64)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int((bits.ravel().astype(np.uint64) * BIT_WEIGHTS).sum())
+
+
+def compute_hashes(image_path: str) -> Tuple[int, int, int]:
+    """(aHash, dHash, pHash) of one image as unsigned 64-bit integers."""
+    with Image.open(image_path) as im:
+        im.draft('L', (64, 64))  # JPEG: let the decoder downscale, much cheaper than a full decode
+        gray = im.convert('L')
+    small = np.asarray(gray.resize((8, 8), Image.BILINEAR), dtype=np.float32)
+    ahash = _bits_to_int(small > small.mean())
+    wide = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.float32)
+    dhash = _bits_to_int(wide[:, 1:] > wide[:, :-1])
+    big = np.asarray(gray.resize((32, 32), Image.BILINEAR), dtype=np.float64)
+    low = (DCT_32 @ big @ DCT_32.T)[:8, :8]
+    phash = _bits_to_int(low > np.median(low.ravel()[1:]))
+    return ahash, dhash, phash
+
+
+def _hash_chunk(entries: List[Tuple[str, int, int]]) -> List[Tuple[str, int, int, int, int, int]]:
+    """Pool task: hash a chunk of (path, size, mtime_ns) entries, unreadable images get None hashes."""
+    rows = []
+    for path, size, mtime_ns in entries:
+        try:
+            rows.append((path, size, mtime_ns, *compute_hashes(path)))
+        except Exception as e:  # PIL raises many different exception types for broken files
+            print(f"Warning: cannot hash '{path}': {e}")
+            rows.append((path, size, mtime_ns, None, None, None))  # cached, not retried until it changes
+    return rows
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes with Hamming distance."""
+
+    def __init__(self):
+        self.root = None  # node: [hash, [items], {distance: child node}]
+
+    def add(self, value: int, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = (value ^ node[0]).bit_count()
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item], {}]
+                return
+            node = child
+
+    def query(self, value: int, radius: int) -> List:
+        """All items whose hash is within `radius` of `value`."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = (value ^ node[0]).bit_count()
+            if d <= radius:
+                found.extend(node[1])
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        return found
+
+
+class ImageDeduplicator:
+    def __init__(self, index: DatasetIndex, hash_name: str = 'phash', max_distance: int = 6,
+                 workers: Optional[int] = None, chunk_size: int = 256):
+        """
+        Args:
+            index: DatasetIndex used to list images and to cache hashes
+            hash_name: 'ahash', 'dhash' or 'phash'
+            max_distance: maximum Hamming distance (of 64 bits) for two images to count as duplicates
+            workers: process pool size (None = os.cpu_count())
+            chunk_size: images per hashing task
+        """
+        if hash_name not in HASH_NAMES:
+            raise ValueError(f"hash_name must be one of {HASH_NAMES}")
+        self.index = index
+        self.hash_name = hash_name
+        self.max_distance = max_distance
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def compute(self) -> Dict[str, int]:
+        """Hash new or changed images and return {image path: hash} for the whole dataset."""
+        self.index.refresh()
+        entries = self.index.images_to_hash()
+        if entries:
+            print(f"Hashing {len(entries)} new or changed images...")
+            chunks = [entries[i:i + self.chunk_size] for i in range(0, len(entries), self.chunk_size)]
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for rows in executor.map(_hash_chunk, chunks):
+                    self.index.update_image_hashes(rows)
+        return self.index.image_hashes(self.hash_name)
+
+    def find_groups(self) -> List[List[str]]:
+        """
+        Duplicate groups of 2+ images. Every group is built around a representative image (listed first,
+        the others sorted) and every member is within `max_distance` of it. Matches are not chained, so
+        consecutive frames of a slowly changing video do not merge into one group.
+        """
+        hashes = self.compute()
+
+        # identical hashes collapse first, so the tree only holds unique values
+        by_hash: Dict[int, List[str]] = {}
+        for path in sorted(hashes):
+            by_hash.setdefault(hashes[path], []).append(path)
+        values = list(by_hash)  # in path order, so representatives do not depend on the hashing order
+
+        tree = BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+
+        group_of = [-1] * len(values)
+        result = []
+        for i, value in enumerate(values):
+            if group_of[i] >= 0:
+                continue
+            members = sorted(j for j in tree.query(value, self.max_distance) if group_of[j] < 0 and j != i)
+            for j in [i] + members:
+                group_of[j] = i
+            paths = by_hash[value] + sorted(p for j in members for p in by_hash[values[j]])
+            if len(paths) > 1:
+                result.append(paths)
+        result.sort()
+        print(f"Found {len(result)} duplicate groups covering {sum(len(g) for g in result)} images")
+        return result
+
+    def drop_duplicates(self, groups: List[List[str]], action: str = 'quarantine',
+                        quarantine_dir: Optional[str] = None, annotation_extension: str = '.txt') -> int:
+        """
+        Keep the first (representative) image of every group and delete / quarantine the others with their labels.
+
+        Returns:
+            number of images actually removed (missing files and per-file OSErrors are skipped and reported)
+        """
+        if action not in ('quarantine', 'delete'):
+            raise ValueError("action must be 'quarantine' or 'delete'")
+        quarantine_dir = quarantine_dir or self.index.dataset_dir + '_duplicates'
+        removed = 0
+        errors = []
+        for group in groups:
+            for image_path in group[1:]:
+                if not os.path.exists(image_path):
+                    continue
+                label_path = os.path.splitext(image_path)[0] + annotation_extension
+                try:
+                    self._drop_file(image_path, action, quarantine_dir)
+                except OSError as e:
+                    errors.append(f"{image_path}: {e}")
+                    continue  # keep the label next to the image that is still there
+                removed += 1
+                if os.path.exists(label_path):
+                    try:
+                        self._drop_file(label_path, action, quarantine_dir)
+                    except OSError as e:
+                        errors.append(f"{label_path}: {e}")
+        print(f"{'Deleted' if action == 'delete' else 'Quarantined'} {removed} duplicate images")
+        for message in errors[:10]:
+            print(f"  Error: {message}")
+        if len(errors) > 10:
+            print(f"  ... and {len(errors) - 10} more errors")
+        return removed
+
+    def _drop_file(self, path: str, action: str, quarantine_dir: str):
+        if action == 'delete':
+            os.remove(path)
+        else:
+            dst = os.path.join(quarantine_dir, os.path.relpath(path, self.index.dataset_dir))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.move(path, dst)
+
+
+# ------------------------------
+# ⚙️ User Configuration
+# ------------------------------
+if __name__ == "__main__":
+    dataset_directory = "datasets/human_dataset"
+    drop = False  # True: keep one image per group; False: only report (use the groups in DatasetPreparer)
+
+    deduplicator = ImageDeduplicator(DatasetIndex(dataset_directory), hash_name='phash', max_distance=6)
+    duplicate_groups = deduplicator.find_groups()
+    if drop:
+        deduplicator.drop_duplicates(duplicate_groups, action='quarantine')
@@ -0,0 +1,373 @@
+"""========================================================================================================
+#
+# ==============================================
+# LabelStore packs every YOLO annotation of a dataset into memory-mapped NumPy arrays.
+# Its main capabilities include:
+# 1. Parsing all label (.txt) files once (in a process pool) into a float32 (N, 5) array
+#    [class, x_center, y_center, width, height] plus per-file offsets, written as .npy files.
+# 2. Opening the arrays with mmap, so peak memory stays flat no matter how large the dataset is.
+# 3. Rebuilding incrementally: rows of files whose size and mtime did not change are copied from the
+#    previous store instead of being parsed again (file stats come from DatasetIndex when available).
+# 4. Vectorized class checks, class remapping and statistics, processed in chunks of files,
+#    and writing labels back out as YOLO .txt files.
+#
+# Use Case:
+# Class filtering, dataset checks and statistics on datasets with millions of boxes, without a Python
+# loop over every annotation line on every run.
+# ==============================================
+#
+# ==============================================
+# LabelStore 將資料集中所有 YOLO 標註打包成記憶體映射（mmap）的 NumPy 陣列。
+# 它的主要功能包括：
+# 1. 以行程池一次解析所有標註檔（.txt），存成 float32 (N, 5) 陣列
+#    [類別, x中心, y中心, 寬, 高] 與每個檔案的 offset，寫入 .npy 檔。
+# 2. 以 mmap 開啟陣列，無論資料集多大，記憶體峰值都維持固定。
+# 3. 增量重建：大小與修改時間未變的檔案直接從舊的 store 複製，不重新解析（可由 DatasetIndex 提供檔案資訊）。
+# 4. 以分塊向量化運算進行類別檢查、類別重新編碼與統計，並可將標註寫回 YOLO .txt 檔。
+#
+# 使用情境：
+# 在有數百萬個框的資料集上進行類別篩選、資料檢查與統計，而不需每次都逐行以 Python 解析。
+# ==============================================
+#
+========================================================================================================"""
+
+import json
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from dataset_index import DatasetIndex
+
+STORE_VERSION = 2  # 2: lines with a non-integral or non-finite class id are malformed
+MALFORMED = 1  # flags bit: the file had lines that are not 5 numeric columns or whose class id is not an integer
+#                (those lines are skipped)
+UNREADABLE = 2  # flags bit: the file could not be read
+
+
+class LabelStore:
+    def __init__(self, store_dir: str):
+        """
+        Open an existing store read-only (memory-mapped).
+
+        Args:
+            store_dir: folder written by `LabelStore.build`
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported label store version in '{store_dir}'")
+        self.root = self.meta['root']
+
+        self.labels = self._load('labels.npy')      # float32 (N, 5)
+        self.offsets = self._load('offsets.npy')    # int64 (M + 1,), rows of file i: offsets[i]:offsets[i + 1]
+        self.paths = self._load('paths.npy')        # bytes (M,), sorted relative label paths
+        self.stats = self._load('stats.npy')        # int64 (M, 2), size and mtime_ns when parsed
+        self.flags = self._load('flags.npy')        # uint8 (M,), MALFORMED / UNREADABLE bits
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.store_dir, name), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @property
+    def num_boxes(self) -> int:
+        return len(self.labels)
+
+    # ------------------------------
+    # Building
+    # ------------------------------
+    @classmethod
+    def build(cls, store_dir: str, dataset_dir: Optional[str] = None, index: Optional[DatasetIndex] = None,
+              workers: Optional[int] = None, chunk_size: int = 1024) -> 'LabelStore':
+        """
+        Build (or incrementally rebuild) a store for every label file of a dataset.
+
+        Args:
+            store_dir: output folder for the .npy files
+            dataset_dir: dataset root, scanned recursively for .txt files (not needed with `index`)
+            index: DatasetIndex to take the label list and file stats from (it is refreshed first)
+            workers: process pool size for parsing (None = os.cpu_count())
+            chunk_size: label files per parsing task
+
+        Returns:
+            the opened LabelStore
+        """
+        if index is not None:
+            index.refresh(workers)
+            root = index.dataset_dir
+            entries = index.label_stats()
+        elif dataset_dir is not None:
+            root = os.path.abspath(dataset_dir)
+            entries = _scan_label_stats(root)
+        else:
+            raise ValueError("Either dataset_dir or index is required")
+
+        previous = cls._open_previous(store_dir, root)
+        os.makedirs(store_dir, exist_ok=True)
+        rel_paths = [os.path.relpath(path, root) for path, _, _ in entries]
+        stats = np.array([(size, mtime_ns) for _, size, mtime_ns in entries], dtype=np.int64).reshape(-1, 2)
+
+        # reuse[i] = row of the file in the previous store, or -1 if it must be parsed
+        reuse = np.full(len(rel_paths), -1, dtype=np.int64)
+        if previous is not None and len(previous) and len(rel_paths):
+            keys = np.array([p.encode() for p in rel_paths])
+            width = max(keys.dtype.itemsize, previous.paths.dtype.itemsize)
+            keys, old_paths = keys.astype(f'S{width}'), previous.paths.astype(f'S{width}')
+            pos = np.clip(np.searchsorted(old_paths, keys), 0, len(previous) - 1)
+            same = (old_paths[pos] == keys) & np.all(previous.stats[pos] == stats, axis=1)
+            reuse[same] = pos[same]
+
+        raw_path = os.path.join(store_dir, 'labels.f32.tmp')
+        offsets = np.zeros(len(rel_paths) + 1, dtype=np.int64)
+        flags = np.zeros(len(rel_paths), dtype=np.uint8)
+        chunks = [range(i, min(i + chunk_size, len(rel_paths))) for i in range(0, len(rel_paths), chunk_size)]
+        parse_lists = [[os.path.join(root, rel_paths[i]) for i in chunk if reuse[i] < 0] for chunk in chunks]
+
+        num_rows = 0
+        with open(raw_path, 'wb') as raw, ProcessPoolExecutor(max_workers=workers) as executor:
+            # at most 2 chunks per worker in flight, so parsed chunks never pile up ahead of the writer
+            window = 2 * (workers or os.cpu_count() or 1)
+            for chunk, parsed in zip(chunks, _bounded_map(executor, _parse_label_chunk, parse_lists, window)):
+                parsed = iter(parsed)
+                for i in chunk:
+                    if reuse[i] >= 0:
+                        j = reuse[i]
+                        rows = previous.labels[previous.offsets[j]:previous.offsets[j + 1]]
+                        flags[i] = previous.flags[j]
+                    else:
+                        rows, flags[i] = next(parsed)
+                    raw.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+                    num_rows += len(rows)
+                    offsets[i + 1] = num_rows
+
+        # drop the old memory maps before the files underneath are replaced
+        del previous
+        _raw_to_npy(raw_path, os.path.join(store_dir, 'labels.npy'), (num_rows, 5))
+        width = max((len(p.encode()) for p in rel_paths), default=1)
+        np.save(os.path.join(store_dir, 'paths.npy'), np.array([p.encode() for p in rel_paths], dtype=f'S{width}'))
+        np.save(os.path.join(store_dir, 'offsets.npy'), offsets)
+        np.save(os.path.join(store_dir, 'stats.npy'), stats)
+        np.save(os.path.join(store_dir, 'flags.npy'), flags)
+        with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+            json.dump({'version': STORE_VERSION, 'root': root, 'num_files': len(rel_paths),
+                       'num_boxes': num_rows, 'reused_files': int((reuse >= 0).sum())}, f, indent=2)
+        return cls(store_dir)
+
+    @classmethod
+    def _open_previous(cls, store_dir: str, root: str) -> Optional['LabelStore']:
+        try:
+            store = cls(store_dir)
+        except (OSError, ValueError, KeyError):
+            return None
+        return store if store.root == root else None
+
+    # ------------------------------
+    # Access
+    # ------------------------------
+    def abspath(self, i: int) -> str:
+        return os.path.join(self.root, self.paths[i].decode())
+
+    def find(self, label_path: str) -> int:
+        """Position of a label file in the store, or -1."""
+        key = os.path.relpath(os.path.abspath(label_path), self.root).encode()
+        i = int(np.searchsorted(self.paths, key))
+        return i if i < len(self.paths) and self.paths[i] == key else -1
+
+    def get(self, label_path: str) -> np.ndarray:
+        i = self.find(label_path)
+        if i < 0:
+            raise KeyError(label_path)
+        return self.labels[self.offsets[i]:self.offsets[i + 1]]
+
+    def iter_chunks(self, files_per_chunk: int = 65536) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        Yields (first file index, rows, local offsets) for consecutive groups of files.
+        `rows` is a view into the memory map; local offsets start at 0.
+        """
+        for start in range(0, len(self), files_per_chunk):
+            end = min(start + files_per_chunk, len(self))
+            offsets = np.asarray(self.offsets[start:end + 1])
+            yield start, self.labels[offsets[0]:offsets[-1]], offsets - offsets[0]
+
+    # ------------------------------
+    # Vectorized operations
+    # ------------------------------
+    def boxes_per_file(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def class_counts(self, num_classes: int = 0) -> np.ndarray:
+        """Boxes per class id; rows with a negative or non-finite class id are not counted."""
+        counts = np.zeros(num_classes, dtype=np.int64)
+        for _, rows, _ in self.iter_chunks():
+            classes = rows[:, 0]
+            chunk_counts = np.bincount(classes[classes >= 0].astype(np.int64), minlength=len(counts))
+            if len(chunk_counts) > len(counts):
+                chunk_counts[:len(counts)] += counts
+                counts = chunk_counts
+            else:
+                counts += chunk_counts
+        return counts
+
+    @staticmethod
+    def class_lut(class_remap: Dict[int, int]) -> np.ndarray:
+        """Lookup table old class id -> new class id (-1 = dropped)."""
+        lut = np.full(max(class_remap, default=0) + 1, -1, dtype=np.int64)
+        for class_id, new_id in class_remap.items():
+            lut[class_id] = new_id
+        return lut
+
+    def files_with_classes_outside(self, allowed_class_ids: Sequence[int]) -> np.ndarray:
+        """Boolean per file: True if any box has a class id not in `allowed_class_ids`, or the file is malformed."""
+        bad_files = self.flags != 0
+        allowed = np.asarray(list(allowed_class_ids), dtype=np.int64)
+        for start, rows, offsets in self.iter_chunks():
+            bad_rows = ~np.isin(rows[:, 0].astype(np.int64), allowed)
+            file_of_row = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+            bad_files[start:start + len(offsets) - 1] |= np.bincount(
+                file_of_row[bad_rows], minlength=len(offsets) - 1) > 0
+        return bad_files
+
+    def remap_chunks(self, class_remap: Dict[int, int], files_per_chunk: int = 65536
+                     ) -> Iterator[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Applies a class remap (classes missing from `class_remap` are dropped) chunk by chunk.
+
+        Yields:
+            (first file index, remapped rows, local offsets of the remapped rows, changed mask per file)
+        """
+        lut = self.class_lut(class_remap)
+        for start, rows, offsets in self.iter_chunks(files_per_chunk):
+            old_ids = rows[:, 0].astype(np.int64)
+            in_range = (old_ids >= 0) & (old_ids < len(lut))
+            new_ids = np.where(in_range, lut[np.where(in_range, old_ids, 0)], -1)
+            keep = new_ids >= 0
+            file_of_row = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+            kept_per_file = np.bincount(file_of_row[keep], minlength=len(offsets) - 1)
+            changed_rows = ~keep | (new_ids != old_ids)
+            changed = np.bincount(file_of_row[changed_rows], minlength=len(offsets) - 1) > 0
+
+            new_rows = np.array(rows[keep], dtype=np.float32)
+            new_rows[:, 0] = new_ids[keep]
+            new_offsets = np.concatenate(([0], np.cumsum(kept_per_file)))
+            yield start, new_rows, new_offsets, changed
+
+    def write_txt(self, out_root: Optional[str] = None, mask: Optional[np.ndarray] = None) -> int:
+        """
+        Write labels back out as YOLO .txt files (coordinates with 6 decimals).
+
+        Args:
+            out_root: output root, mirrors the relative paths (None = overwrite the original files)
+            mask: boolean per file, only write these files
+
+        Returns:
+            number of files written
+        """
+        written = 0
+        for start, rows, offsets in self.iter_chunks():
+            for k in range(len(offsets) - 1):
+                i = start + k
+                if mask is not None and not mask[i]:
+                    continue
+                path = self.abspath(i) if out_root is None else os.path.join(out_root, self.paths[i].decode())
+                write_label_rows(path, rows[offsets[k]:offsets[k + 1]])
+                written += 1
+        return written
+
+
+def write_label_rows(path: str, rows: np.ndarray):
+    """Atomically write (n, 5) rows as a YOLO label file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(format_label_rows(rows))
+    os.replace(tmp_path, path)
+
+
+def format_label_rows(rows: np.ndarray) -> str:
+    return ''.join(f"{int(r[0])} {r[1]:.6f} {r[2]:.6f} {r[3]:.6f} {r[4]:.6f}\n" for r in rows.tolist())
+
+
+def _scan_label_stats(root: str) -> List[Tuple[str, int, int]]:
+    entries = []
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.txt'):
+                    st = entry.stat()
+                    entries.append((entry.path, st.st_size, st.st_mtime_ns))
+    entries.sort()
+    return entries
+
+
+def _bounded_map(executor, fn, items: List, window: int) -> Iterator:
+    """executor.map with at most `window` tasks submitted ahead of the consumer, results in order."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _parse_label_chunk(label_paths: List[str]) -> List[Tuple[np.ndarray, int]]:
+    """Pool task: [(float32 (n, 5) rows, flags)] for each label file."""
+    results = []
+    for label_path in label_paths:
+        flags = 0
+        values = []
+        try:
+            with open(label_path, 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    if not parts:
+                        continue
+                    if len(parts) != 5:
+                        flags |= MALFORMED
+                        continue
+                    try:
+                        row = [float(p) for p in parts]
+                    except ValueError:
+                        flags |= MALFORMED
+                        continue
+                    # same rule as DatasetChecker: 0.5, nan or inf is not a class id (int() would truncate it)
+                    if not row[0].is_integer():
+                        flags |= MALFORMED
+                        continue
+                    values.append(row)
+        except OSError:
+            flags |= UNREADABLE
+        results.append((np.array(values, dtype=np.float32).reshape(-1, 5), flags))
+    return results
+
+
+def _raw_to_npy(raw_path: str, npy_path: str, shape: Tuple[int, int]):
+    """Prepend an .npy header to raw float32 data without loading it into memory."""
+    tmp_path = npy_path + '.tmp'
+    with open(tmp_path, 'wb') as out, open(raw_path, 'rb') as raw:
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)), 'fortran_order': False, 'shape': shape}
+        np.lib.format.write_array_header_1_0(out, header)
+        shutil.copyfileobj(raw, out, 16 * 1024 * 1024)
+    os.replace(tmp_path, npy_path)
+    os.remove(raw_path)
+
+
+# ------------------------------
+# ⚙️ User Configuration
+# ------------------------------
+if __name__ == "__main__":
+    dataset_directory = "datasets/human_dataset"
+    store_directory = "datasets/human_dataset_labels"
+
+    store = LabelStore.build(store_directory, index=DatasetIndex(dataset_directory))
+    print(f"Label store: {len(store)} files, {store.num_boxes} boxes, {store.meta['reused_files']} reused")
+    print(f"Instances per class: {store.class_counts().tolist()}")